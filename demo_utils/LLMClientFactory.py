@@ -1,31 +1,370 @@
-from openai import OpenAI
+"""
+OpenAI-compatible clients of the demo pipeline.
+
+The clients of LLMClientFactory spread requests over a pool of endpoints (deployments
+or API keys), listed in the endpoints key of llm_config.json:
+    "endpoints": [
+        {"base_url": "https://a.example.com/v1", "api_key": "...", "weight": 2},
+        {"base_url": "https://b.example.com/v1", "api_key": "...", "weight": 1, "model": "deployment-b"}
+    ]
+Without endpoints, the pool has the single endpoint of base_url and api_key.
+
+Each endpoint keeps one HTTP connection pool with keep-alive (http_max_connections,
+http_max_keepalive_connections, http_keepalive_expiry and http_timeout keys), shared
+by all threads, and one per event loop for the async client. Requests go to the
+healthy endpoints in weighted round-robin order (routing "round_robin") or to the one
+with the fewest requests in flight per weight (routing "least_outstanding"). A request
+failing with a connection error, a timeout, 429, 5xx or an authentication error is
+sent to the next endpoint; after endpoint_failure_threshold failures in a row an
+endpoint is skipped for endpoint_cooldown seconds. When every endpoint failed, the last
+error is raised, so callers keep their own retries (e.g. the async runner's backoff).
+In a pool of several endpoints the endpoint clients don't retry on their own
+(max_retries=0, unless a caller sets it with with_options()), so a failing request
+moves on to the next endpoint at once instead of being retried on the same one. A
+single endpoint keeps the OpenAI client's default retries and backoff.
+
+get_client() and get_async_client() return process-wide clients with the
+chat.completions.create() and with_options() of OpenAI and AsyncOpenAI, with failover.
+Other attributes (e.g. models or embeddings) are those of the client of the first
+healthy endpoint, without failover. The clients are safe to use from several threads
+and event loops. stub_llm_server.py runs local endpoints, including failing ones, to
+check the routing.
+"""
 import json
-from pathlib import Path
+import time
+import asyncio
+import threading
+import weakref
+from types import SimpleNamespace
+
+import openai
+from openai import OpenAI, AsyncOpenAI
+
+# Errors after which a request is sent to another endpoint, and which count against the health of an endpoint
+FAILOVER_ERRORS = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError,
+                   openai.AuthenticationError, openai.PermissionDeniedError)
+
+ROUTINGS = ['round_robin', 'least_outstanding']
+
+# Connection limits class of the HTTP library the openai package is built on, which isn't a requirement of its own
+_Limits = type(openai.DEFAULT_CONNECTION_LIMITS)
+
+
+class Endpoint:
+    """One deployment or API key of the pool, with its HTTP clients and health."""
+
+    def __init__(self, base_url, api_key, weight=1, model=None, name=None):
+        assert weight > 0, f"Weight of endpoint {base_url} must be positive"
+        self.base_url = base_url
+        self.api_key = api_key
+        self.weight = weight
+        self.model = model
+        self.name = name or base_url
+        # Routing and health state, guarded by the lock of the pool
+        self.current_weight = 0
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.unhealthy_until = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.last_error = None
+        # {options key: client}, the clients of all options sharing one connection pool
+        self._clients = {}
+        # {event loop: {options key: client}}, async connections can't be shared across loops
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def client(self, http_settings, options, max_retries=0):
+        """OpenAI client of the endpoint with request options, shared by all threads."""
+        key = repr(sorted(options.items()))
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                if '' not in self._clients:
+                    self._clients[''] = OpenAI(
+                        api_key=self.api_key, base_url=self.base_url, max_retries=max_retries,
+                        timeout=http_settings.get('timeout', openai.DEFAULT_TIMEOUT),
+                        http_client=openai.DefaultHttpxClient(
+                            limits=http_settings.get('limits', openai.DEFAULT_CONNECTION_LIMITS)))
+                client = self._clients[''].with_options(**options) if options else self._clients['']
+                self._clients[key] = client
+            return client
+
+    def async_client(self, http_settings, options, max_retries=0):
+        """AsyncOpenAI client of the endpoint with request options, for the running event loop."""
+        key = repr(sorted(options.items()))
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._async_clients.setdefault(loop, {})
+            client = clients.get(key)
+            if client is None:
+                if '' not in clients:
+                    clients[''] = AsyncOpenAI(
+                        api_key=self.api_key, base_url=self.base_url, max_retries=max_retries,
+                        timeout=http_settings.get('timeout', openai.DEFAULT_TIMEOUT),
+                        http_client=openai.DefaultAsyncHttpxClient(
+                            limits=http_settings.get('limits', openai.DEFAULT_CONNECTION_LIMITS)))
+                client = clients[''].with_options(**options) if options else clients['']
+                clients[key] = client
+            return client
+
+    def close(self):
+        """Close the connections of the clients of the endpoint (clients with options share them)."""
+        with self._lock:
+            client = self._clients.get('')
+            async_clients = [(loop, clients['']) for loop, clients in self._async_clients.items() if '' in clients]
+            self._clients = {}
+            self._async_clients = weakref.WeakKeyDictionary()
+        if client is not None:
+            client.close()
+        for loop, async_client in async_clients:
+            if loop.is_closed():
+                continue
+            if loop.is_running():
+                # E.g. the loop of a notebook: closed once the loop gets to it
+                asyncio.run_coroutine_threadsafe(async_client.close(), loop)
+            else:
+                loop.run_until_complete(async_client.close())
+
+
+class EndpointPool:
+    """
+    Thread-safe routing of requests over endpoints.
+
+    Args:
+        endpoints: Endpoint list
+        routing: 'round_robin' (smooth weighted round robin) or 'least_outstanding'
+        failure_threshold: failures in a row after which an endpoint is skipped
+        cooldown: seconds an unhealthy endpoint is skipped, before it gets requests again
+        http_settings: connection limits ('limits', of the HTTP clients) and 'timeout' (of the OpenAI clients)
+    """
+
+    def __init__(self, endpoints, routing='round_robin', failure_threshold=3, cooldown=30.0, http_settings=None):
+        assert endpoints, "At least one endpoint is needed"
+        assert routing in ROUTINGS, f"Unknown routing {routing}, expected one of {ROUTINGS}"
+        self.endpoints = endpoints
+        self.routing = routing
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.http_settings = http_settings or {}
+        # Retries of the endpoint clients: failover takes their place when there are other endpoints
+        self.max_retries = openai.DEFAULT_MAX_RETRIES if len(endpoints) == 1 else 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        endpoints = config.get('endpoints') or [{'base_url': config['base_url'], 'api_key': config['api_key']}]
+        http_settings = {
+            'limits': _Limits(max_connections=config.get('http_max_connections', 100),
+                              max_keepalive_connections=config.get('http_max_keepalive_connections', 20),
+                              keepalive_expiry=config.get('http_keepalive_expiry', 30.0)),
+            'timeout': openai.Timeout(config.get('http_timeout', 600.0), connect=5.0),
+        }
+        return cls([Endpoint(**endpoint) for endpoint in endpoints], config.get('routing', 'round_robin'),
+                   config.get('endpoint_failure_threshold', 3), config.get('endpoint_cooldown', 30.0), http_settings)
+
+    def acquire(self, exclude=()):
+        """
+        Next endpoint of a request, not in exclude (None if all were tried). Healthy
+        endpoints come first; when all remaining ones are unhealthy, they are tried anyway.
+        """
+        with self._lock:
+            now = time.monotonic()
+            candidates = [endpoint for endpoint in self.endpoints if endpoint not in exclude]
+            if not candidates:
+                return None
+            healthy = [endpoint for endpoint in candidates if endpoint.unhealthy_until <= now]
+            candidates = healthy or candidates
+            if self.routing == 'least_outstanding':
+                # Ties (e.g. no request in flight) go to the endpoint with the fewest requests per weight
+                endpoint = min(candidates, key=lambda endpoint: (endpoint.outstanding / endpoint.weight,
+                                                                 endpoint.requests / endpoint.weight))
+            else:
+                # Smooth weighted round robin: spreads the requests of heavier endpoints evenly
+                total_weight = sum(endpoint.weight for endpoint in candidates)
+                for candidate in candidates:
+                    candidate.current_weight += candidate.weight
+                endpoint = max(candidates, key=lambda endpoint: endpoint.current_weight)
+                endpoint.current_weight -= total_weight
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def primary(self):
+        """First healthy endpoint (the first endpoint if none is), for requests without failover."""
+        with self._lock:
+            now = time.monotonic()
+            return next((endpoint for endpoint in self.endpoints if endpoint.unhealthy_until <= now),
+                        self.endpoints[0])
+
+    def release(self, endpoint, error=None):
+        """Record the outcome of a request to endpoint: error is a failover error, or None."""
+        with self._lock:
+            endpoint.outstanding -= 1
+            if error is None:
+                endpoint.consecutive_failures = 0
+                endpoint.unhealthy_until = 0.0
+                return
+            endpoint.failures += 1
+            endpoint.consecutive_failures += 1
+            endpoint.last_error = f"{type(error).__name__}: {error}"
+            if endpoint.consecutive_failures >= self.failure_threshold:
+                endpoint.unhealthy_until = time.monotonic() + self.cooldown
+
+    def close(self):
+        """Close the connections of all endpoints."""
+        for endpoint in self.endpoints:
+            endpoint.close()
+
+    def stats(self):
+        """Requests, failures, requests in flight and health of every endpoint."""
+        with self._lock:
+            now = time.monotonic()
+            return [{'endpoint': endpoint.name, 'weight': endpoint.weight, 'requests': endpoint.requests,
+                     'failures': endpoint.failures, 'outstanding': endpoint.outstanding,
+                     'healthy': endpoint.unhealthy_until <= now, 'last_error': endpoint.last_error}
+                    for endpoint in self.endpoints]
+
+
+def _request_kwargs(endpoint, kwargs):
+    # Deployments may serve the model under their own name
+    return {**kwargs, 'model': endpoint.model} if endpoint.model else kwargs
+
+
+class _Completions:
+    def __init__(self, pooled_client):
+        self._pooled_client = pooled_client
+
+    def create(self, **kwargs):
+        return self._pooled_client._create(**kwargs)
+
+
+class _AsyncCompletions(_Completions):
+    async def create(self, **kwargs):
+        return await self._pooled_client._create(**kwargs)
+
+
+class PooledClient:
+    """
+    OpenAI-like client sending chat completions to the endpoints of a pool, with failover.
+    Other attributes are those of the client of the pool's first healthy endpoint.
+    """
+
+    _completions_class = _Completions
+
+    def __init__(self, pool, options=None):
+        self.pool = pool
+        self.options = options or {}
+        self.chat = SimpleNamespace(completions=self._completions_class(self))
+
+    def with_options(self, **options):
+        """Client with the given request options (e.g. max_retries, timeout) on every endpoint."""
+        return type(self)(self.pool, {**self.options, **options})
+
+    def __getattr__(self, name):
+        # Only called for attributes PooledClient doesn't have, e.g. models or embeddings
+        if name.startswith('_') or name in ('pool', 'options', 'chat'):
+            raise AttributeError(name)
+        return getattr(self._endpoint_client(self.pool.primary()), name)
+
+    def _endpoint_client(self, endpoint):
+        return endpoint.client(self.pool.http_settings, self.options, self.pool.max_retries)
+
+    def _create(self, **kwargs):
+        tried, last_error = [], None
+        while (endpoint := self.pool.acquire(tried)) is not None:
+            tried.append(endpoint)
+            try:
+                response = self._endpoint_client(endpoint).chat.completions.create(**_request_kwargs(endpoint, kwargs))
+            except FAILOVER_ERRORS as e:
+                self.pool.release(endpoint, e)
+                last_error = e
+                continue
+            except Exception:
+                # Errors of the request itself (e.g. 400) would fail on any endpoint
+                self.pool.release(endpoint)
+                raise
+            self.pool.release(endpoint)
+            return response
+        raise last_error
+
+
+class AsyncPooledClient(PooledClient):
+    """AsyncOpenAI-like counterpart of PooledClient, usable from any event loop."""
+
+    _completions_class = _AsyncCompletions
+
+    def _endpoint_client(self, endpoint):
+        return endpoint.async_client(self.pool.http_settings, self.options, self.pool.max_retries)
+
+    async def _create(self, **kwargs):
+        tried, last_error = [], None
+        while (endpoint := self.pool.acquire(tried)) is not None:
+            tried.append(endpoint)
+            try:
+                response = await self._endpoint_client(endpoint).chat.completions.create(
+                    **_request_kwargs(endpoint, kwargs))
+            except FAILOVER_ERRORS as e:
+                self.pool.release(endpoint, e)
+                last_error = e
+                continue
+            except BaseException:
+                # Errors of the request itself (e.g. 400), or a cancelled task
+                self.pool.release(endpoint)
+                raise
+            self.pool.release(endpoint)
+            return response
+        raise last_error
+
 
 class LLMClientFactory:
     _instance = None
+    _async_instance = None
+    _pool = None
     _config = None
-    
+    _lock = threading.Lock()
+
     def __init__(self, config_path='./llm_config.json'):
         self.config_path = config_path
-    
+
     def load_config(self):
-        if self._config is None:
-            self._config = json.load(open(self.config_path, 'r'))
-        return self._config
-    
+        if LLMClientFactory._config is None:
+            with open(self.config_path, 'r') as f:
+                LLMClientFactory._config = json.load(f)
+        return LLMClientFactory._config
+
+    @classmethod
+    def get_pool(cls, config_path='./llm_config.json'):
+        """EndpointPool shared by the sync and async clients."""
+        with cls._lock:
+            if cls._pool is None:
+                cls._pool = EndpointPool.from_config(cls(config_path).load_config())
+            return cls._pool
+
     @classmethod
     def get_client(cls, config_path='./llm_config.json'):
-        if cls._instance is None:
-            factory = cls(config_path)
-            config = factory.load_config()
-            cls._instance = OpenAI(
-                api_key=config['api_key'],
-                base_url=config['base_url']
-            )
-        return cls._instance
-    
+        pool = cls.get_pool(config_path)
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = PooledClient(pool)
+            return cls._instance
+
+    @classmethod
+    def get_async_client(cls, config_path='./llm_config.json'):
+        pool = cls.get_pool(config_path)
+        with cls._lock:
+            if cls._async_instance is None:
+                cls._async_instance = AsyncPooledClient(pool)
+            return cls._async_instance
+
     @classmethod
     def reset_client(cls):
-        cls._instance = None
-        cls._config = None
\ No newline at end of file
+        """Drop the clients and the pool, closing their connections, so the next clients read the config again."""
+        with cls._lock:
+            pool = cls._pool
+            cls._instance = None
+            cls._async_instance = None
+            cls._pool = None
+            cls._config = None
+        if pool is not None:
+            pool.close()
@@ -0,0 +1,183 @@
+"""
+Local aggregation of the answers of a way, without the final summary request.
+
+analyze_road_sequence, the async runner and batch jobs end every sequence with one more
+LLM request (aggregation_prompt over the whole history) only to consolidate its answers.
+aggregate_predictions() combines the answers of all sequences of a way locally and
+deterministically instead:
+
+1. Each answer is parsed and normalized (see predictions.py) and turned to the direction
+   of the way: :forward and :backward are swapped for photos taken against the way.
+2. Each answer votes for its values with a weight. Later answers of a sequence have seen
+   more of the road (the prompt asks to aggregate across images), so the weight of an
+   answer is recency ** (number of answers after it), times the confidence the answer
+   states, if any ('confidence': 0.8, 80 or high/medium/low). Final summaries vote with
+   summary_weight; by default only for sequences without parsable answers (e.g. the
+   single request of single-shot batch jobs).
+3. The weights of all sequences of the way are summed per tag and value, and the value
+   with the most weight wins (the first one seen among ties).
+4. The tags are made consistent:
+   - on a one-way road (oneway yes or -1), the tags of the travel direction (:forward,
+     or :backward for -1) are folded into lanes, turn:lanes and maxspeed, as in OSM;
+   - lanes and turn:lanes agree: turn:lanes has one entry per lane, so the lane count with
+     the most weight from the votes of both tags is kept (lanes is filled from turn:lanes
+     if needed), with the turn:lanes value of that count with the most weight, if any.
+
+With "aggregation": "local" in llm_config.json, the notebook, the async runner and batch
+jobs in rounds mode skip the summary requests, one request per sequence less, and batch
+jobs write their predictions with aggregate_predictions(). With "llm" (default) the
+summaries are still requested, and both aggregations can be compared with eval.py on the
+same results.
+
+Usage:
+    predictions_df = aggregate_predictions(results)   # {osmid: [{sequence_id: sequence_results}]}
+    predictions_df.to_csv('predictions_local.csv', index=False)
+    python ../evaluation_utils/eval.py predictions_local.csv local
+"""
+import re
+
+import pandas as pd
+
+from predictions import (PREDICTION_COLUMNS, FINAL_OUTPUT_MARKER, parse_final_output, normalize_tags,
+                         invert_direction, majority_direction)
+
+# Values of the "aggregation" key of llm_config.json
+AGGREGATIONS = ['llm', 'local']
+
+DEFAULT_RECENCY = 0.9
+
+CONFIDENCE_WORDS = {'very high': 1.0, 'high': 1.0, 'medium': 0.6, 'moderate': 0.6, 'low': 0.3, 'very low': 0.1}
+
+_CONFIDENCE_PATTERN = re.compile(
+    r"""(['"])confidence\1\s*:\s*['"]?(\d+(?:\.\d+)?|very high|high|medium|moderate|very low|low)""", re.I)
+
+# Pairs of lane count and turn:lanes tags, per direction
+LANE_TAGS = [('lanes', 'turn:lanes'), ('lanes:forward', 'turn:lanes:forward'),
+             ('lanes:backward', 'turn:lanes:backward')]
+
+# Tags with a plain and per-direction variant, folded on one-way roads
+DIRECTIONAL_TAGS = ['lanes', 'turn:lanes', 'maxspeed']
+
+
+def answer_confidence(response):
+    """Confidence stated in the FINAL_OUTPUT dict of an answer, between 0 and 1 (1 if none)."""
+    if not response:
+        return 1.0
+    match = _CONFIDENCE_PATTERN.search(response, max(response.rfind(FINAL_OUTPUT_MARKER), 0))
+    if match is None:
+        return 1.0
+    value = match.group(2).lower()
+    if value in CONFIDENCE_WORDS:
+        return CONFIDENCE_WORDS[value]
+    value = float(value)
+    # Percentages, e.g. 80
+    return min(value / 100 if value > 1 else value, 1.0)
+
+
+def sequence_observations(sequence_results, recency=DEFAULT_RECENCY, summary_weight=None):
+    """
+    (tags, weight) of each parsable answer of a sequence, with tags normalized and in the
+    direction of the way. Summaries weigh summary_weight, or 1 if the sequence has no
+    parsable answers and summary_weight is None.
+    """
+    answers = [result for result in sequence_results if result['sequence_index'] != 'FINAL_SUMMARY']
+    summaries = [result for result in sequence_results if result['sequence_index'] == 'FINAL_SUMMARY']
+    observations = []
+    for i, result in enumerate(answers):
+        tags = parse_final_output(result['response'])
+        if not tags:
+            continue
+        tags = normalize_tags(tags)
+        if not result.get('match_direction', True):
+            tags = invert_direction(tags)
+        weight = recency ** (len(answers) - 1 - i) * answer_confidence(result['response'])
+        observations.append((tags, weight))
+    weight = summary_weight if summary_weight is not None else float(not observations)
+    sequence_direction = majority_direction(answers)
+    for result in summaries:
+        tags = parse_final_output(result['response'])
+        if tags and weight > 0:
+            tags = normalize_tags(tags)
+            observations.append((tags if sequence_direction else invert_direction(tags),
+                                 weight * answer_confidence(result['response'])))
+    return observations
+
+
+def weighted_vote(weights, min_weight=0.0):
+    """Value with the most weight in {value: weight}, the first one among ties, None if below min_weight."""
+    if not weights:
+        return None
+    value, weight = max(weights.items(), key=lambda item: item[1])
+    return value if weight > 0 and weight >= min_weight else None
+
+
+def lane_count(turn_lanes):
+    """Number of lanes of a turn:lanes value ('through|' has two)."""
+    return turn_lanes.count('|') + 1
+
+
+def consistent_lanes(lanes_weights, turn_lanes_weights, min_weight=0.0):
+    """
+    Lane count and turn:lanes that agree: the count with the most weight from the votes of
+    both tags, and the turn:lanes value of that count with the most weight.
+    """
+    count_weights = {}
+    for value, weight in lanes_weights.items():
+        count_weights[int(value)] = count_weights.get(int(value), 0) + weight
+    for value, weight in turn_lanes_weights.items():
+        count_weights[lane_count(value)] = count_weights.get(lane_count(value), 0) + weight
+    count = weighted_vote(count_weights, min_weight)
+    if count is None:
+        return None, None
+    turn_lanes = weighted_vote({value: weight for value, weight in turn_lanes_weights.items()
+                                if lane_count(value) == count})
+    return str(count), turn_lanes
+
+
+def fold_oneway(votes, oneway):
+    """Votes with the tags of the travel direction of a one-way road folded into the plain tags."""
+    travel, opposite = (':backward', ':forward') if oneway == '-1' else (':forward', ':backward')
+    for tag in DIRECTIONAL_TAGS:
+        weights = votes.setdefault(tag, {})
+        for value, weight in votes.pop(tag + travel, {}).items():
+            weights[value] = weights.get(value, 0) + weight
+        votes.pop(tag + opposite, None)
+    return votes
+
+
+def aggregate_way(way_results, recency=DEFAULT_RECENCY, summary_weight=None, min_weight=0.0):
+    """Consistent tags of a way from the answers of all its sequences ([{sequence_id: sequence_results}])."""
+    votes = {}
+    for sequence in way_results:
+        for sequence_results in sequence.values():
+            for tags, weight in sequence_observations(sequence_results, recency, summary_weight):
+                for tag, value in tags.items():
+                    weights = votes.setdefault(tag, {})
+                    weights[value] = weights.get(value, 0) + weight
+    tags = {}
+    oneway = weighted_vote(votes.pop('oneway', {}), min_weight)
+    if oneway is not None:
+        tags['oneway'] = oneway
+    if oneway in ('yes', '-1'):
+        votes = fold_oneway(votes, oneway)
+    for lanes_tag, turn_lanes_tag in LANE_TAGS:
+        lanes, turn_lanes = consistent_lanes(votes.pop(lanes_tag, {}), votes.pop(turn_lanes_tag, {}), min_weight)
+        if lanes is not None:
+            tags[lanes_tag] = lanes
+        if turn_lanes is not None:
+            tags[turn_lanes_tag] = turn_lanes
+    for tag, weights in votes.items():
+        value = weighted_vote(weights, min_weight)
+        if value is not None:
+            tags[tag] = value
+    return tags
+
+
+def aggregate_predictions(results, recency=DEFAULT_RECENCY, summary_weight=None, min_weight=0.0):
+    """
+    Predictions dataframe (PREDICTION_COLUMNS) of the results of many ways, like
+    results_to_predictions() but aggregating all answers locally (see the module docstring).
+    """
+    rows = [{'osmid': osmid, **aggregate_way(way_results, recency, summary_weight, min_weight)}
+            for osmid, way_results in results.items()]
+    return pd.DataFrame(rows, columns=PREDICTION_COLUMNS)
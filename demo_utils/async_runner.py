@@ -0,0 +1,357 @@
+"""
+Concurrent version of analyze_road_sequence (demo_notebook.ipynb) for many ways.
+
+Sequences of all requested ways are processed concurrently on an asyncio event loop with
+the async client of LLMClientFactory. Within a sequence images are still sent one after
+another, since every request carries the conversation history of the previous ones.
+Requests are throttled to a requests-per-second and a tokens-per-minute limit, and
+requests failing with 429, 5xx or connection errors are retried with exponential backoff.
+
+Usage (in a notebook, where an event loop is already running):
+    runner = AsyncRoadSequenceRunner(LLM_CONFIG)
+    results = await runner.analyze_ways(ways_df, photos_df, osmids, load_and_resize_image, get_front_view)
+"""
+import asyncio
+import random
+import time
+from collections import Counter
+
+import openai
+import pandas as pd
+from openai import NotGiven
+
+from LLMClientFactory import LLMClientFactory
+from llm_utils import estimate_tokens
+from response_cache import request_key
+from image_encoder import ImageEncoder
+from keyframes import KeyframeSelector
+from conversation_context import get_context
+from telemetry import Telemetry, telemetry_scope, message_bytes, usage_fields
+from aggregation import AGGREGATIONS
+
+# Errors worth retrying: rate limits (429), server errors (5xx), timeouts and connection errors
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError)
+
+
+def get_retry_delay(error, attempt, backoff):
+    """Seconds to wait before retrying: the server's Retry-After if given, else exponential backoff with jitter."""
+    response = getattr(error, 'response', None)
+    if response is not None:
+        try:
+            return float(response.headers.get('retry-after'))
+        except (TypeError, ValueError):
+            pass
+    return backoff * 2 ** attempt * random.uniform(0.5, 1)
+
+
+class RateLimiter:
+    """
+    Requests-per-second and tokens-per-minute limits shared by all requests of a runner.
+
+    Every request reserves a start time when it is issued: after the previous request's
+    slot, and once the token budget of the last minute allows its estimated tokens
+    (a token bucket holding up to a minute of tokens). Reservations are made without
+    awaiting, so they don't need a lock and the limiter works on any event loop.
+    Limits set to None are not enforced.
+    """
+
+    def __init__(self, requests_per_second=None, tokens_per_minute=None):
+        self.requests_per_second = requests_per_second
+        self.tokens_per_minute = tokens_per_minute
+        self._next_request = 0.0
+        # Time at which the token bucket is full again
+        self._tokens_full_at = 0.0
+
+    async def acquire(self, tokens=0):
+        """Wait until a request of the given estimated tokens can be sent."""
+        now = time.monotonic()
+        start = now
+        if self.tokens_per_minute:
+            # Requests larger than the bucket wait for a full bucket
+            cost = min(tokens, self.tokens_per_minute) * 60 / self.tokens_per_minute
+            self._tokens_full_at = max(self._tokens_full_at, now) + cost
+            start = max(start, self._tokens_full_at - 60)
+        if self.requests_per_second:
+            start = max(start, self._next_request)
+            self._next_request = start + 1 / self.requests_per_second
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    def refund(self, tokens):
+        """Return reserved tokens that were not used (negative to charge tokens used beyond the estimate)."""
+        if self.tokens_per_minute:
+            self._tokens_full_at -= tokens * 60 / self.tokens_per_minute
+
+
+class AsyncRoadSequenceRunner:
+    """
+    Analyze the image sequences of many ways concurrently.
+
+    Args:
+        config: LLM config (llm_config.json). The optional keys max_concurrency,
+            requests_per_second, tokens_per_minute, max_retries, max_keyframes and
+            context_window set the defaults of the arguments with the same names.
+        client: AsyncOpenAI-compatible client, defaults to LLMClientFactory.get_async_client()
+        max_concurrency: number of sequences processed at the same time (each has at most
+            one request and one image in flight)
+        requests_per_second, tokens_per_minute: rate limits, None for no limit
+        max_retries: retries of a request failing with a retryable error
+        backoff: base delay in seconds of the exponential backoff
+        cache: optional ResponseCache, cached requests are not sent again
+        image_encoder: ImageEncoder of the images, defaults to ImageEncoder.from_config(config)
+        max_keyframes: keyframes sent per sequence (see keyframes.py), None to send all photos
+        keyframe_images: also use the difference of the front views to pick keyframes,
+            which loads every photo of the sequences
+        context_window: keep a bounded context of the tag estimate and this many recent
+            answers (see conversation_context.py), None to replay the whole history
+        telemetry: Telemetry recording the stages and requests of the run (see
+            telemetry.py), defaults to Telemetry.from_config(config)
+        aggregation: 'llm' to end every sequence with the final summary request, 'local' to
+            skip it and aggregate the answers with aggregate_predictions (see aggregation.py)
+    """
+
+    def __init__(self, config, client=None, max_concurrency=None, requests_per_second=None, tokens_per_minute=None,
+                 max_retries=None, backoff=1.0, verbose=False, cache=None, image_encoder=None, max_keyframes=None,
+                 keyframe_images=True, context_window=None, telemetry=None, aggregation=None):
+        self.config = config
+        self.cache = cache
+        self.image_encoder = image_encoder if image_encoder is not None else ImageEncoder.from_config(config)
+        if client is None:
+            client = LLMClientFactory.get_async_client()
+        # Retries are handled here, with the rate limiter
+        self.client = client.with_options(max_retries=0)
+        self.max_concurrency = max_concurrency or config.get('max_concurrency') or 8
+        self.max_retries = max_retries if max_retries is not None else config.get('max_retries', 5)
+        self.backoff = backoff
+        self.verbose = verbose
+        self.limiter = RateLimiter(requests_per_second or config.get('requests_per_second'),
+                                   tokens_per_minute or config.get('tokens_per_minute'))
+        self.max_keyframes = max_keyframes or config.get('max_keyframes')
+        self.keyframe_images = keyframe_images
+        self.context_window = context_window if context_window is not None else config.get('context_window')
+        self.telemetry = telemetry if telemetry is not None else Telemetry.from_config(config)
+        self.aggregation = aggregation or config.get('aggregation', 'llm')
+        assert self.aggregation in AGGREGATIONS, f"Unknown aggregation {self.aggregation}, expected {AGGREGATIONS}"
+        # Photos and calls of every analyzed sequence, see calls_summary
+        self.call_log = []
+        # Estimated and used tokens and latency of every request, see requests_summary
+        self.request_log = []
+        # Failed requests and images (stage and error), reported by run; also in the telemetry
+        self.error_log = []
+
+    async def call_api(self, messages, stage='api'):
+        """Async counterpart of call_api: the response text, or None if the request failed."""
+        call_start = time.perf_counter()
+        if self.cache is not None:
+            key = request_key(messages, self.config)
+            cached_response = self.cache.get(key)
+            if cached_response is not None:
+                self.telemetry.record(stage, duration=time.perf_counter() - call_start, cached=True)
+                return cached_response
+        estimated_tokens = estimate_tokens(messages, self.config['max_tokens'])
+        payload_bytes = message_bytes(messages)
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire(estimated_tokens)
+            start = time.monotonic()
+            try:
+                response = await self.client.chat.completions.create(
+                    model=self.config['model'],
+                    messages=messages,
+                    max_tokens=self.config['max_tokens'],
+                    temperature=self.config['temperature'],
+                    response_format={'type': 'json_object'} if self.config['return_json'] else NotGiven(),
+                )
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    self.error_log.append({'stage': stage, 'error': f"{type(e).__name__}: {e}"})
+                    self.telemetry.record(stage, duration=time.perf_counter() - call_start, attempts=attempt + 1,
+                                          payload_bytes=payload_bytes, error=f"{type(e).__name__}: {e}")
+                    return None
+                await asyncio.sleep(get_retry_delay(e, attempt, self.backoff))
+                continue
+            except Exception as e:
+                self.error_log.append({'stage': stage, 'error': f"{type(e).__name__}: {e}"})
+                self.telemetry.record(stage, duration=time.perf_counter() - call_start, attempts=attempt + 1,
+                                      payload_bytes=payload_bytes, error=f"{type(e).__name__}: {e}")
+                return None
+            usage = response.usage
+            if usage is not None:
+                self.limiter.refund(estimated_tokens - usage.total_tokens)
+            self.request_log.append({
+                'estimated_prompt_tokens': estimated_tokens - self.config['max_tokens'],
+                'prompt_tokens': usage.prompt_tokens if usage is not None else None,
+                'completion_tokens': usage.completion_tokens if usage is not None else None,
+                'latency': time.monotonic() - start,
+            })
+            # Duration of the whole call, including rate limiting and retries
+            self.telemetry.record(stage, duration=time.perf_counter() - call_start, attempts=attempt + 1,
+                                  payload_bytes=payload_bytes, **usage_fields(response))
+            content = response.choices[0].message.content
+            if self.cache is not None and content:
+                self.cache.put(key, content)
+            return content
+
+    def _get_image_messages(self, sequence_id, sequence_index, context, load_and_resize_image, get_front_view):
+        # Loading, cropping and encoding an image is blocking work, run in a thread.
+        # Photos already encoded are not loaded again.
+        loading = []
+
+        def load_front_view():
+            start = time.perf_counter()
+            with self.telemetry.stage('load'):
+                image = load_and_resize_image(sequence_id, sequence_index)
+            with self.telemetry.stage('crop'):
+                front_view = get_front_view(image)
+            loading.append(time.perf_counter() - start)
+            return front_view
+
+        start = time.perf_counter()
+        image_url = self.image_encoder.photo_url(sequence_id, sequence_index, load_front_view)
+        # Encoding time only, without the loading and cropping of a cache miss
+        self.telemetry.record('encode', duration=time.perf_counter() - start - sum(loading),
+                              payload_bytes=len(image_url), cached=not loading)
+        return context.image_messages([image_url])
+
+    async def analyze_sequence(self, sequence_id, sequence_indexes, match_directions, load_and_resize_image,
+                               get_front_view):
+        """
+        Analyze the images of one sequence in order, then ask for the final summary
+        (unless the aggregation is local).
+        Returns the sequence results in the format of analyze_road_sequence.
+        """
+        context = get_context(self.config, self.context_window)
+        sequence_results = []
+
+        for sequence_index in sequence_indexes:
+            try:
+                with telemetry_scope(sequence_index=int(sequence_index)):
+                    messages = await asyncio.to_thread(self._get_image_messages, sequence_id, sequence_index, context,
+                                                       load_and_resize_image, get_front_view)
+                    response = await self.call_api(messages)
+
+                if response:
+                    if self.verbose:
+                        print(f"  {sequence_id} image {sequence_index}: {response}")
+                    sequence_results.append({
+                        'sequence_index': sequence_index,
+                        'match_direction': match_directions[(sequence_id, sequence_index)],
+                        'response': response
+                    })
+                    context.update(messages, response)
+                elif self.verbose:
+                    print(f"  {sequence_id} image {sequence_index}: Failed to get response")
+
+            except Exception as e:
+                self.error_log.append({'stage': 'image', 'error': f"{type(e).__name__}: {e}"})
+                if self.verbose:
+                    print(f"  Error processing image {sequence_index} of sequence {sequence_id}: {e}")
+                continue
+
+        # Get final summary for the sequence
+        if context.has_observations and self.aggregation == 'llm':
+            final_messages = context.summary_messages(self.config['aggregation_prompt'])
+            final_response = await self.call_api(final_messages, stage='aggregation')
+            if final_response:
+                sequence_results.append({
+                    'sequence_index': 'FINAL_SUMMARY',
+                    'response': final_response
+                })
+                if self.verbose:
+                    print(f"  {sequence_id} final summary: {final_response}")
+
+        return sequence_results
+
+    async def analyze_way_sequence(self, osmid, sequence_id, sequence_indexes, match_directions, load_and_resize_image,
+                                   get_front_view, selector=None):
+        """
+        Analyze a sequence of a way: its keyframes picked by a KeyframeSelector, else all its
+        photos. Its calls are recorded in call_log. Returns the keyframes and the sequence results.
+        """
+        def load_front_view(sequence_id, sequence_index):
+            return get_front_view(load_and_resize_image(sequence_id, sequence_index))
+
+        with telemetry_scope(osmid=int(osmid), sequence_id=int(sequence_id)):
+            keyframes = sequence_indexes
+            if selector is not None:
+                keyframes = await asyncio.to_thread(selector.select, sequence_id, sequence_indexes,
+                                                    load_front_view if self.keyframe_images else None)
+            sequence_results = await self.analyze_sequence(sequence_id, keyframes, match_directions,
+                                                           load_and_resize_image, get_front_view)
+            # One call per keyframe, and the final summary once any of them succeeded
+            summary_calls = int(self.aggregation == 'llm' and
+                                any(result['sequence_index'] != 'FINAL_SUMMARY' for result in sequence_results))
+            self.call_log.append({'osmid': osmid, 'sequence_id': sequence_id, 'frames': len(sequence_indexes),
+                                  'keyframes': len(keyframes), 'calls': len(keyframes) + summary_calls})
+            return keyframes, sequence_results
+
+    async def analyze_ways(self, ways_df, photos_df, osmids, load_and_resize_image, get_front_view):
+        """
+        Analyze all sequences of the given ways concurrently.
+
+        Returns {osmid: [{sequence_id: sequence_results}, ...]} like analyze_road_sequence,
+        with the sequences of each way in the order of ways.csv. With max_keyframes, only
+        the keyframes of each sequence are analyzed.
+        """
+        match_directions = photos_df.set_index(['sequence_id', 'sequence_index'])['match_forward']
+        assert match_directions.index.is_unique, "Duplicate photos in photos.csv"
+        match_directions = match_directions.to_dict()
+        sequences_by_osmid = ways_df.set_index('osmid')['sequences']
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        selector = KeyframeSelector(photos_df, self.max_keyframes) if self.max_keyframes else None
+
+        async def analyze(osmid, sequence_id, sequence_indexes):
+            async with semaphore:
+                _, sequence_results = await self.analyze_way_sequence(osmid, sequence_id, sequence_indexes,
+                                                                      match_directions, load_and_resize_image,
+                                                                      get_front_view, selector)
+                return sequence_results
+
+        way_sequences = [(osmid, sequence_id, sequence_indexes) for osmid in osmids
+                         for sequence_id, sequence_indexes in sequences_by_osmid[osmid].items()]
+        sequence_results = await asyncio.gather(*[analyze(osmid, sequence_id, sequence_indexes)
+                                                  for osmid, sequence_id, sequence_indexes in way_sequences])
+
+        self.telemetry.flush()
+        results = {osmid: [] for osmid in osmids}
+        for (osmid, sequence_id, _), sequence_result in zip(way_sequences, sequence_results):
+            results[osmid].append({sequence_id: sequence_result})
+        return results
+
+    def calls_summary(self):
+        """
+        Photos and LLM calls per way of the sequences analyzed so far: osmid, sequences,
+        frames, keyframes and calls. Saved as CSV, it can be passed to eval.py --calls.
+        """
+        columns = ['osmid', 'sequence_id', 'frames', 'keyframes', 'calls']
+        call_log_df = pd.DataFrame(self.call_log, columns=columns)
+        return call_log_df.groupby('osmid', sort=False).agg(
+            sequences=('sequence_id', 'size'), frames=('frames', 'sum'), keyframes=('keyframes', 'sum'),
+            calls=('calls', 'sum')).reset_index()
+
+    def requests_summary(self):
+        """
+        Requests sent so far (cache hits excluded): their number, mean and maximum prompt
+        tokens (as reported by the API, and as estimated), mean completion tokens, and
+        mean and 95th percentile latency in seconds.
+        """
+        request_log_df = pd.DataFrame(self.request_log, columns=['estimated_prompt_tokens', 'prompt_tokens',
+                                                                 'completion_tokens', 'latency'], dtype=float)
+        summary = {
+            'mean_prompt_tokens': request_log_df['prompt_tokens'].mean(),
+            'max_prompt_tokens': request_log_df['prompt_tokens'].max(),
+            'mean_estimated_prompt_tokens': request_log_df['estimated_prompt_tokens'].mean(),
+            'max_estimated_prompt_tokens': request_log_df['estimated_prompt_tokens'].max(),
+            'mean_completion_tokens': request_log_df['completion_tokens'].mean(),
+            'mean_latency': request_log_df['latency'].mean(),
+            'p95_latency': request_log_df['latency'].quantile(0.95),
+        }
+        return {'requests': len(request_log_df), **{name: float(value) for name, value in summary.items()}}
+
+    def run(self, ways_df, photos_df, osmids, load_and_resize_image, get_front_view):
+        """Blocking analyze_ways, for scripts (use await analyze_ways in notebooks). Prints the failures of the run."""
+        errors = len(self.error_log)
+        results = asyncio.run(self.analyze_ways(ways_df, photos_df, osmids, load_and_resize_image, get_front_view))
+        for (stage, error), count in Counter((failure['stage'], failure['error'])
+                                             for failure in self.error_log[errors:]).most_common():
+            print(f"{stage} failed {count} times: {error}")
+        return results
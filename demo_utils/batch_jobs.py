@@ -0,0 +1,327 @@
+"""
+Offline batch-job mode of the demo pipeline.
+
+Instead of synchronous requests, BatchJob writes the requests of many ways to JSONL
+files in the format of the OpenAI batch API (custom_id, method, url, body), and ingests
+the result JSONL files the provider returns. Two modes:
+
+- 'rounds': the images of a sequence are still analyzed one after another, with the
+  conversation context of the earlier answers (see conversation_context.py). Round k
+  holds the k-th image request of every sequence, and the round after the last image
+  holds the final summary requests (the aggregation step), unless the "aggregation" of
+  the config is 'local' (see aggregation.py).
+- 'single_shot': one request per sequence with all its keyframes in driving order and
+  the prompt and aggregation prompt together, so a single round is enough.
+
+The state of a job (keyframes, answers and the step of every sequence) is saved in its
+directory after every ingest, so rounds can be submitted hours apart or resumed after a
+restart. When all sequences are done, write_predictions() writes a predictions CSV in
+the schema of metadata/predictions_*.csv.
+
+fake_batch_processor() turns a request file into a result file locally, for tests.
+
+Usage:
+    python batch_jobs.py prepare path/to/job_dir [--mode rounds] [--store path/to/tile_store] [--osmids ...]
+    python batch_jobs.py ingest path/to/job_dir path/to/results.jsonl
+"""
+import os
+import sys
+import json
+import argparse
+
+import cv2
+
+from image_encoder import ImageEncoder
+from keyframes import KeyframeSelector
+from conversation_context import get_context
+from llm_utils import get_llm_prompt
+from predictions import results_to_predictions
+from aggregation import AGGREGATIONS, aggregate_predictions
+from tile_store import TileStore, crop_front_view, PHOTOS_DIR
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'evaluation_utils'))
+from metadata_cache import load_metadata  # noqa: E402
+
+MODES = ['rounds', 'single_shot']
+BATCH_URL = '/v1/chat/completions'
+
+# Limits of a batch input file of the OpenAI batch API, with some margin
+MAX_FILE_BYTES = 190 * 2 ** 20
+MAX_FILE_REQUESTS = 50000
+
+# Placeholder image when re-building a context from stored answers (the history only keeps text)
+PLACEHOLDER_IMAGE_URL = 'data:image/png;base64,'
+
+
+def batch_request(custom_id, messages, config):
+    """One line of a batch input file: a chat completion request with the model parameters of config."""
+    body = {
+        'model': config['model'],
+        'messages': messages,
+        'max_tokens': config['max_tokens'],
+        'temperature': config['temperature'],
+    }
+    if config['return_json']:
+        body['response_format'] = {'type': 'json_object'}
+    return {'custom_id': custom_id, 'method': 'POST', 'url': BATCH_URL, 'body': body}
+
+
+def read_batch_results(results_path):
+    """{custom_id: response text, or None if the request failed} of a batch result file."""
+    results = {}
+    with open(results_path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            response = result.get('response') or {}
+            content = None
+            if not result.get('error') and response.get('status_code') == 200:
+                content = response['body']['choices'][0]['message']['content']
+            results[result['custom_id']] = content
+    return results
+
+
+def fake_batch_processor(requests_path, results_path, respond):
+    """
+    Local stand-in for the batch endpoint: answers every request of requests_path with
+    respond(body) (the response text, or None to report an error) in results_path.
+    """
+    with open(requests_path) as requests_file, open(results_path, 'w') as results_file:
+        for i, line in enumerate(requests_file):
+            request = json.loads(line)
+            content = respond(request['body'])
+            result = {'id': f'batch_req_{i}', 'custom_id': request['custom_id'], 'response': None, 'error': None}
+            if content is None:
+                result['error'] = {'code': 'server_error', 'message': 'Fake batch error'}
+            else:
+                result['response'] = {'status_code': 200, 'request_id': f'req_{i}', 'body': {
+                    'object': 'chat.completion', 'model': request['body']['model'],
+                    'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content},
+                                 'finish_reason': 'stop'}],
+                }}
+            results_file.write(json.dumps(result) + '\n')
+
+
+class BatchJob:
+    """
+    Batch job over the sequences of ways, with its state in job_dir.
+
+    Args:
+        job_dir: directory of the state, request and result files of the job
+        config: LLM config (llm_config.json), including the image_*, max_keyframes and
+            context_window keys
+        load_front_view: load_front_view(sequence_id, sequence_index) returns the RGB front view of a photo
+        image_encoder: ImageEncoder of the images, defaults to ImageEncoder.from_config(config)
+    """
+
+    def __init__(self, job_dir, config, load_front_view, image_encoder=None):
+        self.job_dir = job_dir
+        self.config = config
+        self.load_front_view = load_front_view
+        self.image_encoder = image_encoder if image_encoder is not None else ImageEncoder.from_config(config)
+        self.state_path = os.path.join(job_dir, 'state.json')
+        self.state = None
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                self.state = json.load(f)
+
+    def create(self, ways_df, photos_df, osmids=None, mode='rounds'):
+        """Set up the sequences of the given ways (all ways of ways_df by default), selecting their keyframes."""
+        assert mode in MODES, f"Unknown mode {mode}, expected one of {MODES}"
+        assert self.state is None, f"A batch job already exists in {self.job_dir}"
+        os.makedirs(self.job_dir, exist_ok=True)
+        if osmids is None:
+            osmids = ways_df['osmid'].tolist()
+        sequences_by_osmid = ways_df.set_index('osmid')['sequences']
+        match_directions = photos_df.set_index(['sequence_id', 'sequence_index'])['match_forward'].to_dict()
+        selector = KeyframeSelector(photos_df, self.config.get('max_keyframes'))
+        sequences = {}
+        for osmid in osmids:
+            for sequence_id, sequence_indexes in sequences_by_osmid[osmid].items():
+                keyframes = [int(sequence_index) for sequence_index in selector.select(sequence_id, sequence_indexes)]
+                sequences[f'{osmid}:{sequence_id}'] = {
+                    'osmid': int(osmid),
+                    'sequence_id': int(sequence_id),
+                    'keyframes': keyframes,
+                    'match_directions': [bool(match_directions[(sequence_id, index)]) for index in keyframes],
+                    'step': 0,
+                    'answers': [None] * len(keyframes),
+                    'summary': None,
+                }
+        aggregation = self.config.get('aggregation', 'llm')
+        assert aggregation in AGGREGATIONS, f"Unknown aggregation {aggregation}, expected one of {AGGREGATIONS}"
+        self.state = {'mode': mode, 'aggregation': aggregation, 'round': 0, 'sequences': sequences}
+        self.save()
+
+    def save(self):
+        # Write then rename, so an interrupted save doesn't lose the previous state
+        with open(self.state_path + '.tmp', 'w') as f:
+            json.dump(self.state, f)
+        os.replace(self.state_path + '.tmp', self.state_path)
+
+    @property
+    def done(self):
+        return all(self._next_step(sequence) is None for sequence in self.state['sequences'].values())
+
+    def _next_step(self, sequence):
+        # Index of the next image, 'summary', or None when the sequence is done
+        if self.state['mode'] == 'single_shot':
+            return 'summary' if sequence['step'] == 0 else None
+        if sequence['step'] < len(sequence['keyframes']):
+            return sequence['step']
+        if (sequence['step'] == len(sequence['keyframes']) and any(sequence['answers']) and
+                self.state.get('aggregation', 'llm') == 'llm'):
+            return 'summary'
+        return None
+
+    def _context(self, sequence):
+        # Conversation context of the answers received so far, re-built from the stored answers
+        context = get_context(self.config, self.config.get('context_window'))
+        for answer in sequence['answers'][:sequence['step']]:
+            messages = context.image_messages([PLACEHOLDER_IMAGE_URL])
+            if answer is not None:
+                context.update(messages, answer)
+        return context
+
+    def _image_url(self, sequence, step):
+        sequence_id, sequence_index = sequence['sequence_id'], sequence['keyframes'][step]
+        return self.image_encoder.photo_url(sequence_id, sequence_index,
+                                            lambda: self.load_front_view(sequence_id, sequence_index))
+
+    def _request_messages(self, sequence, step):
+        if self.state['mode'] == 'single_shot':
+            images = [self._image_url(sequence, i) for i in range(len(sequence['keyframes']))]
+            # Tags are answered in the driving direction, predictions.py inverts them by match direction
+            prompt_text = (f"The {len(images)} images below were taken in driving order along the road segment.\n\n"
+                           f"{self.config['prompt']}\n\n{self.config['aggregation_prompt']}")
+            return get_llm_prompt(prompt_text=prompt_text, images=images, first_step=True,
+                                  job_description=self.config['job_description'])
+        context = self._context(sequence)
+        if step == 'summary':
+            return context.summary_messages(self.config['aggregation_prompt'])
+        return context.image_messages([self._image_url(sequence, step)])
+
+    def write_round(self):
+        """
+        Write the pending request of every sequence to requests_round_{n}_{part}.jsonl
+        files, split to stay within the limits of a batch file. Returns their paths (none
+        when the job is done).
+        """
+        pending = [(key, sequence, self._next_step(sequence)) for key, sequence in self.state['sequences'].items()]
+        pending = [(key, sequence, step) for key, sequence, step in pending if step is not None]
+        if not pending:
+            return []
+        self.state['round'] += 1
+        paths, requests_file, file_bytes, file_requests = [], None, 0, 0
+        for key, sequence, step in pending:
+            line = json.dumps(batch_request(f'{key}:{step}', self._request_messages(sequence, step), self.config))
+            line_bytes = len(line) + 1
+            if requests_file is None or file_bytes + line_bytes > MAX_FILE_BYTES or file_requests == MAX_FILE_REQUESTS:
+                if requests_file is not None:
+                    requests_file.close()
+                paths.append(os.path.join(self.job_dir, f"requests_round_{self.state['round']}_{len(paths) + 1}.jsonl"))
+                requests_file = open(paths[-1], 'w')
+                file_bytes, file_requests = 0, 0
+            requests_file.write(line + '\n')
+            file_bytes += line_bytes
+            file_requests += 1
+        requests_file.close()
+        self.save()
+        print(f"Round {self.state['round']}: {len(pending)} requests in {len(paths)} file(s)")
+        return paths
+
+    def ingest(self, results_path):
+        """
+        Record the answers of a result file and advance their sequences. Failed requests
+        are skipped like in analyze_road_sequence (a failed final summary leaves the
+        sequence without one). Returns the number of answers and of failed requests.
+        """
+        answers, failures = 0, 0
+        for custom_id, content in read_batch_results(results_path).items():
+            key, step = custom_id.rsplit(':', 1)
+            sequence = self.state['sequences'][key]
+            if str(self._next_step(sequence)) != step:
+                # Already ingested, e.g. the same file ingested twice
+                continue
+            if step == 'summary':
+                sequence['summary'] = content
+                sequence['step'] = len(sequence['keyframes']) + 1
+            else:
+                sequence['answers'][int(step)] = content
+                sequence['step'] += 1
+            answers += content is not None
+            failures += content is None
+        self.save()
+        print(f"Ingested {answers} answers and {failures} failed requests from {results_path}")
+        return answers, failures
+
+    def results(self):
+        """Results of the job so far, in the format of analyze_road_sequence: {osmid: [{sequence_id: sequence_results}]}."""
+        results = {}
+        for sequence in self.state['sequences'].values():
+            sequence_results = [
+                {'sequence_index': sequence_index, 'match_direction': match_direction, 'response': answer}
+                for sequence_index, match_direction, answer
+                in zip(sequence['keyframes'], sequence['match_directions'], sequence['answers']) if answer is not None
+            ]
+            if sequence['summary'] is not None:
+                sequence_results.append({'sequence_index': 'FINAL_SUMMARY', 'response': sequence['summary']})
+            results.setdefault(sequence['osmid'], []).append({sequence['sequence_id']: sequence_results})
+        return results
+
+    def write_predictions(self, path=None):
+        """
+        Write the predictions of the job to path (predictions.csv in the job directory by
+        default), aggregated locally if the aggregation of the job is 'local'.
+        """
+        if path is None:
+            path = os.path.join(self.job_dir, 'predictions.csv')
+        if self.state.get('aggregation', 'llm') == 'local':
+            predictions_df = aggregate_predictions(self.results())
+        else:
+            predictions_df = results_to_predictions(self.results())
+        predictions_df.to_csv(path, index=False)
+        print(f"Predictions saved to {path}")
+        return path
+
+
+def get_front_view_loader(store_dir=None, photos_dir=PHOTOS_DIR):
+    """load_front_view of a tile store if given, else cropping the photos in photos_dir."""
+    if store_dir is not None:
+        return TileStore(store_dir).get
+
+    def load_front_view(sequence_id, sequence_index):
+        image = cv2.imread(os.path.join(photos_dir, f"{sequence_id}_{sequence_index}.png"))
+        assert image is not None, f"Photo {sequence_id}_{sequence_index} not found in {photos_dir}"
+        return crop_front_view(image)
+    return load_front_view
+
+
+if __name__ == "__main__":
+    metadata_dir = os.path.join(os.path.dirname(PHOTOS_DIR), 'metadata')
+    parser = argparse.ArgumentParser(description="Prepare and ingest batch jobs of the demo pipeline.")
+    parser.add_argument("command", choices=['prepare', 'ingest'])
+    parser.add_argument("job_dir", type=str, help="Directory of the batch job.")
+    parser.add_argument("results_path", type=str, nargs='?', help="Result JSONL file to ingest.", default=None)
+    parser.add_argument("--mode", choices=MODES, help="Request mode of a new job (defaults to rounds).", default='rounds')
+    parser.add_argument("--config", type=str, help="LLM config (defaults to llm_config.json).",
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'llm_config.json'))
+    parser.add_argument("--ways", type=str, help="ways.csv of a new job.", default=os.path.join(metadata_dir, 'ways.csv'))
+    parser.add_argument("--photos", type=str, help="photos.csv of a new job.", default=os.path.join(metadata_dir, 'photos.csv'))
+    parser.add_argument("--osmids", type=int, nargs='+', help="Ways of a new job (defaults to all ways).", default=None)
+    parser.add_argument("--store", type=str, help="Tile store to take the front views from (optional).", default=None)
+    parser.add_argument("--photos-dir", type=str, help="Photos directory, if no tile store is given.", default=PHOTOS_DIR)
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        config = json.load(f)
+    job = BatchJob(args.job_dir, config, get_front_view_loader(args.store, args.photos_dir))
+    if args.command == 'prepare':
+        job.create(load_metadata(args.ways), load_metadata(args.photos), args.osmids, args.mode)
+    else:
+        if args.results_path is None:
+            parser.error("results_path is required to ingest")
+        job.ingest(args.results_path)
+    if not job.write_round():
+        job.write_predictions()
@@ -0,0 +1,144 @@
+"""
+Conversation context of the requests of a sequence.
+
+FullReplayContext is the approach of analyze_road_sequence: every request replays the
+whole text history of the sequence, i.e. every earlier prompt (the full prompt of
+llm_config.json) and every answer, so input tokens grow quadratically with the length
+of the sequence.
+
+RollingContext keeps a bounded, structured state instead: the current best estimate of
+the tags (the non-null values of the answers so far, later answers winning) and the last
+few answers. Every request is the job description and the prompt, sent once as a
+system message that is identical for all requests (so providers can cache it), and one
+user message with the state and the new image. Its size doesn't depend on the position
+in the sequence.
+
+Both contexts have the same interface, used by the async runner:
+    context.image_messages(images, image_encoder) -> messages of the next image request
+    context.update(messages, response)            -> record the answer to those messages
+    context.summary_messages(aggregation_prompt)   -> messages of the final summary request
+
+estimate_context_tokens() compares the prompt tokens of both contexts on the sequences
+of ways.csv without calling the API.
+"""
+import json
+from collections import deque
+
+import pandas as pd
+
+from llm_utils import get_llm_prompt, update_conversation_history, estimate_tokens
+from predictions import parse_final_output
+
+
+class FullReplayContext:
+    """The whole text history of the sequence in every request, as analyze_road_sequence does."""
+
+    def __init__(self, config):
+        self.config = config
+        self.conversation_history = None
+        self.steps = 0
+
+    @property
+    def has_observations(self):
+        return bool(self.conversation_history)
+
+    def image_messages(self, images, image_encoder=None):
+        messages = get_llm_prompt(prompt_text=self.config['prompt'], images=images,
+                                  conversation_history=self.conversation_history, first_step=self.steps == 0,
+                                  job_description=self.config['job_description'], image_encoder=image_encoder)
+        self.steps += 1
+        return messages
+
+    def update(self, messages, response):
+        self.conversation_history = update_conversation_history(self.conversation_history, messages, response)
+
+    def summary_messages(self, aggregation_prompt):
+        return get_llm_prompt(prompt_text=aggregation_prompt, images=None,
+                              conversation_history=self.conversation_history, first_step=False,
+                              job_description=self.config['job_description'])
+
+
+class RollingContext:
+    """
+    Bounded context: the current tag estimate and the last window answers.
+
+    Args:
+        config: LLM config (job_description and prompt)
+        window: number of recent answers kept
+        max_observation_chars: answers are cut to this length in the context
+    """
+
+    def __init__(self, config, window=2, max_observation_chars=600):
+        self.system_message = {
+            'role': 'system',
+            'content': [{'type': 'text', 'text': f"{config['job_description']}\n\n{config['prompt']}"}]
+        }
+        self.estimate = {}
+        self.observations = deque(maxlen=window)
+        self.max_observation_chars = max_observation_chars
+        self.steps = 0
+
+    @property
+    def has_observations(self):
+        return self.steps > 0
+
+    def state_text(self):
+        lines = [f"Images analyzed so far: {self.steps}",
+                 f"Current estimate of the tags: {json.dumps(self.estimate, ensure_ascii=False)}"]
+        if self.observations:
+            lines.append("Most recent observations:")
+            lines += [f"- {observation}" for observation in self.observations]
+        return '\n'.join(lines)
+
+    def image_messages(self, images, image_encoder=None):
+        prompt_text = f"{self.state_text()}\n\nAnalyze the next image of the road segment and update the estimate."
+        messages = get_llm_prompt(prompt_text=prompt_text, images=images, image_encoder=image_encoder)
+        return [self.system_message] + messages
+
+    def update(self, messages, response):
+        self.steps += 1
+        tags = parse_final_output(response)
+        if tags:
+            self.estimate.update({tag: value for tag, value in tags.items() if value not in (None, '')})
+        self.observations.append(response[:self.max_observation_chars].replace('\n', ' '))
+
+    def summary_messages(self, aggregation_prompt):
+        messages = get_llm_prompt(prompt_text=f"{self.state_text()}\n\n{aggregation_prompt}")
+        return [self.system_message] + messages
+
+
+def get_context(config, context_window=None):
+    """RollingContext with context_window recent answers, or FullReplayContext if context_window is None."""
+    if context_window is None:
+        return FullReplayContext(config)
+    return RollingContext(config, context_window)
+
+
+def estimate_context_tokens(ways_df, config, response, context_windows=(None, 2)):
+    """
+    Estimated prompt tokens of every request of the sequences in ways_df, for each context
+    (context_window None is the full replay), assuming every image gets the answer response.
+
+    Returns a dataframe with one row per request: osmid, sequence_id, step (image number,
+    or 'FINAL_SUMMARY') and one tokens column per context window.
+    """
+    # Images are only counted by estimate_tokens, their content doesn't matter
+    image_url = 'data:image/png;base64,'
+    rows = []
+    for osmid, sequences in zip(ways_df['osmid'], ways_df['sequences']):
+        for sequence_id, sequence_indexes in sequences.items():
+            tokens = {}
+            for context_window in context_windows:
+                context = get_context(config, context_window)
+                requests = []
+                for _ in sequence_indexes:
+                    messages = context.image_messages([image_url])
+                    requests.append(estimate_tokens(messages, 0))
+                    context.update(messages, response)
+                requests.append(estimate_tokens(context.summary_messages(config['aggregation_prompt']), 0))
+                tokens[f'tokens_window_{context_window}' if context_window is not None else 'tokens_full'] = requests
+            steps = list(range(1, len(sequence_indexes) + 1)) + ['FINAL_SUMMARY']
+            for i, step in enumerate(steps):
+                rows.append({'osmid': osmid, 'sequence_id': sequence_id, 'step': step,
+                             **{column: requests[i] for column, requests in tokens.items()}})
+    return pd.DataFrame(rows)
@@ -0,0 +1,173 @@
+"""
+Accuracy vs. payload sweep of the image encoder settings (see image_encoder.py).
+
+payload_sweep() encodes a set of front views with every setting and reports the payload
+per image, the encoding time and the fidelity (PSNR) of the decoded image, without any
+API call. accuracy_sweep() runs the async runner on a set of ways once per setting,
+scores each run's predictions with eval.py against the ground truth of those ways, and
+reports the F1 next to the payload, so that settings can be chosen with evidence.
+
+The photos are not part of the repository, so the sweep needs the photos directory (or
+a tile store built from it).
+
+Usage:
+    python encoding_sweep.py [--store path/to/tile_store] [--photos-dir ../photos] [--n-images 50]
+"""
+import os
+import sys
+import time
+import base64
+import argparse
+
+import numpy as np
+import pandas as pd
+import cv2
+
+from image_encoder import ImageEncoder, MODEL_INPUT_SIDE
+from async_runner import AsyncRoadSequenceRunner
+from tile_store import TileStore, crop_front_view, PHOTOS_DIR
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'evaluation_utils'))
+import eval as evaluation  # noqa: E402
+
+# (image_format, quality, max_side) settings compared by default, from the current PNG to small JPEG/WebP
+DEFAULT_SETTINGS = [
+    ('png', None, None),
+    ('jpeg', 95, None),
+    ('jpeg', 85, None),
+    ('jpeg', 85, MODEL_INPUT_SIDE),
+    ('jpeg', 70, MODEL_INPUT_SIDE),
+    ('webp', 85, MODEL_INPUT_SIDE),
+    ('webp', 70, MODEL_INPUT_SIDE),
+    ('jpeg', 70, 512),
+]
+
+
+def setting_label(image_format, quality, max_side):
+    label = image_format
+    if image_format != 'png':
+        label += f'_q{quality}'
+    if max_side is not None:
+        label += f'_{max_side}px'
+    return label
+
+
+def psnr(image, decoded):
+    """PSNR in dB of a decoded image against the original, after upscaling it back to the original size."""
+    if decoded.shape != image.shape:
+        decoded = cv2.resize(decoded, (image.shape[1], image.shape[0]), interpolation=cv2.INTER_LINEAR)
+    mse = np.mean((image.astype(np.float64) - decoded) ** 2)
+    return float('inf') if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+
+def payload_sweep(images, settings=DEFAULT_SETTINGS):
+    """
+    Encode RGB front views with every (image_format, quality, max_side) setting.
+
+    Returns a dataframe with one row per setting: mean payload per image (encoded and as
+    base64), its share of the PNG payload, mean encoding time and mean PSNR.
+    """
+    rows = []
+    for image_format, quality, max_side in settings:
+        encoder = ImageEncoder(image_format, quality, max_side, cache_bytes=0)
+        sizes, times, fidelity = [], [], []
+        for image in images:
+            start = time.perf_counter()
+            encoded = encoder.encode(image)
+            times.append(time.perf_counter() - start)
+            sizes.append(len(encoded))
+            decoded = cv2.imdecode(np.frombuffer(base64.b64decode(encoded), np.uint8), cv2.IMREAD_COLOR)
+            fidelity.append(psnr(image, cv2.cvtColor(decoded, cv2.COLOR_BGR2RGB)))
+        rows.append({
+            'setting': setting_label(image_format, encoder.quality, max_side),
+            'image_format': image_format,
+            'quality': encoder.quality,
+            'max_side': max_side,
+            'encoded_kb': encoder.encoded_bytes / len(images) / 1024,
+            'base64_kb': np.mean(sizes) / 1024,
+            'encode_ms': np.mean(times) * 1000,
+            'psnr_db': np.mean(fidelity),
+        })
+    sweep_df = pd.DataFrame(rows)
+    sweep_df['payload_share'] = sweep_df['base64_kb'] / sweep_df['base64_kb'].iloc[0]
+    return sweep_df
+
+
+async def accuracy_sweep(config, ways_df, photos_df, osmids, load_and_resize_image, get_front_view,
+                         results_to_predictions, settings=DEFAULT_SETTINGS, out_dir='./encoding_sweep_runs', gt_df=None,
+                         client=None, cache=None, crop_params=None, uid='encoding_sweep'):
+    """
+    Predict the given ways once per encoder setting and score every run with eval.py.
+
+    Args:
+        config, client, cache: as for AsyncRoadSequenceRunner
+        ways_df, photos_df, osmids, load_and_resize_image, get_front_view: as for analyze_ways
+        results_to_predictions: turns the results of analyze_ways into a predictions
+            dataframe in the metadata/predictions_*.csv schema
+        settings: (image_format, quality, max_side) settings to compare
+        out_dir: directory of the predictions_{setting}.csv files
+        gt_df: ground truth dataframe (defaults to metadata/ground_truth.csv), restricted to osmids
+        crop_params: crop parameters of the images (see ImageEncoder)
+        uid: prefix of the eval.py uids, metrics are saved as metrics_{uid}_{setting}
+
+    Returns a dataframe with one row per setting: the images sent, their mean payload, the
+    run time and the overall and per-tag F1.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    if gt_df is None:
+        gt_df = evaluation.load_ground_truth()
+    # Ways that weren't predicted would only count as false negatives
+    gt_df = gt_df[gt_df['osmid'].isin(osmids)]
+
+    rows = []
+    for image_format, quality, max_side in settings:
+        encoder = ImageEncoder(image_format, quality, max_side, crop_params)
+        label = setting_label(image_format, encoder.quality, max_side)
+        runner = AsyncRoadSequenceRunner(config, client=client, cache=cache, image_encoder=encoder)
+        start = time.perf_counter()
+        results = await runner.analyze_ways(ways_df, photos_df, osmids, load_and_resize_image, get_front_view)
+        run_seconds = time.perf_counter() - start
+
+        pred_df_path = os.path.join(out_dir, f'predictions_{label}.csv')
+        results_to_predictions(results).to_csv(pred_df_path, index=False)
+        detailed_metrics, final_metrics_df = evaluation.eval_map_feature_pred(pred_df_path, f'{uid}_{label}',
+                                                                              gt_df=gt_df)
+        overall = final_metrics_df[final_metrics_df['osm_tag'] == 'overall'].iloc[0]
+        images = encoder.misses
+        rows.append({
+            'setting': label,
+            'images': images,
+            'encoded_kb': encoder.encoded_bytes / images / 1024 if images else 0,
+            'run_seconds': run_seconds,
+            'f1': overall['f1'],
+            **{f'f1:{tag}': round(metrics['f1'], 4) for tag, metrics in detailed_metrics.items()},
+        })
+    return pd.DataFrame(rows)
+
+
+def load_sweep_images(store_dir=None, photos_dir=PHOTOS_DIR, n_images=50):
+    """Front views of up to n_images photos, from a tile store if given, else cropped from photos_dir."""
+    if store_dir is not None:
+        store = TileStore(store_dir)
+        return [store.get(*key) for key in list(store.rows)[:n_images]]
+    images = []
+    for filename in sorted(os.listdir(photos_dir)) if os.path.isdir(photos_dir) else []:
+        if len(images) == n_images:
+            break
+        image = cv2.imread(os.path.join(photos_dir, filename))
+        if image is not None:
+            images.append(crop_front_view(image))
+    return images
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the payload and fidelity of image encoder settings.")
+    parser.add_argument("--store", type=str, help="Tile store to take the front views from (optional).", default=None)
+    parser.add_argument("--photos-dir", type=str, help="Photos directory, if no tile store is given.", default=PHOTOS_DIR)
+    parser.add_argument("--n-images", type=int, help="Number of front views to encode (optional, defaults to 50).", default=50)
+    args = parser.parse_args()
+
+    images = load_sweep_images(args.store, args.photos_dir, args.n_images)
+    if not images:
+        raise SystemExit(f"No photos found in {args.store or args.photos_dir}")
+    print(payload_sweep(images).to_markdown(index=False, floatfmt='.2f'))
@@ -0,0 +1,169 @@
+"""
+Configurable encoding of the images sent to the LLM.
+
+encode_image_from_array sends every front view as an uncompressed PNG (about 4 MB of
+base64 for a 1000x1000 crop). ImageEncoder can encode JPEG or WebP at a given quality
+instead, and downscale images to the resolution the model actually looks at (768 pixels
+on the short side at high detail for OpenAI models). Encode buffers are re-used per
+thread, and encoded images are cached in memory by (sequence_id, sequence_index), the
+crop parameters and the encoder settings, so repeated requests for a photo don't
+re-encode it.
+
+The settings are read from the image_format, image_quality, image_max_side and
+image_cache_mb keys of llm_config.json. The default is the PNG encoding of
+encode_image_from_array. See encoding_sweep.py to compare settings.
+"""
+import io
+import base64
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import cv2
+from PIL import Image
+
+# Pillow format name and data URL MIME type of each supported format
+IMAGE_FORMATS = {
+    'png': ('PNG', 'image/png'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'webp': ('WEBP', 'image/webp'),
+}
+DEFAULT_QUALITY = 90
+
+# Short side of high-detail images as seen by OpenAI vision models
+MODEL_INPUT_SIDE = 768
+
+
+class ImageEncoder:
+    """
+    Encode images as base64 data URLs.
+
+    Args:
+        image_format: 'png', 'jpeg' or 'webp'
+        quality: JPEG/WebP quality (1-100), defaults to DEFAULT_QUALITY. Ignored for PNG,
+            which is saved uncompressed like encode_image_from_array.
+        max_side: downscale images whose longer side is larger, None to keep the size
+        crop_params: parameters of the crop the images come from (e.g. TileStore.crop_params),
+            part of the cache key so that crops of a different window aren't mixed up
+        cache_bytes: size limit of the cache of encoded images, 0 to disable it
+    """
+
+    def __init__(self, image_format='png', quality=None, max_side=None, crop_params=None, cache_bytes=256 * 2 ** 20):
+        image_format = image_format.lower().replace('jpg', 'jpeg')
+        assert image_format in IMAGE_FORMATS, f"Unsupported image format {image_format}, expected one of {list(IMAGE_FORMATS)}"
+        self.image_format = image_format
+        self.quality = None if image_format == 'png' else (quality or DEFAULT_QUALITY)
+        self.max_side = max_side
+        self.crop_params = tuple(sorted(crop_params.items())) if crop_params else None
+        self.cache_bytes = cache_bytes
+        self.hits = 0
+        self.misses = 0
+        self.encoded_bytes = 0
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+        self._buffers = threading.local()
+
+    @classmethod
+    def from_config(cls, config, crop_params=None):
+        """Encoder configured by the image_* keys of llm_config.json (PNG at full size if they aren't set)."""
+        return cls(config.get('image_format') or 'png', config.get('image_quality'), config.get('image_max_side'),
+                   crop_params, int(config.get('image_cache_mb', 256) * 2 ** 20))
+
+    @property
+    def settings(self):
+        return {'image_format': self.image_format, 'image_quality': self.quality, 'image_max_side': self.max_side}
+
+    @property
+    def mime_type(self):
+        return IMAGE_FORMATS[self.image_format][1]
+
+    def cache_key(self, sequence_id, sequence_index):
+        return (int(sequence_id), int(sequence_index), self.crop_params, self.image_format, self.quality, self.max_side)
+
+    def get(self, key):
+        """Cached data URL of an image key (see cache_key), None on a miss."""
+        with self._lock:
+            url = self._cache.get(key)
+            if url is None:
+                self.misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return url
+
+    def _put(self, key, url):
+        with self._lock:
+            if key in self._cache:
+                return
+            self._cache[key] = url
+            self._cached_bytes += len(url)
+            while self._cached_bytes > self.cache_bytes and self._cache:
+                _, evicted = self._cache.popitem(last=False)
+                self._cached_bytes -= len(evicted)
+
+    def resize(self, image_array):
+        """Downscale an image so that its longer side is at most max_side."""
+        height, width = image_array.shape[:2]
+        if self.max_side is None or max(height, width) <= self.max_side:
+            return image_array
+        scale = self.max_side / max(height, width)
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        return cv2.resize(image_array, size, interpolation=cv2.INTER_AREA)
+
+    def encode(self, image_array, input_format='RGB'):
+        """Base64 string of an RGB (or BGR) image in the configured format."""
+        if image_array.dtype != np.uint8:
+            image_array = (image_array * 255).astype(np.uint8)
+        if input_format.upper() == 'BGR':
+            image_array = cv2.cvtColor(image_array, cv2.COLOR_BGR2RGB)
+        elif input_format.upper() != 'RGB':
+            raise ValueError("input_format must be either 'RGB' or 'BGR'")
+        image = Image.fromarray(self.resize(image_array))
+
+        # The buffer of this thread keeps its capacity between images
+        buffer = getattr(self._buffers, 'buffer', None)
+        if buffer is None:
+            buffer = self._buffers.buffer = io.BytesIO()
+        buffer.seek(0)
+        pil_format = IMAGE_FORMATS[self.image_format][0]
+        if self.image_format == 'png':
+            image.save(buffer, format=pil_format, optimize=True, compress_level=0)
+        else:
+            image.save(buffer, format=pil_format, quality=self.quality)
+        size = buffer.tell()
+        with buffer.getbuffer() as view, view[:size] as content_bytes:
+            encoded = base64.b64encode(content_bytes).decode('ascii')
+        with self._lock:
+            self.encoded_bytes += size
+        return encoded
+
+    def data_url(self, image_array, input_format='RGB'):
+        """Data URL of an image for the image_url content of a request."""
+        return f"data:{self.mime_type};base64,{self.encode(image_array, input_format)}"
+
+    def photo_url(self, sequence_id, sequence_index, load_front_view):
+        """
+        Data URL of the front view of a photo, from the cache if possible.
+        load_front_view() returns the RGB front view and is only called on a cache miss.
+        """
+        key = self.cache_key(sequence_id, sequence_index)
+        url = self.get(key)
+        if url is None:
+            url = self.data_url(load_front_view())
+            if self.cache_bytes:
+                self._put(key, url)
+        return url
+
+    def stats(self):
+        """Cache hits and misses, encoded bytes (before base64) and the size of the cached data URLs."""
+        lookups = self.hits + self.misses
+        return {
+            **self.settings,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0,
+            'encoded_bytes': self.encoded_bytes,
+            'cached_images': len(self._cache),
+            'cached_bytes': self._cached_bytes,
+        }
@@ -0,0 +1,106 @@
+"""
+Keyframe selection: send a few informative photos of a sequence instead of all of them.
+
+Consecutive photos along a way are a few meters apart and nearly identical. The change
+between two consecutive photos is scored from the distance between their positions,
+the change of heading and, if the front views are available, the Hamming distance of
+their difference hashes (dHash). Keyframes are then picked by farthest-point sampling
+along the cumulative change of the sequence: the first photo, the last one, then the
+photo farthest from the keyframes picked so far, until max_keyframes photos are picked.
+Sequences where the scene changes little get evenly spread keyframes, and stretches
+with turns or visual changes get more of them.
+
+Selected keyframes keep the order of the sequence.
+"""
+import numpy as np
+import cv2
+from shapely.wkt import loads
+
+# Meters per degree of latitude (and of longitude at the equator)
+METERS_PER_DEGREE = 111320
+
+HASH_SIZE = 8
+
+
+def dhash(image):
+    """64-bit difference hash of an RGB image: signs of the horizontal gradients of a 9x8 thumbnail."""
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if image.ndim == 3 else image
+    thumbnail = cv2.resize(gray, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA)
+    return (thumbnail[:, 1:] > thumbnail[:, :-1]).ravel()
+
+
+def farthest_point_sampling(positions, n_samples):
+    """Indexes of n_samples of the sorted 1D positions, greedily farthest from the ones already picked."""
+    n_samples = min(n_samples, len(positions))
+    selected = [0]
+    distances = np.abs(positions - positions[0])
+    distances[0] = -1
+    while len(selected) < n_samples:
+        farthest = int(np.argmax(distances))
+        selected.append(farthest)
+        distances = np.minimum(distances, np.abs(positions - positions[farthest]))
+        # Picked photos are never picked again, even among photos without any change
+        distances[selected] = -1
+    return sorted(selected)
+
+
+class KeyframeSelector:
+    """
+    Pick up to max_keyframes photos per sequence.
+
+    Args:
+        photos_df: photos.csv (and/or extra_photos.csv) with geometry as WKT or shapely points
+        max_keyframes: keyframes per sequence, None to keep all photos
+        distance_scale: meters between two photos counting as one unit of change
+        heading_scale: degrees of heading change counting as one unit of change
+        hash_scale: differing dHash bits counting as one unit of change
+    """
+
+    def __init__(self, photos_df, max_keyframes=None, distance_scale=10.0, heading_scale=30.0, hash_scale=16.0):
+        self.max_keyframes = max_keyframes
+        self.distance_scale = distance_scale
+        self.heading_scale = heading_scale
+        self.hash_scale = hash_scale
+
+        points = [loads(geometry) if isinstance(geometry, str) else geometry for geometry in photos_df['geometry']]
+        lon = np.array([point.x for point in points])
+        lat = np.array([point.y for point in points])
+        # Local equirectangular projection in meters, fine at the scale of a sequence
+        x = lon * METERS_PER_DEGREE * np.cos(np.radians(lat))
+        y = lat * METERS_PER_DEGREE
+        keys = zip(photos_df['sequence_id'].astype(int), photos_df['sequence_index'].astype(int))
+        self.positions = dict(zip(keys, zip(x, y, photos_df['heading'].to_numpy(dtype=float))))
+
+    @classmethod
+    def from_config(cls, config, photos_df):
+        """Selector with the max_keyframes key of llm_config.json (all photos if it isn't set)."""
+        return cls(photos_df, config.get('max_keyframes'))
+
+    def frame_changes(self, sequence_id, sequence_indexes, front_views=None):
+        """Change score between each photo and the previous one (0 for the first photo)."""
+        x, y, heading = np.array([self.positions[(int(sequence_id), int(sequence_index))]
+                                  for sequence_index in sequence_indexes]).T
+        changes = np.hypot(np.diff(x), np.diff(y)) / self.distance_scale
+        changes += np.abs((np.diff(heading) + 180) % 360 - 180) / self.heading_scale
+        if front_views is not None:
+            hashes = np.array([dhash(front_view) for front_view in front_views])
+            changes += np.count_nonzero(hashes[1:] != hashes[:-1], axis=1) / self.hash_scale
+        return np.concatenate([[0], changes])
+
+    def select(self, sequence_id, sequence_indexes, load_front_view=None):
+        """
+        Keyframes of a sequence, in sequence order.
+        load_front_view(sequence_id, sequence_index) returns an RGB front view and is used
+        for the image difference if given. Sequences with photos missing from photos_df are
+        kept whole.
+        """
+        sequence_indexes = list(sequence_indexes)
+        if self.max_keyframes is None or len(sequence_indexes) <= self.max_keyframes:
+            return sequence_indexes
+        if any((int(sequence_id), int(sequence_index)) not in self.positions for sequence_index in sequence_indexes):
+            return sequence_indexes
+        front_views = None
+        if load_front_view is not None:
+            front_views = [load_front_view(sequence_id, sequence_index) for sequence_index in sequence_indexes]
+        cumulative_change = np.cumsum(self.frame_changes(sequence_id, sequence_indexes, front_views))
+        return [sequence_indexes[i] for i in farthest_point_sampling(cumulative_change, self.max_keyframes)]
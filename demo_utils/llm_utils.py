@@ -0,0 +1,125 @@
+import base64
+import io
+
+import numpy as np
+import cv2
+from PIL import Image
+
+# Rough token cost of an image in a request (a 1000x1000 front view at high detail)
+IMAGE_TOKEN_ESTIMATE = 765
+CHARS_PER_TOKEN = 4
+
+
+def encode_image_from_array(image_array, input_format='RGB'):
+    if image_array.dtype != np.uint8:
+        image_array = (image_array * 255).astype(np.uint8)
+    if input_format.upper() == 'BGR':
+        image_array = cv2.cvtColor(image_array, cv2.COLOR_BGR2RGB)
+    elif input_format.upper() not in ['RGB', 'BGR']:
+        raise ValueError("output_format must be either 'RGB' or 'BGR'")
+
+    image = Image.fromarray(image_array)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", optimize=True, compress_level=0)
+    content_bytes = buffer.getvalue()
+    return base64.b64encode(content_bytes).decode('utf-8')
+
+
+def get_llm_prompt(prompt_text, images=None, conversation_history=None, first_step=False, job_description=None,
+                   image_encoder=None):
+    """
+    Build the messages of a request: the job description as system message on the first
+    step, the text of the conversation history, and the prompt with its images.
+    Images are RGB arrays, encoded with image_encoder (an ImageEncoder, PNG if None), or
+    already encoded data URLs.
+    """
+    conversation = []
+
+    if first_step:
+        conversation.append({
+            "role": "system",
+            "content": [{"type": "text", "text": job_description}]
+        })
+
+    if conversation_history is not None:
+        for message in conversation_history:
+
+            if message["role"] == "assistant":
+                conversation.append(message)
+
+            elif message["role"] == "user":
+                text_content = []
+                for content in message["content"]:
+                    if content["type"] == "text":
+                        text_content.append(content)
+
+                if text_content:
+                    conversation.append({
+                        "role": "user",
+                        "content": text_content
+                    })
+
+    user_content = [{"type": "text", "text": prompt_text}]
+
+    if images is not None:
+        for img in images:
+            if isinstance(img, str):
+                url = img
+            elif image_encoder is not None:
+                url = image_encoder.data_url(img)
+            else:
+                url = f"data:image/png;base64,{encode_image_from_array(img)}"
+            img_dict = {"type": "image_url", "image_url": {"url": url}}
+            user_content.append(img_dict)
+
+    conversation.append({
+        "role": "user",
+        "content": user_content
+    })
+
+    return conversation
+
+
+def update_conversation_history(conversation_history, new_messages, response_content):
+    """
+    Update conversation history with new messages and response
+    """
+    if conversation_history is None:
+        conversation_history = []
+
+    # Add the new user message (without images to save memory)
+    user_message = None
+    for msg in new_messages:
+        if msg["role"] == "user":
+            # Keep only text content, remove images to save memory
+            text_content = [content for content in msg["content"] if content["type"] == "text"]
+            if text_content:
+                user_message = {
+                    "role": "user",
+                    "content": text_content
+                }
+            break
+
+    if user_message:
+        conversation_history.append(user_message)
+
+    # Add the assistant's response
+    if response_content:
+        conversation_history.append({
+            "role": "assistant",
+            "content": [{"type": "text", "text": response_content}]
+        })
+
+    return conversation_history
+
+
+def estimate_tokens(messages, max_tokens):
+    """Estimate the tokens a request uses: text of the messages, images and the completion budget."""
+    tokens = max_tokens
+    for message in messages:
+        for content in message['content']:
+            if content['type'] == 'text':
+                tokens += len(content['text']) // CHARS_PER_TOKEN + 1
+            else:
+                tokens += IMAGE_TOKEN_ESTIMATE
+    return tokens
@@ -0,0 +1,231 @@
+"""
+Predictions CSV from the results of the demo pipeline.
+
+The prompt asks for answers such as
+    FINAL_OUTPUT: {'reasoning': '...'; 'oneway': 'no'; 'lanes:forward': '1'; 'turn:lanes:backward': None, 'maxspeed': 25}
+i.e. Python-style dicts with ';' or ',' separators, single or double quotes and None,
+often followed by more prose. parse_final_output() reads them (and JSON answers) with a
+single compiled regex over the tag-value pairs after the last FINAL_OUTPUT marker, with
+no json/ast/eval parsing of whole answers, so it parses hundreds of thousands of answers per
+second.
+
+Values are then normalized to the conventions of the ground truth: missing values
+("None", "null", "unknown", ...) become empty, lane counts become integers, speeds
+are always written with their unit, "25 mph" or "50 km/h" (speeds without a unit are read
+in mph, like SpeedComparator(default_unit='mph') of eval.py does), oneway becomes yes/no/-1
+and turn:lanes loses its spaces.
+
+Answers describe the road in the driving direction, so the :forward and :backward tags
+of a sequence are swapped when its photos were taken against the direction of the way
+(match_direction False).
+
+results_to_predictions() turns {osmid: [{sequence_id: sequence_results}, ...]}, as
+returned by analyze_road_sequence, the async runner or a batch job, into a dataframe in
+the schema of metadata/predictions_*.csv, ready for eval.py. The tags of a sequence are
+those of its final summary (or of its last parsable answer), and the value of each tag
+of a way is voted across its sequences.
+
+Usage (normalize an existing predictions CSV, e.g. to drop its "None" strings; the output
+defaults to path/to/predictions_normalized.csv, next to the input):
+    python predictions.py path/to/predictions.csv [path/to/output.csv]
+"""
+import os
+import re
+import json
+import argparse
+from collections import Counter
+
+import pandas as pd
+
+# Columns of metadata/predictions_*.csv
+PREDICTION_COLUMNS = ['osmid', 'maxspeed:forward', 'maxspeed:backward', 'maxspeed', 'lanes', 'lanes:forward',
+                      'lanes:backward', 'turn:lanes', 'turn:lanes:forward', 'turn:lanes:backward', 'name', 'oneway']
+
+FINAL_OUTPUT_MARKER = 'FINAL_OUTPUT'
+
+# One of the tags of the predictions as a quoted key, then its value: a single-quoted string
+# (closed by the first quote followed by a separator), a double-quoted string or a bare value.
+# The reasoning and other keys are skipped by the search, without capturing them
+_PAIR_PATTERN = re.compile(
+    r"""(['"])(""" + '|'.join(re.escape(tag) for tag in sorted(PREDICTION_COLUMNS[1:], key=len, reverse=True)) +
+    r""")\1\s*:\s*(?:'(.*?)'(?=\s*(?:[;,}]|$))|"((?:[^"\\]|\\.)*)"|([^\s;,{}'"][^;,}]*))""",
+    re.S)
+
+MISSING_VALUES = {'', 'none', 'null', 'nan', 'n/a', 'na', 'unknown', 'not visible', 'no relevant features detected'}
+
+_NUMBER_PATTERN = re.compile(r'\d+(?:\.\d+)?')
+_SPEED_PATTERN = re.compile(r'(\d+(?:\.\d+)?)\s*(mph|km/h|kmh|kph)?', re.I)
+_SPEED_UNITS = {'mph': 'mph', 'km/h': 'km/h', 'kmh': 'km/h', 'kph': 'km/h'}
+_ONEWAY_VALUES = {'yes': 'yes', 'true': 'yes', '1': 'yes', 'no': 'no', 'false': 'no', '0': 'no', '-1': '-1'}
+
+
+def parse_final_output(response):
+    """
+    Tags of an answer: the key-value pairs of its (last) FINAL_OUTPUT dict, or of its first
+    dict if it has no marker, without the reasoning. Values are strings or None. Returns
+    None if no pair can be read.
+    """
+    if not response:
+        return None
+    marker = response.rfind(FINAL_OUTPUT_MARKER)
+    start = response.find('{', marker if marker >= 0 else 0)
+    if start < 0:
+        return None
+    end = response.rfind('}')
+    if end < start:
+        # Answer cut off by max_tokens: read what is there
+        end = len(response)
+    tags = {}
+    for _, tag, single_quoted, double_quoted, bare in _PAIR_PATTERN.findall(response, start, end + 1):
+        if single_quoted or not (double_quoted or bare):
+            tags[tag] = single_quoted
+        elif double_quoted:
+            tags[tag] = json.loads(f'"{double_quoted}"') if '\\' in double_quoted else double_quoted
+        else:
+            bare = bare.rstrip()
+            tags[tag] = None if bare in ('None', 'null') else bare
+    return tags or None
+
+
+def _is_missing(value):
+    return value is None or value != value or str(value).strip().lower() in MISSING_VALUES
+
+
+def normalize_lanes(value):
+    match = _NUMBER_PATTERN.search(value)
+    return str(int(float(match.group()))) if match else None
+
+
+def normalize_speed(value, default_unit='mph'):
+    match = _SPEED_PATTERN.fullmatch(value.strip())
+    if match is None:
+        # Not a number, e.g. "none" or "walk"
+        return value.strip().lower()
+    speed = float(match.group(1))
+    speed = str(int(speed)) if speed.is_integer() else str(speed)
+    unit = _SPEED_UNITS[(match.group(2) or default_unit).lower()]
+    # With the unit written out, the value doesn't depend on the default unit of the comparator
+    return f'{speed} {unit}'
+
+
+def normalize_oneway(value):
+    return _ONEWAY_VALUES.get(value.strip().lower())
+
+
+def normalize_turn_lanes(value):
+    value = value.lower().replace(' ', '')
+    return value if value.strip('|') else None
+
+
+def normalize_name(value):
+    return ' '.join(value.split())
+
+
+NORMALIZERS = {
+    'lanes': normalize_lanes, 'lanes:forward': normalize_lanes, 'lanes:backward': normalize_lanes,
+    'maxspeed': normalize_speed, 'maxspeed:forward': normalize_speed, 'maxspeed:backward': normalize_speed,
+    'oneway': normalize_oneway,
+    'turn:lanes': normalize_turn_lanes, 'turn:lanes:forward': normalize_turn_lanes,
+    'turn:lanes:backward': normalize_turn_lanes,
+    'name': normalize_name,
+}
+
+
+def normalize_value(tag, value):
+    """Value of a tag in the conventions of the ground truth, None if missing."""
+    if _is_missing(value):
+        return None
+    value = str(value)
+    normalizer = NORMALIZERS.get(tag)
+    return normalizer(value) if normalizer is not None else value.strip()
+
+
+def normalize_tags(tags):
+    """Normalized non-missing values of the prediction tags in tags."""
+    normalized = {}
+    for tag, value in tags.items():
+        if tag in NORMALIZERS:
+            value = normalize_value(tag, value)
+            if value is not None:
+                normalized[tag] = value
+    return normalized
+
+
+def invert_direction(tags):
+    """Tags with :forward and :backward swapped."""
+    inverted = {}
+    for tag, value in tags.items():
+        if tag.endswith(':forward'):
+            tag = tag[:-len(':forward')] + ':backward'
+        elif tag.endswith(':backward'):
+            tag = tag[:-len(':backward')] + ':forward'
+        inverted[tag] = value
+    return inverted
+
+
+def majority_direction(answers):
+    """Match direction of most answers of a sequence (True for ties and without answers)."""
+    directions = [bool(result.get('match_direction', True)) for result in answers]
+    return 2 * sum(directions) >= len(directions)
+
+
+def sequence_tags(sequence_results):
+    """
+    Normalized tags of a sequence, in the direction of the way: the final summary, else
+    the last answer that can be parsed. Each answer is inverted by its match direction,
+    the summary by the match direction of most answers of the sequence.
+    """
+    summaries = [result for result in sequence_results if result['sequence_index'] == 'FINAL_SUMMARY']
+    answers = [result for result in sequence_results if result['sequence_index'] != 'FINAL_SUMMARY']
+    directions = [bool(result.get('match_direction', True)) for result in answers]
+    sequence_direction = majority_direction(answers)
+    candidates = [(result, sequence_direction) for result in summaries]
+    candidates += [(result, direction) for result, direction in zip(answers[::-1], directions[::-1])]
+    for result, match_direction in candidates:
+        tags = parse_final_output(result['response'])
+        if tags:
+            tags = normalize_tags(tags)
+            return tags if match_direction else invert_direction(tags)
+    return {}
+
+
+def vote(values):
+    """Most common of values, the first one among ties, None if there are none."""
+    if not values:
+        return None
+    return Counter(values).most_common(1)[0][0]
+
+
+def results_to_predictions(results):
+    """Predictions dataframe (PREDICTION_COLUMNS) of the results of many ways, voting across sequences."""
+    rows = []
+    for osmid, way_results in results.items():
+        votes = {}
+        for sequence in way_results:
+            for sequence_results in sequence.values():
+                for tag, value in sequence_tags(sequence_results).items():
+                    votes.setdefault(tag, []).append(value)
+        rows.append({'osmid': osmid, **{tag: vote(values) for tag, values in votes.items()}})
+    return pd.DataFrame(rows, columns=PREDICTION_COLUMNS)
+
+
+def normalize_predictions(pred_df):
+    """Copy of a predictions dataframe with normalized values (missing values as NaN)."""
+    pred_df = pred_df.copy()
+    for tag in pred_df.columns:
+        if tag in NORMALIZERS:
+            pred_df[tag] = pred_df[tag].map(lambda value: normalize_value(tag, value)).astype(object)
+    return pred_df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Normalize the values of a predictions CSV.")
+    parser.add_argument("pred_df_path", type=str, help="Path to the predictions CSV.")
+    parser.add_argument("output_path", type=str, nargs='?', default=None,
+                        help="Output CSV (defaults to *_normalized.csv next to the input, which is never overwritten).")
+    args = parser.parse_args()
+    output_path = args.output_path or '{}_normalized{}'.format(*os.path.splitext(args.pred_df_path))
+    assert os.path.abspath(output_path) != os.path.abspath(args.pred_df_path), "Output would overwrite the input"
+    pred_df = normalize_predictions(pd.read_csv(args.pred_df_path, dtype=str, keep_default_na=False))
+    pred_df.to_csv(output_path, index=False)
+    print(f"Normalized predictions saved to {output_path}")
@@ -0,0 +1,127 @@
+"""
+Persistent cache of LLM responses for the demo pipeline.
+
+Responses are stored in a SQLite file and keyed by a hash of the request: the message
+list, with every image replaced by the hash of its data, and the model parameters of
+llm_config.json. Re-running the notebook or resuming a crashed run replays the cached
+responses instead of calling the API again. Since the conversation history of a sequence
+only contains earlier prompts and responses, a change to aggregation_prompt only misses
+the cache for the final summaries, and per-image responses are re-used.
+
+The file is kept under a size limit by evicting the least recently used responses.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+# Parameters of llm_config.json that change the response of a request
+CACHE_PARAMS = ['model', 'max_tokens', 'temperature', 'return_json']
+
+
+def normalize_messages(messages):
+    """Copy of the messages with every image URL replaced by the SHA-256 of the URL (its base64 data)."""
+    normalized = []
+    for message in messages:
+        content = []
+        for item in message['content']:
+            if item['type'] == 'image_url':
+                url_hash = hashlib.sha256(item['image_url']['url'].encode()).hexdigest()
+                item = {'type': 'image_url', 'image_url': {'url': f'sha256:{url_hash}'}}
+            content.append(item)
+        normalized.append({**message, 'content': content})
+    return normalized
+
+
+def request_key(messages, config):
+    """Cache key of a request: hash of the normalized messages and the model parameters."""
+    request = {
+        'messages': normalize_messages(messages),
+        'params': {param: config.get(param) for param in CACHE_PARAMS},
+    }
+    payload = json.dumps(request, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    SQLite-backed response cache with LRU eviction beyond max_bytes.
+    hits and misses count the lookups of this instance.
+    """
+
+    def __init__(self, path, max_bytes=1024 * 2 ** 20):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS responses ('
+                                 'key TEXT PRIMARY KEY, response TEXT NOT NULL, '
+                                 'size INTEGER NOT NULL, last_access REAL NOT NULL)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)')
+        self._total_bytes = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    @classmethod
+    def from_config(cls, config):
+        """Cache configured by the cache_path and cache_max_mb keys of llm_config.json, None if cache_path isn't set."""
+        if not config.get('cache_path'):
+            return None
+        return cls(config['cache_path'], int(config.get('cache_max_mb', 1024) * 2 ** 20))
+
+    def get(self, key):
+        """Cached response of a request key (see request_key), None on a miss."""
+        with self._lock:
+            row = self._connection.execute('SELECT response FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._connection.execute('UPDATE responses SET last_access = ? WHERE key = ?', (time.time(), key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, response):
+        size = len(key) + len(response.encode())
+        with self._lock:
+            previous = self._connection.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            self._connection.execute('INSERT OR REPLACE INTO responses (key, response, size, last_access) '
+                                     'VALUES (?, ?, ?, ?)', (key, response, size, time.time()))
+            self._total_bytes += size - (previous[0] if previous else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Other processes may share the file, so start from the actual total
+        self._total_bytes = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        while self._total_bytes > self.max_bytes:
+            rows = self._connection.execute('SELECT key, size FROM responses ORDER BY last_access LIMIT 1000').fetchall()
+            if not rows:
+                break
+            evicted = []
+            for key, size in rows:
+                if self._total_bytes <= self.max_bytes:
+                    break
+                evicted.append((key,))
+                self._total_bytes -= size
+            self._connection.executemany('DELETE FROM responses WHERE key = ?', evicted)
+            self.evictions += len(evicted)
+
+    def stats(self):
+        """Hit/miss counters of this instance, and the number and total size of the cached responses."""
+        with self._lock:
+            entries = self._connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0,
+            'evictions': self.evictions,
+            'entries': entries,
+            'bytes': self._total_bytes,
+        }
+
+    def close(self):
+        self._connection.close()
@@ -0,0 +1,348 @@
+"""
+Resumable, fault-tolerant runs of the demo pipeline over many ways.
+
+analyze_road_sequence and AsyncRoadSequenceRunner.analyze_ways only return results at the
+end of a run, so a crash or a run of API errors loses everything. JobScheduler splits a run
+into units, one (osmid, sequence) of ways.csv each, and checkpoints every finished unit
+to a SQLite file in the job directory (units.sqlite). A restarted run only processes the
+units that are not finished.
+
+- A unit is done once every keyframe was answered, and its final summary too with
+  "aggregation": "llm". Otherwise it is queued again, up to max_attempts in total. Once
+  they are exhausted it is 'failed', and the answers of its last attempt are still used
+  in the predictions. With a response cache (cache_path of llm_config.json), a retry only
+  re-sends the requests that failed.
+- workers units are analyzed concurrently by the async runner, the images of a unit in
+  order.
+- shard and num_shards split a run across machines: each one takes the ways whose osmid
+  hashes (MD5, the same on every machine and Python run) to its shard, with all the
+  sequences of a way on the same shard.
+- progress() counts the done, failed and pending units and estimates the throughput and
+  the time left from the units finished recently. It is printed every progress_interval
+  seconds during a run, and by the status command from another process.
+- write_predictions() writes a predictions CSV for eval.py from one or several job
+  directories (e.g. the shards of a run), aggregated like the results of batch jobs.
+
+Usage:
+    python scheduler.py run path/to/job_dir [--workers 8] [--max-attempts 3] [--shard 0 --num-shards 4] [--store path/to/tile_store] [--osmids ...]
+    python scheduler.py status path/to/job_dir
+    python scheduler.py predictions path/to/job_dir [more job dirs ...] [--output path/to/predictions.csv]
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import argparse
+
+from async_runner import AsyncRoadSequenceRunner
+from keyframes import KeyframeSelector
+from response_cache import ResponseCache
+from predictions import results_to_predictions
+from aggregation import aggregate_predictions
+from batch_jobs import get_front_view_loader
+from tile_store import PHOTOS_DIR
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'evaluation_utils'))
+from metadata_cache import load_metadata  # noqa: E402
+
+STORE_NAME = 'units.sqlite'
+DEFAULT_MAX_ATTEMPTS = 3
+
+# Window of recently finished units the throughput is estimated from, in seconds
+RATE_WINDOW = 600
+
+
+def shard_of(osmid, num_shards):
+    """Shard of a way: MD5 of its osmid modulo num_shards, the same on every machine."""
+    return int(hashlib.md5(str(int(osmid)).encode()).hexdigest(), 16) % num_shards
+
+
+def unit_complete(keyframes, sequence_results, aggregation):
+    """Whether every keyframe of a unit was answered, and its final summary with the 'llm' aggregation."""
+    answers = sum(result['sequence_index'] != 'FINAL_SUMMARY' for result in sequence_results)
+    summaries = len(sequence_results) - answers
+    return answers == len(keyframes) and (aggregation == 'local' or summaries > 0 or not keyframes)
+
+
+def _to_json(value):
+    # numpy integers and booleans of the keyframes and match directions
+    return json.dumps(value, default=lambda item: item.item())
+
+
+class JobScheduler:
+    """
+    Args:
+        job_dir: directory of the job store, created if needed
+        shard: shard of the ways run by this scheduler, between 0 and num_shards - 1
+        num_shards: number of machines the run is split across
+        Both default to those of an existing store, else to a single shard.
+    """
+
+    def __init__(self, job_dir, shard=None, num_shards=None):
+        self.job_dir = job_dir
+        os.makedirs(job_dir, exist_ok=True)
+        self._connection = sqlite3.connect(os.path.join(job_dir, STORE_NAME), isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS units ('
+                                 'osmid INTEGER NOT NULL, sequence_id INTEGER NOT NULL, '
+                                 'sequence_indexes TEXT NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL, '
+                                 'results TEXT, error TEXT, updated REAL, PRIMARY KEY (osmid, sequence_id))')
+        stored_shard = self._get_meta('shard')
+        if stored_shard is None:
+            shard, num_shards = shard or 0, num_shards or 1
+            assert 0 <= shard < num_shards, f"Shard {shard} out of range for {num_shards} shards"
+            self._set_meta('shard', [shard, num_shards])
+        else:
+            assert shard in (None, stored_shard[0]) and num_shards in (None, stored_shard[1]), \
+                f"{job_dir} holds shard {stored_shard[0]} of {stored_shard[1]}, not {shard} of {num_shards}"
+            shard, num_shards = stored_shard
+        self.shard = shard
+        self.num_shards = num_shards
+
+    def _get_meta(self, key):
+        row = self._connection.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def _set_meta(self, key, value):
+        self._connection.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, json.dumps(value)))
+
+    def add_units(self, ways_df, osmids=None):
+        """
+        Add the sequences of the given ways of this shard (all ways of ways_df by default)
+        as pending units. Units already in the store are kept as they are. Returns the
+        number of added units.
+        """
+        if osmids is None:
+            osmids = ways_df['osmid'].tolist()
+        sequences_by_osmid = ways_df.set_index('osmid')['sequences']
+        units = [(int(osmid), int(sequence_id), _to_json([int(index) for index in sequence_indexes]))
+                 for osmid in osmids if shard_of(osmid, self.num_shards) == self.shard
+                 for sequence_id, sequence_indexes in sequences_by_osmid[osmid].items()]
+        before = self._connection.total_changes
+        self._connection.execute('BEGIN')
+        self._connection.executemany("INSERT OR IGNORE INTO units (osmid, sequence_id, sequence_indexes, status, "
+                                     "attempts) VALUES (?, ?, ?, 'pending', 0)", units)
+        self._connection.execute('COMMIT')
+        return self._connection.total_changes - before
+
+    def _record(self, osmid, sequence_id, status, attempts, sequence_results, error):
+        # An attempt that raised keeps the results of the previous one
+        results = _to_json(sequence_results) if sequence_results is not None else None
+        self._connection.execute('UPDATE units SET status = ?, attempts = ?, results = COALESCE(?, results), '
+                                 'error = ?, updated = ? WHERE osmid = ? AND sequence_id = ?',
+                                 (status, attempts, results, error, time.time(), osmid, sequence_id))
+
+    async def run(self, runner, photos_df, load_and_resize_image, get_front_view, workers=8,
+                  max_attempts=DEFAULT_MAX_ATTEMPTS, progress_interval=30):
+        """
+        Analyze the pending units with the runner (an AsyncRoadSequenceRunner, with its
+        config, cache, keyframes and aggregation), checkpointing every finished unit.
+        Failed units with attempts left, e.g. after raising max_attempts, are pending again.
+        Returns the progress at the end of the run.
+        """
+        match_directions = photos_df.set_index(['sequence_id', 'sequence_index'])['match_forward']
+        assert match_directions.index.is_unique, "Duplicate photos in photos.csv"
+        match_directions = match_directions.to_dict()
+        selector = KeyframeSelector(photos_df, runner.max_keyframes) if runner.max_keyframes else None
+        self._set_meta('aggregation', runner.aggregation)
+        self._connection.execute("UPDATE units SET status = 'pending' WHERE status = 'failed' AND attempts < ?",
+                                 (max_attempts,))
+        queue = asyncio.Queue()
+        for unit in self._connection.execute("SELECT osmid, sequence_id, sequence_indexes, attempts FROM units "
+                                             "WHERE status = 'pending' ORDER BY rowid"):
+            queue.put_nowait(unit)
+
+        async def worker():
+            # Workers wait for units until all are finished, since a unit in flight may be queued again
+            while True:
+                osmid, sequence_id, sequence_indexes, attempts = await queue.get()
+                try:
+                    await analyze(osmid, sequence_id, sequence_indexes, attempts + 1)
+                finally:
+                    queue.task_done()
+
+        async def analyze(osmid, sequence_id, sequence_indexes, attempts):
+            try:
+                keyframes, sequence_results = await runner.analyze_way_sequence(
+                    osmid, sequence_id, json.loads(sequence_indexes), match_directions, load_and_resize_image,
+                    get_front_view, selector)
+                complete = unit_complete(keyframes, sequence_results, runner.aggregation)
+                error = None if complete else \
+                    f"{sum(result['sequence_index'] != 'FINAL_SUMMARY' for result in sequence_results)} " \
+                    f"of {len(keyframes)} keyframes answered"
+            except Exception as e:
+                sequence_results, complete, error = None, False, f"{type(e).__name__}: {e}"
+            if complete:
+                self._record(osmid, sequence_id, 'done', attempts, sequence_results, None)
+            elif attempts < max_attempts:
+                # Retried after the other pending units, so a short outage can pass
+                self._record(osmid, sequence_id, 'pending', attempts, sequence_results, error)
+                queue.put_nowait((osmid, sequence_id, sequence_indexes, attempts))
+            else:
+                print(f"  Unit {osmid}:{sequence_id} failed after {attempts} attempts: {error}")
+                self._record(osmid, sequence_id, 'failed', attempts, sequence_results, error)
+
+        async def report():
+            while True:
+                await asyncio.sleep(progress_interval)
+                print(format_progress(self.progress()))
+
+        reporter = asyncio.create_task(report()) if progress_interval else None
+        worker_tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+        joined = asyncio.create_task(queue.join())
+        try:
+            # Workers only stop on an error (e.g. of the store), which is raised instead of waiting forever
+            await asyncio.wait([joined, *worker_tasks], return_when=asyncio.FIRST_COMPLETED)
+            for task in worker_tasks:
+                if task.done():
+                    task.result()
+        finally:
+            for task in [joined, *worker_tasks]:
+                task.cancel()
+            await asyncio.gather(joined, *worker_tasks, return_exceptions=True)
+            if reporter is not None:
+                reporter.cancel()
+            runner.telemetry.flush()
+        progress = self.progress()
+        print(format_progress(progress))
+        return progress
+
+    def progress(self, rate_window=RATE_WINDOW):
+        """
+        Units per status, the throughput (finished units per second over the last
+        rate_window seconds with finished units) and the estimated seconds left.
+        """
+        counts = dict(self._connection.execute('SELECT status, COUNT(*) FROM units GROUP BY status').fetchall())
+        retrying = self._connection.execute("SELECT COUNT(*) FROM units "
+                                            "WHERE status = 'pending' AND attempts > 0").fetchone()[0]
+        finished = [updated for updated, in self._connection.execute(
+            "SELECT updated FROM units WHERE status != 'pending' AND updated >= "
+            "(SELECT MAX(updated) FROM units WHERE status != 'pending') - ? ORDER BY updated", (rate_window,))]
+        rate = None
+        if len(finished) > 1 and finished[-1] > finished[0]:
+            rate = (len(finished) - 1) / (finished[-1] - finished[0])
+        pending = counts.get('pending', 0)
+        return {
+            'total': sum(counts.values()),
+            'done': counts.get('done', 0),
+            'failed': counts.get('failed', 0),
+            'pending': pending,
+            'retrying': retrying,
+            'units_per_second': rate,
+            'eta_seconds': pending / rate if rate else (0.0 if not pending else None),
+        }
+
+    def results(self):
+        """
+        Results of the units so far, in the format of analyze_road_sequence:
+        {osmid: [{sequence_id: sequence_results}]}, with every way of the store.
+        """
+        results = {}
+        for osmid, sequence_id, sequence_results in self._connection.execute(
+                'SELECT osmid, sequence_id, results FROM units ORDER BY rowid'):
+            way_results = results.setdefault(osmid, [])
+            if sequence_results is not None:
+                way_results.append({sequence_id: json.loads(sequence_results)})
+        return results
+
+    def errors(self):
+        """Last error of every unit that isn't done, as (osmid, sequence_id, status, attempts, error) rows."""
+        return self._connection.execute("SELECT osmid, sequence_id, status, attempts, error FROM units "
+                                        "WHERE status != 'done' AND error IS NOT NULL ORDER BY rowid").fetchall()
+
+    @property
+    def aggregation(self):
+        return self._get_meta('aggregation') or 'llm'
+
+    def close(self):
+        self._connection.close()
+
+
+def format_progress(progress):
+    """One-line summary of JobScheduler.progress()."""
+    line = (f"{progress['done']}/{progress['total']} units done, {progress['failed']} failed, "
+            f"{progress['pending']} pending ({progress['retrying']} retrying)")
+    if progress['units_per_second']:
+        line += f", {progress['units_per_second']:.2f} units/s"
+    if progress['eta_seconds'] is not None:
+        line += f", ETA {time.strftime('%H:%M:%S', time.gmtime(progress['eta_seconds']))}"
+    return line
+
+
+def write_predictions(job_dirs, path):
+    """
+    Write the predictions of the units of one or several job directories (the shards of a
+    run) to path, aggregated with aggregate_predictions for jobs run with the 'local'
+    aggregation, else with results_to_predictions.
+    """
+    results, aggregations = {}, set()
+    for job_dir in job_dirs:
+        assert os.path.exists(os.path.join(job_dir, STORE_NAME)), f"No job in {job_dir}"
+        scheduler = JobScheduler(job_dir)
+        aggregations.add(scheduler.aggregation)
+        for osmid, way_results in scheduler.results().items():
+            results.setdefault(osmid, []).extend(way_results)
+        scheduler.close()
+    assert len(aggregations) == 1, f"Jobs run with different aggregations: {aggregations}"
+    if aggregations.pop() == 'local':
+        predictions_df = aggregate_predictions(results)
+    else:
+        predictions_df = results_to_predictions(results)
+    predictions_df.to_csv(path, index=False)
+    print(f"Predictions of {len(predictions_df)} ways saved to {path}")
+    return path
+
+
+if __name__ == "__main__":
+    metadata_dir = os.path.join(os.path.dirname(PHOTOS_DIR), 'metadata')
+    parser = argparse.ArgumentParser(description="Resumable runs of the demo pipeline over many ways.")
+    parser.add_argument("command", choices=['run', 'status', 'predictions'])
+    parser.add_argument("job_dirs", type=str, nargs='+', help="Job directory (several for predictions).")
+    parser.add_argument("--config", type=str, help="LLM config (defaults to llm_config.json).",
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'llm_config.json'))
+    parser.add_argument("--ways", type=str, help="ways.csv of the run.", default=os.path.join(metadata_dir, 'ways.csv'))
+    parser.add_argument("--photos", type=str, help="photos.csv of the run.", default=os.path.join(metadata_dir, 'photos.csv'))
+    parser.add_argument("--osmids", type=int, nargs='+', help="Ways of the run (defaults to all ways).", default=None)
+    parser.add_argument("--workers", type=int, help="Units analyzed concurrently (defaults to max_concurrency).",
+                        default=None)
+    parser.add_argument("--max-attempts", type=int, help="Attempts per unit.", default=DEFAULT_MAX_ATTEMPTS)
+    parser.add_argument("--shard", type=int, help="Shard of the ways run on this machine (defaults to that of an "
+                        "existing job, else 0).", default=None)
+    parser.add_argument("--num-shards", type=int, help="Number of machines the run is split across (defaults to that "
+                        "of an existing job, else 1).", default=None)
+    parser.add_argument("--progress-interval", type=float, help="Seconds between progress lines.", default=30)
+    parser.add_argument("--store", type=str, help="Tile store to take the front views from (optional).", default=None)
+    parser.add_argument("--photos-dir", type=str, help="Photos directory, if no tile store is given.", default=PHOTOS_DIR)
+    parser.add_argument("--output", type=str, help="Predictions CSV (defaults to predictions.csv in the job directory).",
+                        default=None)
+    args = parser.parse_args()
+
+    if args.command == 'predictions':
+        write_predictions(args.job_dirs, args.output or os.path.join(args.job_dirs[0], 'predictions.csv'))
+    else:
+        if len(args.job_dirs) > 1:
+            parser.error(f"{args.command} takes a single job directory")
+        job_dir = args.job_dirs[0]
+        if args.command == 'status':
+            assert os.path.exists(os.path.join(job_dir, STORE_NAME)), f"No job in {job_dir}"
+            scheduler = JobScheduler(job_dir)
+            print(format_progress(scheduler.progress()))
+            for osmid, sequence_id, status, attempts, error in scheduler.errors():
+                print(f"  {osmid}:{sequence_id} {status} after {attempts} attempts: {error}")
+        else:
+            with open(args.config) as f:
+                config = json.load(f)
+            scheduler = JobScheduler(job_dir, args.shard, args.num_shards)
+            added = scheduler.add_units(load_metadata(args.ways), args.osmids)
+            print(f"{added} new units in {job_dir} (shard {scheduler.shard} of {scheduler.num_shards})")
+            runner = AsyncRoadSequenceRunner(config, cache=ResponseCache.from_config(config))
+            progress = asyncio.run(scheduler.run(runner, load_metadata(args.photos),
+                                                 get_front_view_loader(args.store, args.photos_dir), lambda image: image,
+                                                 args.workers or config.get('max_concurrency') or 8, args.max_attempts,
+                                                 args.progress_interval))
+            if not progress['pending']:
+                write_predictions([job_dir], args.output or os.path.join(job_dir, 'predictions.csv'))
@@ -0,0 +1,203 @@
+"""
+Spatial matching of photos and ways.
+
+WayIndex holds the LINESTRINGs of ways.csv or ground_truth.geojson in an STRtree, in a
+local metric projection. match_photos() snaps all photo POINTs to their nearest way in
+one vectorized query, and derives match_forward from the photo heading and the bearing
+of the way at the snapped point. build_sequences() turns the matches back into the
+sequences column of ways.csv, so new imagery (e.g. extra_photos.csv) can be attached
+to ways without a precomputed mapping.
+
+PhotoIndex looks photos up by (sequence_id, sequence_index) with a hash index, instead
+of filtering photos_df for every image.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely import STRtree
+from shapely.geometry import shape
+
+# Meters per degree of latitude (and of longitude at the equator)
+METERS_PER_DEGREE = 111320
+
+# Meters before and after the snapped point between which the bearing of a way is taken
+BEARING_STEP = 1.0
+
+# Photo keys pack the sequence index in the low bits of a 64-bit integer
+SEQUENCE_INDEX_BITS = 20
+
+
+def to_geometries(values):
+    """Array of shapely geometries from WKT strings or geometries."""
+    values = np.asarray(values, dtype=object)
+    if len(values) and isinstance(values[0], str):
+        return shapely.from_wkt(values)
+    return values
+
+
+def load_ways(path):
+    """osmid and shapely geometry of the ways in ways.csv or ground_truth.geojson."""
+    if path.endswith('.geojson') or path.endswith('.json'):
+        with open(path) as f:
+            features = json.load(f)['features']
+        return pd.DataFrame({'osmid': [feature['properties']['osmid'] for feature in features],
+                             'geometry': [shape(feature['geometry']) for feature in features]})
+    ways_df = pd.read_csv(path, usecols=['osmid', 'geometry'])
+    ways_df['geometry'] = to_geometries(ways_df['geometry'])
+    return ways_df
+
+
+def angle_difference(a, b):
+    """Absolute difference in degrees between compass angles, in [0, 180]."""
+    return np.abs((np.asarray(a) - b + 180) % 360 - 180)
+
+
+class WayIndex:
+    """
+    STRtree of way geometries in a local equirectangular projection (meters), centered on
+    the mean latitude of the ways, which is accurate enough at city scale.
+    """
+
+    def __init__(self, osmids, geometries):
+        geometries = to_geometries(geometries)
+        self.osmids = np.asarray(osmids)
+        assert len(self.osmids) == len(geometries), "One osmid per geometry expected"
+        self.osmid_rows = pd.Index(self.osmids)
+        assert self.osmid_rows.is_unique, "Duplicate osmids in the ways"
+        latitude = np.mean(shapely.bounds(geometries)[:, [1, 3]])
+        self.scale = np.array([METERS_PER_DEGREE * np.cos(np.radians(latitude)), METERS_PER_DEGREE])
+        self.lines = self.project(geometries)
+        self.tree = STRtree(self.lines)
+
+    @classmethod
+    def from_ways_df(cls, ways_df):
+        return cls(ways_df['osmid'], ways_df['geometry'])
+
+    @classmethod
+    def from_file(cls, path):
+        """Index of the ways in ways.csv or ground_truth.geojson."""
+        return cls.from_ways_df(load_ways(path))
+
+    def project(self, geometries):
+        """(lon, lat) geometries in the metric projection of the index."""
+        return shapely.transform(to_geometries(geometries), lambda coords: coords * self.scale)
+
+    def bearings(self, way_rows, points):
+        """Compass bearings in degrees of the ways at the given rows where they pass closest to projected points."""
+        lines = self.lines[way_rows]
+        distances = shapely.line_locate_point(lines, points)
+        lengths = shapely.length(lines)
+        start = shapely.line_interpolate_point(lines, np.clip(distances - BEARING_STEP, 0, lengths))
+        end = shapely.line_interpolate_point(lines, np.clip(distances + BEARING_STEP, 0, lengths))
+        dx = shapely.get_x(end) - shapely.get_x(start)
+        dy = shapely.get_y(end) - shapely.get_y(start)
+        return np.degrees(np.arctan2(dx, dy)) % 360
+
+    def way_bearings(self, osmids, geometries):
+        """Bearings of the given ways at photo geometries (NaN for osmids not in the index)."""
+        way_rows = self.osmid_rows.get_indexer(np.asarray(osmids))
+        bearings = np.full(len(way_rows), np.nan)
+        known = way_rows >= 0
+        points = self.project(to_geometries(geometries)[known])
+        bearings[known] = self.bearings(way_rows[known], points)
+        return bearings
+
+    def match_photos(self, photos_df, max_distance=25.0, heading_weight=0.5):
+        """
+        Snap every photo of photos_df (geometry, heading) to a nearby way.
+
+        All ways within max_distance meters of a photo are candidates. At junctions a
+        photo is close to several ways, so the candidate with the lowest distance plus
+        heading_weight meters per degree between the photo heading and the way's axis
+        (0° when driving along the way in either direction, 90° when crossing it) wins.
+
+        Returns a dataframe aligned with photos_df with sequence_id, sequence_index, osmid,
+        distance (meters), bearing of the way and match_forward (heading within 90° of
+        the bearing). Photos without any way within max_distance get a missing osmid and
+        match_forward.
+        """
+        points = self.project(photos_df['geometry'])
+        headings = photos_df['heading'].to_numpy(dtype=float)
+        photo_rows, way_rows = self.tree.query(points, predicate='dwithin', distance=max_distance)
+        distances = shapely.distance(points[photo_rows], self.lines[way_rows])
+        bearings = self.bearings(way_rows, points[photo_rows])
+        heading_difference = angle_difference(headings[photo_rows], bearings)
+        cost = distances + heading_weight * np.minimum(heading_difference, 180 - heading_difference)
+        # Best candidate of every photo: first of each photo after sorting by photo and cost
+        order = np.lexsort((cost, photo_rows))
+        best = order[np.unique(photo_rows[order], return_index=True)[1]]
+        photo_rows, way_rows = photo_rows[best], way_rows[best]
+
+        osmid = np.zeros(len(points), dtype=np.int64)
+        osmid[photo_rows] = self.osmids[way_rows]
+        unmatched = np.ones(len(points), dtype=bool)
+        unmatched[photo_rows] = False
+        distance = np.full(len(points), np.nan)
+        distance[photo_rows] = distances[best]
+        bearing = np.full(len(points), np.nan)
+        bearing[photo_rows] = bearings[best]
+        match_forward = angle_difference(headings, bearing) <= 90
+
+        return pd.DataFrame({
+            'sequence_id': photos_df['sequence_id'].to_numpy(),
+            'sequence_index': photos_df['sequence_index'].to_numpy(),
+            'osmid': pd.arrays.IntegerArray(osmid, unmatched),
+            'distance': distance,
+            'bearing': bearing,
+            'match_forward': pd.arrays.BooleanArray(match_forward, unmatched),
+        })
+
+
+def build_sequences(matched_df):
+    """
+    The sequences column of ways.csv from matched photos: one row per osmid with a dict
+    {sequence_id: [sequence_index, ...]}, indexes in increasing order. Unmatched photos are
+    ignored.
+    """
+    matched_df = matched_df[matched_df['osmid'].notna()]
+    sequence_indexes = (matched_df.sort_values(['osmid', 'sequence_id', 'sequence_index'])
+                        .groupby(['osmid', 'sequence_id'], sort=False)['sequence_index'].agg(list))
+    sequences = {}
+    for (osmid, sequence_id), indexes in sequence_indexes.items():
+        sequences.setdefault(int(osmid), {})[int(sequence_id)] = [int(index) for index in indexes]
+    return pd.DataFrame({'osmid': list(sequences), 'sequences': list(sequences.values())})
+
+
+def photo_keys(sequence_ids, sequence_indexes):
+    """Unique 64-bit keys of (sequence_id, sequence_index) pairs."""
+    sequence_ids = np.asarray(sequence_ids, dtype=np.int64)
+    sequence_indexes = np.asarray(sequence_indexes, dtype=np.int64)
+    assert np.all((0 <= sequence_indexes) & (sequence_indexes < 2 ** SEQUENCE_INDEX_BITS)), "Sequence index out of range"
+    assert np.all((0 <= sequence_ids) & (sequence_ids < 2 ** (63 - SEQUENCE_INDEX_BITS))), "Sequence id out of range"
+    return (sequence_ids << SEQUENCE_INDEX_BITS) | sequence_indexes
+
+
+class PhotoIndex:
+    """Constant-time lookup of the photos of photos_df by (sequence_id, sequence_index)."""
+
+    def __init__(self, photos_df):
+        self.photos_df = photos_df.reset_index(drop=True)
+        self.keys = pd.Index(photo_keys(self.photos_df['sequence_id'], self.photos_df['sequence_index']))
+        assert self.keys.is_unique, "Duplicate photos in photos_df"
+
+    def __len__(self):
+        return len(self.photos_df)
+
+    def __contains__(self, key):
+        return int(photo_keys([key[0]], [key[1]])[0]) in self.keys
+
+    def row(self, sequence_id, sequence_index):
+        """Row of a photo in photos_df (KeyError if it isn't there)."""
+        return self.keys.get_loc(int(photo_keys([sequence_id], [sequence_index])[0]))
+
+    def rows(self, sequence_ids, sequence_indexes):
+        """Rows of many photos at once, -1 for photos not in photos_df."""
+        return self.keys.get_indexer(photo_keys(sequence_ids, sequence_indexes))
+
+    def get(self, sequence_id, sequence_index, column):
+        return self.photos_df[column].iat[self.row(sequence_id, sequence_index)]
+
+    def match_forward(self, sequence_id, sequence_index):
+        return self.get(sequence_id, sequence_index, 'match_forward')
@@ -0,0 +1,138 @@
+"""
+Local OpenAI-compatible chat completions endpoint, to check clients without an API key.
+
+StubLLMServer answers POST .../chat/completions with a fixed answer, after an optional
+delay, and can fail on purpose: with status 500 (or any status) on every request, or on
+every fail_every-th request. It counts the requests it received.
+
+Usage (in Python, e.g. to check the routing of LLMClientFactory):
+    with StubLLMServer() as healthy, StubLLMServer(status=500) as failing:
+        config['endpoints'] = [{'base_url': healthy.url, 'api_key': 'stub'},
+                               {'base_url': failing.url, 'api_key': 'stub'}]
+
+get_stub_config() is llm_config.json for the stub endpoint, without cache and telemetry
+files, as used by the test_*.py modules.
+
+Usage (standalone):
+    python stub_llm_server.py --port 8001 [--status 500] [--delay 0.5]
+"""
+import os
+import json
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DEFAULT_ANSWER = json.dumps({'reasoning': 'Stub answer.', 'oneway': 'no', 'lanes': '2'})
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'llm_config.json')
+
+
+def get_stub_config():
+    """llm_config.json with the 'stub' model, without the cache and telemetry files."""
+    with open(CONFIG_PATH) as f:
+        config = json.load(f)
+    return {**config, 'model': 'stub', 'cache_path': None, 'telemetry_path': None}
+
+
+class _Server(ThreadingHTTPServer):
+    # Bursts of concurrent clients shouldn't be refused by a short listen queue
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class StubLLMServer:
+    """
+    Args:
+        port: port to listen on, 0 for any free port
+        answer: content of every answer
+        delay: seconds before answering
+        status: HTTP status of every answer (200, or e.g. 500 or 429 to fail on purpose)
+        fail_every: also answer every fail_every-th request with a 500
+    """
+
+    def __init__(self, port=0, answer=DEFAULT_ANSWER, delay=0.0, status=200, fail_every=None):
+        self.answer = answer
+        self.delay = delay
+        self.status = status
+        self.fail_every = fail_every
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = _Server(('127.0.0.1', port), self._handler_class())
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, like real endpoints
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                with server._lock:
+                    server.requests += 1
+                    count = server.requests
+                if server.delay:
+                    time.sleep(server.delay)
+                status = server.status
+                if server.fail_every and count % server.fail_every == 0:
+                    status = 500
+                if not self.path.endswith('/chat/completions'):
+                    status = 404
+                if status == 200:
+                    payload = {
+                        'id': f'chatcmpl-stub-{count}', 'object': 'chat.completion', 'created': int(time.time()),
+                        'model': body.get('model', 'stub'),
+                        'choices': [{'index': 0, 'finish_reason': 'stop',
+                                     'message': {'role': 'assistant', 'content': server.answer}}],
+                        'usage': {'prompt_tokens': 100, 'completion_tokens': 20, 'total_tokens': 120},
+                    }
+                else:
+                    payload = {'error': {'message': f'Stub error {status}', 'type': 'server_error', 'code': status}}
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local OpenAI-compatible chat completions endpoint.")
+    parser.add_argument("--port", type=int, help="Port to listen on.", default=8001)
+    parser.add_argument("--status", type=int, help="HTTP status of every answer (e.g. 500 to fail).", default=200)
+    parser.add_argument("--delay", type=float, help="Seconds before answering.", default=0.0)
+    parser.add_argument("--fail-every", type=int, help="Fail every n-th request with a 500.", default=None)
+    args = parser.parse_args()
+
+    stub = StubLLMServer(args.port, delay=args.delay, status=args.status, fail_every=args.fail_every)
+    print(f"Stub endpoint listening on {stub.url}")
+    try:
+        stub._server.serve_forever()
+    except KeyboardInterrupt:
+        stub.stop()
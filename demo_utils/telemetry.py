@@ -0,0 +1,281 @@
+"""
+Telemetry of the demo pipeline: where the time and the tokens of a run go.
+
+Telemetry records one row per pipeline stage of every image and request:
+    load         reading and resizing the photo
+    crop         cutting the front view
+    encode       encoding the front view for the request (payload_bytes of the image)
+    api          an image request (latency, prompt/completion tokens from response.usage,
+                 payload_bytes of the messages, attempts, error, cached)
+    aggregation  the final summary request of a sequence (same fields as api)
+Records carry the osmid, sequence_id and sequence_index of the work they belong to,
+set once with telemetry_scope() around a way, sequence or image (the scope follows
+asyncio tasks and asyncio.to_thread). They are appended to a JSONL file, or kept in
+memory without a path.
+
+summarize_telemetry() reports the p50/p95/p99 latency of every stage, the throughput
+of every run, and the requests, tokens, payload, retries, errors and cost of every way.
+Given an issues_{uid}.csv of eval.py, it also joins the way costs with the evaluated
+tags on osmid, to weigh cost against accuracy per tag.
+
+Usage:
+    python telemetry.py path/to/telemetry.jsonl [--issues ../evaluation_results/issues_{uid}.csv] [--output prefix]
+"""
+import os
+import json
+import time
+import argparse
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+STAGES = ['load', 'crop', 'encode', 'api', 'aggregation']
+REQUEST_STAGES = ['api', 'aggregation']
+
+# Fields (osmid, sequence_id, sequence_index) of the work in progress, added to every record
+_SCOPE = contextvars.ContextVar('telemetry_scope', default={})
+
+
+@contextmanager
+def telemetry_scope(**fields):
+    """Add fields to the records of the enclosed code, including its tasks and threads."""
+    token = _SCOPE.set({**_SCOPE.get(), **fields})
+    try:
+        yield
+    finally:
+        _SCOPE.reset(token)
+
+
+def message_bytes(messages):
+    """Bytes of the text and image URLs of request messages."""
+    size = 0
+    for message in messages:
+        content = message['content']
+        if isinstance(content, str):
+            size += len(content)
+            continue
+        for item in content:
+            size += len(item['text']) if item['type'] == 'text' else len(item['image_url']['url'])
+    return size
+
+
+def usage_fields(response):
+    """prompt_tokens and completion_tokens of a chat completion, None if the API didn't report them."""
+    usage = getattr(response, 'usage', None)
+    if usage is None:
+        return {'prompt_tokens': None, 'completion_tokens': None}
+    return {'prompt_tokens': usage.prompt_tokens, 'completion_tokens': usage.completion_tokens}
+
+
+class Telemetry:
+    """
+    Thread-safe record log of a run.
+
+    Args:
+        path: JSONL file the records are appended to, None to keep them in memory
+        run_id: id of the run in the records, defaults to the start time
+    """
+
+    def __init__(self, path=None, run_id=None):
+        self.path = path
+        self.run_id = run_id or datetime.now().strftime('%Y%m%d%H%M%S_%f')
+        self.records = [] if path is None else None
+        self._file = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, run_id=None):
+        """Telemetry written to the telemetry_path key of llm_config.json (in memory if it isn't set)."""
+        return cls(config.get('telemetry_path'), run_id)
+
+    def record(self, stage, **fields):
+        record = {'time': time.time(), 'run_id': self.run_id, 'stage': stage, **_SCOPE.get(), **fields}
+        with self._lock:
+            if self.path is None:
+                self.records.append(record)
+                return
+            if self._file is None:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                # Line buffered, so records are on disk as they come and runners can share a file
+                self._file = open(self.path, 'a', buffering=1)
+            self._file.write(json.dumps(record, default=str) + '\n')
+
+    @contextmanager
+    def stage(self, stage, **fields):
+        """
+        Record the duration of the enclosed code, and its error if it raises. The yielded
+        dict can be filled with more fields of the record (e.g. payload_bytes).
+        """
+        start = time.perf_counter()
+        error = None
+        try:
+            yield fields
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self.record(stage, duration=time.perf_counter() - start, error=error, **fields)
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def records_df(self):
+        """Records so far as a dataframe."""
+        if self.path is None:
+            with self._lock:
+                return records_to_df(list(self.records))
+        self.flush()
+        return load_records(self.path)
+
+
+def records_to_df(records):
+    columns = ['time', 'run_id', 'stage', 'osmid', 'sequence_id', 'sequence_index', 'duration', 'error',
+               'attempts', 'cached', 'payload_bytes', 'prompt_tokens', 'completion_tokens']
+    records_df = pd.DataFrame(records)
+    for column in columns:
+        if column not in records_df.columns:
+            records_df[column] = None
+    return records_df
+
+
+def load_records(path):
+    """Records of a telemetry JSONL file."""
+    with open(path) as f:
+        return records_to_df([json.loads(line) for line in f if line.strip()])
+
+
+def stage_summary(records_df):
+    """Per stage: records, errors, retries, total seconds and mean/p50/p95/p99 latency in seconds."""
+    records_df = records_df.assign(failed=records_df['error'].notna(),
+                                   retries=pd.to_numeric(records_df['attempts']).fillna(1) - 1,
+                                   duration=pd.to_numeric(records_df['duration']))
+    summary = records_df.groupby('stage').agg(
+        records=('duration', 'size'), errors=('failed', 'sum'), retries=('retries', 'sum'),
+        total=('duration', 'sum'), mean=('duration', 'mean'), p50=('duration', 'median'),
+        p95=('duration', lambda duration: duration.quantile(0.95)),
+        p99=('duration', lambda duration: duration.quantile(0.99)))
+    order = [stage for stage in STAGES if stage in summary.index]
+    return summary.loc[order + [stage for stage in summary.index if stage not in STAGES]].reset_index()
+
+
+def throughput(records_df):
+    """Per run: wall seconds, ways, requests, ways per hour and requests per second."""
+    records_df = records_df.assign(start=records_df['time'] - pd.to_numeric(records_df['duration']).fillna(0))
+    requests_df = records_df[records_df['stage'].isin(REQUEST_STAGES)]
+    summary = records_df.groupby('run_id').agg(start=('start', 'min'), end=('time', 'max'),
+                                               ways=('osmid', 'nunique'))
+    summary['requests'] = requests_df.groupby('run_id').size().reindex(summary.index, fill_value=0)
+    summary['seconds'] = summary['end'] - summary['start']
+    seconds = summary['seconds'].where(summary['seconds'] > 0)
+    summary['ways_per_hour'] = summary['ways'] / seconds * 3600
+    summary['requests_per_second'] = summary['requests'] / seconds
+    return summary.drop(columns=['start', 'end']).reset_index()
+
+
+def way_summary(records_df, prompt_price=None, completion_price=None):
+    """
+    Per osmid: sequences, requests (cache hits excluded), cached requests, retries, failed
+    requests, prompt and completion tokens, request payload bytes, seconds waiting for
+    the API, seconds of all stages and cost in USD (prices per million tokens, NaN
+    without prices). Joinable with issues_{uid}.csv on osmid.
+    """
+    records_df = records_df[records_df['osmid'].notna()]
+    requests_df = records_df[records_df['stage'].isin(REQUEST_STAGES)]
+    cached = requests_df['cached'].fillna(False).astype(bool)
+    requests_df = requests_df.assign(
+        sent=~cached, cached=cached, failed=requests_df['error'].notna(),
+        retries=pd.to_numeric(requests_df['attempts']).fillna(1) - 1,
+        prompt_tokens=pd.to_numeric(requests_df['prompt_tokens']),
+        completion_tokens=pd.to_numeric(requests_df['completion_tokens']),
+        payload_bytes=pd.to_numeric(requests_df['payload_bytes']),
+        api_seconds=pd.to_numeric(requests_df['duration']).where(~cached, 0))
+    summary = requests_df.groupby('osmid').agg(
+        requests=('sent', 'sum'), cached_requests=('cached', 'sum'), retries=('retries', 'sum'),
+        errors=('failed', 'sum'), prompt_tokens=('prompt_tokens', 'sum'),
+        completion_tokens=('completion_tokens', 'sum'), payload_bytes=('payload_bytes', 'sum'),
+        api_seconds=('api_seconds', 'sum'))
+    summary.insert(0, 'sequences', records_df.groupby('osmid')['sequence_id'].nunique())
+    summary['seconds'] = pd.to_numeric(records_df['duration']).groupby(records_df['osmid']).sum()
+    if prompt_price is not None and completion_price is not None:
+        summary['cost'] = (summary['prompt_tokens'] * prompt_price +
+                           summary['completion_tokens'] * completion_price) / 1e6
+    else:
+        summary['cost'] = np.nan
+    summary.index = summary.index.astype('int64')
+    return summary.reset_index()
+
+
+def join_issues(ways_df, issues_df):
+    """Rows of issues_{uid}.csv (osmid, tag, issue_type, ...) with the telemetry of their way."""
+    return issues_df.merge(ways_df, on='osmid', how='left')
+
+
+def tag_summary(ways_df, issues_df):
+    """
+    Per tag of issues_{uid}.csv: evaluated ways, TP, FP, FN and mismatches, with the tokens
+    and cost of those ways and the tokens and cost per TP. A request predicts all tags at
+    once, so the cost of a way counts for every tag evaluated on it.
+    """
+    joined = join_issues(ways_df, issues_df)
+    joined['tokens'] = joined['prompt_tokens'] + joined['completion_tokens']
+    counts = pd.crosstab(joined['tag'], joined['issue_type']).reindex(columns=['TP', 'FP', 'FN', 'Mismatch'],
+                                                                      fill_value=0)
+    counts.columns = ['tp', 'fp', 'fn', 'mismatch']
+    summary = joined.groupby('tag').agg(ways=('osmid', 'nunique'), tokens=('tokens', 'sum'),
+                                        cost=('cost', lambda cost: cost.sum(min_count=1)))
+    summary = summary.join(counts)
+    tp = summary['tp'].where(summary['tp'] > 0)
+    summary['tokens_per_tp'] = summary['tokens'] / tp
+    summary['cost_per_tp'] = summary['cost'] / tp
+    return summary.reset_index()
+
+
+def summarize_telemetry(records_df, issues_df=None, prompt_price=None, completion_price=None):
+    """
+    Tables of a run: stages (stage_summary), throughput, ways (way_summary) and, with an
+    issues dataframe of eval.py, tags (tag_summary).
+    """
+    summary = {
+        'stages': stage_summary(records_df),
+        'throughput': throughput(records_df),
+        'ways': way_summary(records_df, prompt_price, completion_price),
+    }
+    if issues_df is not None:
+        summary['tags'] = tag_summary(summary['ways'], issues_df)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize the telemetry of demo pipeline runs.")
+    parser.add_argument("telemetry_path", type=str, help="Path to the telemetry JSONL file.")
+    parser.add_argument("--issues", type=str, help="issues_{uid}.csv of eval.py, to report cost per tag.",
+                        default=None)
+    parser.add_argument("--config", type=str, help="LLM config with the token prices (defaults to llm_config.json).",
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'llm_config.json'))
+    parser.add_argument("--output", type=str, help="Prefix of the CSV files of the tables (optional).", default=None)
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        config = json.load(f)
+    issues_df = pd.read_csv(args.issues) if args.issues else None
+    summary = summarize_telemetry(load_records(args.telemetry_path), issues_df,
+                                  config.get('prompt_token_price'), config.get('completion_token_price'))
+    for name, table in summary.items():
+        print(f"\n{name}:")
+        print(table.to_markdown(index=False))
+        if args.output:
+            table.to_csv(f"{args.output}_{name}.csv", index=False)
@@ -0,0 +1,171 @@
+"""
+Tests of the endpoint pool of LLMClientFactory.py against local stub endpoints
+(stub_llm_server.py): routing, failover and health of the endpoints.
+
+Usage:
+    python test_LLMClientFactory.py
+"""
+import os
+import json
+import asyncio
+import tempfile
+
+import openai
+
+from LLMClientFactory import Endpoint, EndpointPool, PooledClient, AsyncPooledClient, LLMClientFactory
+from stub_llm_server import StubLLMServer, DEFAULT_ANSWER
+
+MESSAGES = [{'role': 'user', 'content': 'Describe the road.'}]
+
+
+def get_pool(stubs, weights=None, routing='round_robin', failure_threshold=2, cooldown=60.0):
+    weights = weights or [1] * len(stubs)
+    endpoints = [Endpoint(stub.url, 'stub', weight) for stub, weight in zip(stubs, weights)]
+    return EndpointPool(endpoints, routing, failure_threshold, cooldown)
+
+
+def create(client):
+    return client.chat.completions.create(model='stub', messages=MESSAGES).choices[0].message.content
+
+
+def test_failover():
+    """Requests failing on an endpoint go to the next one, and an endpoint failing in a row is skipped."""
+    print("\nTesting failover from a failing endpoint:")
+    with StubLLMServer(status=500) as failing, StubLLMServer() as healthy:
+        pool = get_pool([failing, healthy])
+        client = PooledClient(pool)
+        responses = [create(client) for _ in range(6)]
+        stats = pool.stats()
+    print(f"  Requests: failing {failing.requests} (expected: 2), healthy {healthy.requests} (expected: 6)")
+    assert responses == [DEFAULT_ANSWER] * 6, f"All requests should be answered, got {responses}"
+    # Sent once per request (max_retries=0), until failure_threshold failures in a row
+    assert failing.requests == 2, f"Failing endpoint should be skipped after 2 failures, got {failing.requests}"
+    assert healthy.requests == 6, f"Healthy endpoint should answer every request, got {healthy.requests}"
+    assert not stats[0]['healthy'] and stats[0]['failures'] == 2, f"Failing endpoint should be unhealthy: {stats[0]}"
+    assert stats[1]['healthy'] and stats[1]['failures'] == 0, f"Healthy endpoint should stay healthy: {stats[1]}"
+    print("  ✓ Requests failed over and the failing endpoint skipped!")
+
+
+def test_all_endpoints_failing():
+    """When every endpoint fails, each is tried once and the last error is raised to the caller."""
+    print("\nTesting a pool where every endpoint fails:")
+    with StubLLMServer(status=500) as first, StubLLMServer(status=429) as second:
+        client = PooledClient(get_pool([first, second]))
+        try:
+            create(client)
+            raise AssertionError("Request should fail when every endpoint fails")
+        except (openai.InternalServerError, openai.RateLimitError) as e:
+            error = e
+    print(f"  Requests: {first.requests} and {second.requests} (expected: 1 and 1), error: {type(error).__name__}")
+    assert (first.requests, second.requests) == (1, 1), \
+        f"Each endpoint should get the request once, got {first.requests} and {second.requests}"
+    print("  ✓ Last error raised after trying every endpoint once!")
+
+
+def test_bad_request_not_failed_over():
+    """Errors of the request itself (e.g. 400) would fail on any endpoint, so they are raised at once."""
+    print("\nTesting that a bad request is not failed over:")
+    with StubLLMServer(status=400) as first, StubLLMServer() as second:
+        pool = get_pool([first, second])
+        try:
+            create(PooledClient(pool))
+            raise AssertionError("Bad request should be raised")
+        except openai.BadRequestError:
+            pass
+        stats = pool.stats()
+    print(f"  Requests: {first.requests} and {second.requests} (expected: 1 and 0)")
+    assert (first.requests, second.requests) == (1, 0), "Bad request should only be sent to the first endpoint"
+    assert stats[0]['healthy'] and stats[0]['outstanding'] == 0, f"Bad request shouldn't count against {stats[0]}"
+    print("  ✓ Bad request raised without failover!")
+
+
+def test_weighted_round_robin():
+    """Requests are spread over healthy endpoints by weight."""
+    print("\nTesting weighted round robin:")
+    with StubLLMServer() as heavy, StubLLMServer() as light:
+        client = PooledClient(get_pool([heavy, light], weights=[2, 1]))
+        for _ in range(9):
+            create(client)
+    print(f"  Requests: {heavy.requests} and {light.requests} (expected: 6 and 3)")
+    assert (heavy.requests, light.requests) == (6, 3), \
+        f"Requests should follow the weights 2:1, got {heavy.requests} and {light.requests}"
+    print("  ✓ Requests spread by weight!")
+
+
+def test_async_failover():
+    """The async client fails over like the sync one, from concurrent requests."""
+    print("\nTesting failover of the async client:")
+    with StubLLMServer(fail_every=2) as flaky, StubLLMServer() as healthy:
+        pool = get_pool([flaky, healthy], routing='least_outstanding', failure_threshold=100)
+        client = AsyncPooledClient(pool)
+
+        async def create_many(n):
+            return await asyncio.gather(*[client.chat.completions.create(model='stub', messages=MESSAGES)
+                                          for _ in range(n)])
+
+        responses = asyncio.run(create_many(20))
+        failures = sum(stats['failures'] for stats in pool.stats())
+    print(f"  Requests: flaky {flaky.requests}, healthy {healthy.requests}, failures {failures}")
+    assert all(response.choices[0].message.content == DEFAULT_ANSWER for response in responses), \
+        "All concurrent requests should be answered"
+    assert flaky.requests + healthy.requests == 20 + failures, "Each failure should be sent once more"
+    assert failures == flaky.requests // 2, f"Every 2nd request of the flaky endpoint should fail, got {failures}"
+    print("  ✓ Concurrent requests failed over!")
+
+
+def test_single_endpoint_retries():
+    """A pool of one endpoint keeps the retries of the OpenAI client, since there is nothing to fail over to."""
+    print("\nTesting retries of a single endpoint:")
+    with StubLLMServer(fail_every=2) as stub:
+        pool = get_pool([stub])
+        client = PooledClient(pool)
+        responses = [create(client) for _ in range(2)]
+    print(f"  Requests: {stub.requests} (expected: 3)")
+    assert pool.max_retries == openai.DEFAULT_MAX_RETRIES, f"Single endpoint should retry, got {pool.max_retries}"
+    assert responses == [DEFAULT_ANSWER] * 2, f"Both requests should be answered, got {responses}"
+    assert stub.requests == 3, f"Failed request should be retried on the endpoint, got {stub.requests}"
+    print("  ✓ Single endpoint retried with the OpenAI client's backoff!")
+
+
+def test_client_attributes():
+    """Attributes other than chat.completions are those of the client of the first healthy endpoint."""
+    print("\nTesting other attributes of the pooled client:")
+    with StubLLMServer(status=500) as failing, StubLLMServer() as healthy:
+        client = PooledClient(get_pool([failing, healthy], failure_threshold=1))
+        before = str(client.base_url)
+        create(client)
+        after = str(client.base_url)
+        assert client.models is not None, "Pooled client should have the models of the OpenAI client"
+    print(f"  base_url: {before} then {after}")
+    assert before.rstrip('/') == failing.url, f"First endpoint should be used while healthy, got {before}"
+    assert after.rstrip('/') == healthy.url, f"Unhealthy endpoint should be skipped, got {after}"
+    print("  ✓ Other attributes taken from the first healthy endpoint!")
+
+
+def test_reset_closes_clients():
+    """reset_client closes the connections of the clients it drops."""
+    print("\nTesting that reset_client closes the clients:")
+    with StubLLMServer() as stub, tempfile.TemporaryDirectory() as config_dir:
+        config_path = os.path.join(config_dir, 'llm_config.json')
+        with open(config_path, 'w') as f:
+            json.dump({'base_url': stub.url, 'api_key': 'stub'}, f)
+        LLMClientFactory.reset_client()
+        create(LLMClientFactory.get_client(config_path))
+        pool = LLMClientFactory.get_pool(config_path)
+        endpoint_client = pool.endpoints[0].client(pool.http_settings, {}, pool.max_retries)
+        assert not endpoint_client.is_closed(), "Client should be open before the reset"
+        LLMClientFactory.reset_client()
+    assert endpoint_client.is_closed(), "reset_client should close the clients of the pool"
+    print("  ✓ Clients closed!")
+
+
+if __name__ == "__main__":
+    test_failover()
+    test_all_endpoints_failing()
+    test_bad_request_not_failed_over()
+    test_weighted_round_robin()
+    test_async_failover()
+    test_single_endpoint_retries()
+    test_client_attributes()
+    test_reset_closes_clients()
+    print("\n✓ All endpoint pool tests passed!")
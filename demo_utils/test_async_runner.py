@@ -0,0 +1,102 @@
+"""
+Tests of the retries and backoff of async_runner.py against local stub endpoints
+(stub_llm_server.py), without an API key.
+
+Usage:
+    python test_async_runner.py
+"""
+import time
+import asyncio
+from types import SimpleNamespace
+
+from openai import AsyncOpenAI
+
+from async_runner import AsyncRoadSequenceRunner, get_retry_delay
+from stub_llm_server import StubLLMServer, DEFAULT_ANSWER, get_stub_config
+from telemetry import Telemetry
+
+MESSAGES = [{'role': 'user', 'content': [{'type': 'text', 'text': 'Describe the road.'}]}]
+
+
+def get_runner(stub, **kwargs):
+    return AsyncRoadSequenceRunner(get_stub_config(), client=AsyncOpenAI(api_key='stub', base_url=stub.url),
+                                   telemetry=Telemetry(), **kwargs)
+
+
+async def call_api_times(runner, n):
+    # One event loop for all calls, since the connections of the client are bound to it
+    return [await runner.call_api(MESSAGES) for _ in range(n)]
+
+
+def test_retry_after_server_error():
+    """A request failing with a 500 is retried and succeeds."""
+    print("\nTesting retry after a server error (every 2nd request fails):")
+    with StubLLMServer(fail_every=2) as stub:
+        runner = get_runner(stub, max_retries=2, backoff=0.01)
+        responses = asyncio.run(call_api_times(runner, 2))
+    attempts = [record['attempts'] for record in runner.telemetry.records]
+    print(f"  Requests: {stub.requests} (expected: 3), attempts: {attempts} (expected: [1, 2])")
+    assert responses == [DEFAULT_ANSWER] * 2, f"Both calls should be answered, got {responses}"
+    # Request 2 fails and is sent again as request 3
+    assert stub.requests == 3, f"Stub should get 3 requests, got {stub.requests}"
+    assert attempts == [1, 2], f"Second call should take 2 attempts, got {attempts}"
+    print("  ✓ Failed request retried!")
+
+
+def test_give_up_after_max_retries():
+    """A request failing every time is sent max_retries + 1 times, then the call returns None."""
+    print("\nTesting retries of an endpoint that always fails:")
+    with StubLLMServer(status=500) as stub:
+        runner = get_runner(stub, max_retries=2, backoff=0.01)
+        responses = asyncio.run(call_api_times(runner, 1))
+    record = runner.telemetry.records[-1]
+    print(f"  Requests: {stub.requests} (expected: 3), error: {record['error']}")
+    assert responses == [None], f"Call should fail, got {responses}"
+    assert stub.requests == 3, f"Stub should get 1 request and 2 retries, got {stub.requests}"
+    assert record['attempts'] == 3 and record['error'].startswith('InternalServerError'), \
+        f"Telemetry should record 3 attempts and the error, got {record}"
+    assert [failure['stage'] for failure in runner.error_log] == ['api'] and \
+        runner.error_log[0]['error'] == record['error'], f"Runner should log the error, got {runner.error_log}"
+    print("  ✓ Gave up after max_retries!")
+
+
+def test_no_retry_of_bad_request():
+    """Errors of the request itself (e.g. 400) are not retried."""
+    print("\nTesting that a bad request is not retried:")
+    with StubLLMServer(status=400) as stub:
+        runner = get_runner(stub, max_retries=2, backoff=0.01)
+        responses = asyncio.run(call_api_times(runner, 1))
+    print(f"  Requests: {stub.requests} (expected: 1)")
+    assert responses == [None], f"Call should fail, got {responses}"
+    assert stub.requests == 1, f"Bad request should be sent once, got {stub.requests}"
+    print("  ✓ Bad request not retried!")
+
+
+def test_backoff():
+    """Retries wait backoff * 2 ** attempt seconds (with jitter), or the server's Retry-After."""
+    print("\nTesting backoff delays:")
+    for attempt in range(4):
+        # Errors without a response, e.g. connection errors
+        delay = get_retry_delay(SimpleNamespace(response=None), attempt, 0.5)
+        assert 0.25 * 2 ** attempt <= delay <= 0.5 * 2 ** attempt, \
+            f"Delay of attempt {attempt} should be in [{0.25 * 2 ** attempt}, {0.5 * 2 ** attempt}], got {delay}"
+    error = SimpleNamespace(response=SimpleNamespace(headers={'retry-after': '3'}))
+    assert get_retry_delay(error, 0, 0.5) == 3.0, f"Retry-After should be used, got {get_retry_delay(error, 0, 0.5)}"
+
+    # 2 retries wait at least 0.1 + 0.2 seconds
+    with StubLLMServer(status=500) as stub:
+        runner = get_runner(stub, max_retries=2, backoff=0.2)
+        start = time.monotonic()
+        asyncio.run(call_api_times(runner, 1))
+        elapsed = time.monotonic() - start
+    print(f"  Call with 2 retries took {elapsed:.2f}s (expected: at least 0.30s)")
+    assert elapsed >= 0.3, f"Retries should back off for at least 0.3s, took {elapsed:.2f}s"
+    print("  ✓ Exponential backoff and Retry-After respected!")
+
+
+if __name__ == "__main__":
+    test_retry_after_server_error()
+    test_give_up_after_max_retries()
+    test_no_retry_of_bad_request()
+    test_backoff()
+    print("\n✓ All async runner tests passed!")
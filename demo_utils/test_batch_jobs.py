@@ -0,0 +1,102 @@
+"""
+Round trip of batch_jobs.py: request JSONL files are answered by a local stub endpoint
+(stub_llm_server.py) through fake_batch_processor, and the result JSONL files are
+ingested until the job is done.
+
+Usage:
+    python test_batch_jobs.py
+"""
+import os
+import json
+import tempfile
+
+import numpy as np
+import pandas as pd
+from openai import OpenAI
+
+from batch_jobs import BatchJob, BATCH_URL, fake_batch_processor, read_batch_results
+from stub_llm_server import StubLLMServer, get_stub_config
+
+# Two ways, with sequences of 2 and 3 photos
+WAYS_DF = pd.DataFrame({'osmid': [101, 102], 'sequences': [{1: [0, 1]}, {2: [0, 1, 2]}]})
+PHOTOS_DF = pd.DataFrame({
+    'sequence_id': [1, 1, 2, 2, 2],
+    'sequence_index': [0, 1, 0, 1, 2],
+    'match_forward': [True, True, True, False, True],
+    'geometry': ['POINT (-77.0 38.9)', 'POINT (-77.0001 38.9)', 'POINT (-77.0 38.91)', 'POINT (-77.0 38.9101)',
+                 'POINT (-77.0 38.9102)'],
+    'heading': [90.0, 90.0, 0.0, 0.0, 0.0],
+})
+
+
+def load_front_view(sequence_id, sequence_index):
+    return np.full((8, 8, 3), sequence_id * 10 + sequence_index, dtype=np.uint8)
+
+
+def test_batch_round_trip():
+    print("\nTesting batch job round trip:")
+    config = {**get_stub_config(), 'aggregation': 'llm'}
+    with tempfile.TemporaryDirectory() as job_dir, StubLLMServer() as stub:
+        client = OpenAI(api_key='stub', base_url=stub.url)
+        job = BatchJob(job_dir, config, load_front_view)
+        job.create(WAYS_DF, PHOTOS_DF)
+
+        sent = []
+
+        def respond(body):
+            # The first request of the job fails, the others are answered by the stub endpoint
+            sent.append(body)
+            if len(sent) == 1:
+                return None
+            return client.chat.completions.create(**body).choices[0].message.content
+
+        rounds, custom_ids = 0, []
+        while not job.done:
+            paths = job.write_round()
+            assert len(paths) == 1, f"Round should fit in one file, got {paths}"
+            with open(paths[0]) as f:
+                requests = [json.loads(line) for line in f]
+            for request in requests:
+                assert request['method'] == 'POST' and request['url'] == BATCH_URL, f"Bad request line {request}"
+                assert request['body']['model'] == config['model'], f"Bad model in {request['body']}"
+                assert request['body']['messages'], "Request should have messages"
+            custom_ids += [request['custom_id'] for request in requests]
+            results_path = os.path.join(job_dir, f'results_round_{rounds + 1}.jsonl')
+            fake_batch_processor(paths[0], results_path, respond)
+            assert list(read_batch_results(results_path)) == [request['custom_id'] for request in requests], \
+                "Results should keep the custom_ids of the requests"
+            answers, failures = job.ingest(results_path)
+            assert answers + failures == len(requests), f"Every result should be ingested, got {answers}, {failures}"
+            # Ingesting the same file again changes nothing
+            assert job.ingest(results_path) == (0, 0), "A result file should only be ingested once"
+            # Resume from the saved state, as after a restart
+            job = BatchJob(job_dir, config, load_front_view)
+            rounds += 1
+
+        print(f"  Rounds: {rounds} (expected: 4), requests: {len(custom_ids)} (expected: 7), "
+              f"stub requests: {stub.requests} (expected: 6)")
+        # 3 image rounds for the longest sequence, then its summary; the short sequence's summary is in round 3
+        assert rounds == 4, f"Job should take 4 rounds, got {rounds}"
+        assert sorted(custom_ids) == sorted(['101:1:0', '101:1:1', '101:1:summary',
+                                             '102:2:0', '102:2:1', '102:2:2', '102:2:summary']), \
+            f"Unexpected custom_ids {custom_ids}"
+        assert stub.requests == len(custom_ids) - 1, \
+            f"All requests but the failed one should reach the stub, got {stub.requests}"
+
+        results = job.results()
+        answered = {osmid: [len(sequence_results) for way in way_results for sequence_results in way.values()]
+                    for osmid, way_results in results.items()}
+        # The failed first image of way 101 is skipped, like in analyze_road_sequence
+        assert answered == {101: [2], 102: [4]}, f"Unexpected answers per sequence {answered}"
+
+        predictions_df = pd.read_csv(job.write_predictions())
+        print(f"  Predictions:\n{predictions_df[['osmid', 'oneway', 'lanes']].to_string(index=False)}")
+        assert predictions_df['osmid'].tolist() == [101, 102], f"Unexpected ways {predictions_df['osmid'].tolist()}"
+        assert predictions_df['lanes'].tolist() == [2, 2] and predictions_df['oneway'].tolist() == ['no', 'no'], \
+            "Predictions should hold the stub answers"
+    print("  ✓ Requests written, answered, ingested and resumed!")
+
+
+if __name__ == "__main__":
+    test_batch_round_trip()
+    print("\n✓ All batch job tests passed!")
@@ -0,0 +1,63 @@
+"""
+Tests of the parsing and normalization of predictions.py: normalized predictions are
+scored by the comparators of eval.py like the values they stand for.
+
+Usage:
+    python test_predictions.py
+"""
+import os
+import sys
+
+from predictions import normalize_value, parse_final_output
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'evaluation_utils'))
+from eval import equals  # noqa: E402
+
+
+def test_parse_final_output():
+    """Python-style dicts with ';' separators, None and trailing prose are read."""
+    print("\nTesting parsing of FINAL_OUTPUT answers:")
+    response = ("The road has two lanes. FINAL_OUTPUT: {'reasoning': 'a; b'; 'oneway': 'no'; 'lanes': 2, "
+                "'maxspeed': '50 km/h', 'turn:lanes': None} That's all.")
+    tags = parse_final_output(response)
+    print(f"  Tags: {tags}")
+    assert tags == {'oneway': 'no', 'lanes': '2', 'maxspeed': '50 km/h', 'turn:lanes': None}, f"Unexpected {tags}"
+    print("  ✓ Answer parsed!")
+
+
+def test_normalized_speeds_match():
+    """Normalized speeds keep their unit, so eval.py scores them against the ground truth in that unit."""
+    print("\nTesting normalized speeds against the ground truth:")
+    # (ground truth, model answer, should match)
+    cases = [('50 km/h', '50 km/h', True), ('50 km/h', '50kmh', True), ('50 km/h', '50 kph', True),
+             ('25 mph', '25', True), ('25 mph', '25 MPH', True), ('40 km/h', '25 mph', False),
+             ('50 km/h', '50 mph', False), ('walk', 'Walk', True)]
+    for gt_value, answer, expected in cases:
+        for tag in ['maxspeed', 'maxspeed:forward']:
+            normalized = normalize_value(tag, answer)
+            matched = equals(gt_value, normalized, tag)
+            print(f"  {tag}: GT {gt_value!r}, answer {answer!r} -> {normalized!r}: {matched}")
+            assert matched == expected, \
+                f"{answer!r} normalized to {normalized!r} should {'' if expected else 'not '}match {gt_value!r}"
+    assert normalize_value('maxspeed', '50 km/h') == '50 km/h', "km/h speeds should keep their unit"
+    assert normalize_value('maxspeed', '25') == '25 mph', "Speeds without a unit should be written in mph"
+    print("  ✓ Normalized speeds scored in their unit!")
+
+
+def test_normalized_values_match():
+    """Other normalized tags match the ground truth values they stand for."""
+    print("\nTesting other normalized values against the ground truth:")
+    cases = [('lanes', '2', '2 lanes'), ('oneway', 'yes', 'True'), ('turn:lanes', 'left|through', 'Left | Through'),
+             ('name', 'Main Street', ' Main  Street ')]
+    for tag, gt_value, answer in cases:
+        normalized = normalize_value(tag, answer)
+        print(f"  {tag}: GT {gt_value!r}, answer {answer!r} -> {normalized!r}")
+        assert equals(gt_value, normalized, tag), f"{answer!r} normalized to {normalized!r} should match {gt_value!r}"
+    print("  ✓ Normalized values matched!")
+
+
+if __name__ == "__main__":
+    test_parse_final_output()
+    test_normalized_speeds_match()
+    test_normalized_values_match()
+    print("\n✓ All predictions tests passed!")
@@ -0,0 +1,75 @@
+"""
+Tests of the request keys of response_cache.py, and of the cached calls of the async
+runner against a local stub endpoint (stub_llm_server.py).
+
+Usage:
+    python test_response_cache.py
+"""
+import os
+import asyncio
+import tempfile
+
+from openai import AsyncOpenAI
+
+from async_runner import AsyncRoadSequenceRunner
+from response_cache import ResponseCache, request_key
+from stub_llm_server import StubLLMServer, DEFAULT_ANSWER, get_stub_config
+from telemetry import Telemetry
+
+
+def get_messages(image_data='AAAA', text='Describe the road.'):
+    return [{'role': 'user', 'content': [
+        {'type': 'text', 'text': text},
+        {'type': 'image_url', 'image_url': {'url': f'data:image/png;base64,{image_data}'}},
+    ]}]
+
+
+def test_request_key():
+    """Keys depend on the messages, the images and the model parameters, and on nothing else."""
+    print("\nTesting request keys:")
+    config = get_stub_config()
+    key = request_key(get_messages(), config)
+    assert key == request_key(get_messages(), dict(config)), "Same request should have the same key"
+    assert key != request_key(get_messages(image_data='BBBB'), config), "Another image should change the key"
+    assert key != request_key(get_messages(text='Describe the lanes.'), config), "Another prompt should change the key"
+    for param, value in [('model', 'other'), ('temperature', 0.7), ('max_tokens', 10), ('return_json', False)]:
+        assert key != request_key(get_messages(), {**config, param: value}), f"{param} should change the key"
+    # Settings that don't change the response
+    for param, value in [('max_concurrency', 64), ('max_retries', 0), ('cache_max_mb', 1)]:
+        assert key == request_key(get_messages(), {**config, param: value}), f"{param} shouldn't change the key"
+    assert len(key) == 64 and 'AAAA' not in key, f"Key should be a SHA-256 hex digest, got {key}"
+    print("  ✓ Keys change with the messages, images and model parameters only!")
+
+
+def test_cached_calls():
+    """Repeated requests are answered from the cache, also after reopening it, and misses go to the endpoint."""
+    print("\nTesting cached calls of the async runner:")
+    with tempfile.TemporaryDirectory() as cache_dir, StubLLMServer() as stub:
+        cache_path = os.path.join(cache_dir, 'llm_cache.sqlite')
+
+        def call_api(config, messages):
+            cache = ResponseCache(cache_path)
+            runner = AsyncRoadSequenceRunner(config, client=AsyncOpenAI(api_key='stub', base_url=stub.url),
+                                             cache=cache, telemetry=Telemetry())
+            response = asyncio.run(runner.call_api(messages))
+            cache.close()
+            return response, runner.telemetry.records[-1].get('cached', False)
+
+        config = get_stub_config()
+        calls = [call_api(config, get_messages()),
+                 call_api(config, get_messages()),
+                 call_api({**config, 'temperature': 0.7}, get_messages()),
+                 call_api(config, get_messages(image_data='BBBB'))]
+    print(f"  Cached: {[cached for _, cached in calls]} (expected: [False, True, False, False]), "
+          f"requests: {stub.requests} (expected: 3)")
+    assert all(response == DEFAULT_ANSWER for response, _ in calls), f"All calls should be answered, got {calls}"
+    assert [cached for _, cached in calls] == [False, True, False, False], \
+        f"Only the repeated request should be cached, got {calls}"
+    assert stub.requests == 3, f"Stub should get the 3 cache misses, got {stub.requests}"
+    print("  ✓ Repeated request answered from the cache!")
+
+
+if __name__ == "__main__":
+    test_request_key()
+    test_cached_calls()
+    print("\n✓ All response cache tests passed!")
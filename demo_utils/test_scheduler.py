@@ -0,0 +1,127 @@
+"""
+Tests of the retries and resumption of scheduler.py, running units against local stub
+endpoints (stub_llm_server.py).
+
+Usage:
+    python test_scheduler.py
+"""
+import asyncio
+import tempfile
+
+import numpy as np
+import pandas as pd
+from openai import AsyncOpenAI
+
+from async_runner import AsyncRoadSequenceRunner
+from scheduler import JobScheduler
+from stub_llm_server import StubLLMServer, get_stub_config
+from telemetry import Telemetry
+
+# Ways with one sequence of 2 photos each: one unit and 2 requests per way
+N_WAYS = 6
+WAYS_DF = pd.DataFrame({'osmid': [100 + i for i in range(N_WAYS)], 'sequences': [{i: [0, 1]} for i in range(N_WAYS)]})
+PHOTOS_DF = pd.DataFrame({
+    'sequence_id': np.repeat(np.arange(N_WAYS), 2),
+    'sequence_index': np.tile([0, 1], N_WAYS),
+    'match_forward': True,
+    'geometry': [f'POINT (-77.0 {38.9 + i * 1e-4})' for i in range(2 * N_WAYS)],
+    'heading': 0.0,
+})
+
+
+def load_and_resize_image(sequence_id, sequence_index):
+    return np.full((8, 8, 3), sequence_id * 10 + sequence_index, dtype=np.uint8)
+
+
+def run(job_dir, stub, max_attempts, workers=2, timeout=None):
+    """Run the pending units of job_dir against stub. Returns the progress, None if the run was stopped by timeout."""
+    scheduler = JobScheduler(job_dir)
+    # Without retries of the runner, every failed request leaves its unit incomplete
+    runner = AsyncRoadSequenceRunner({**get_stub_config(), 'aggregation': 'local'}, max_retries=0,
+                                     client=AsyncOpenAI(api_key='stub', base_url=stub.url), telemetry=Telemetry())
+    try:
+        return asyncio.run(asyncio.wait_for(scheduler.run(runner, PHOTOS_DF, load_and_resize_image, lambda image: image,
+                                                          workers, max_attempts, progress_interval=0), timeout))
+    except asyncio.TimeoutError:
+        return None
+    finally:
+        scheduler.close()
+
+
+def create_job(job_dir):
+    scheduler = JobScheduler(job_dir)
+    added = scheduler.add_units(WAYS_DF)
+    scheduler.close()
+    assert added == N_WAYS, f"Job should have {N_WAYS} units, got {added}"
+
+
+def test_failed_units_resumed():
+    """Units failing on their last attempt are failed; a later run with more attempts retries only those."""
+    print("\nTesting failed units and their resumption:")
+    with tempfile.TemporaryDirectory() as job_dir:
+        create_job(job_dir)
+        with StubLLMServer(status=500) as failing:
+            progress = run(job_dir, failing, max_attempts=1)
+        scheduler = JobScheduler(job_dir)
+        errors = scheduler.errors()
+        scheduler.close()
+        print(f"  First run: {progress['failed']} failed (expected: {N_WAYS}), {failing.requests} requests")
+        assert progress['failed'] == N_WAYS and progress['done'] == 0, f"All units should fail, got {progress}"
+        assert len(errors) == N_WAYS and all(attempts == 1 for _, _, _, attempts, _ in errors), \
+            f"Every unit should fail after 1 attempt, got {errors}"
+
+        with StubLLMServer() as healthy:
+            progress = run(job_dir, healthy, max_attempts=2)
+        print(f"  Second run: {progress['done']} done (expected: {N_WAYS}), {healthy.requests} requests "
+              f"(expected: {2 * N_WAYS})")
+        assert progress['done'] == N_WAYS, f"Failed units with attempts left should be run again, got {progress}"
+        assert healthy.requests == 2 * N_WAYS, f"Each unit should be sent once more, got {healthy.requests}"
+
+        with StubLLMServer() as idle:
+            progress = run(job_dir, idle, max_attempts=2)
+        assert idle.requests == 0 and progress['done'] == N_WAYS, "Done units shouldn't be run again"
+    print("  ✓ Failed units retried on the next run, done units kept!")
+
+
+def test_units_retried_within_run():
+    """Incomplete units are queued again and picked up by the waiting workers until they are done."""
+    print("\nTesting retries within a run (every 4th request fails):")
+    with tempfile.TemporaryDirectory() as job_dir:
+        create_job(job_dir)
+        with StubLLMServer(fail_every=4) as flaky:
+            progress = run(job_dir, flaky, max_attempts=20, workers=4)
+        scheduler = JobScheduler(job_dir)
+        attempts = [row[0] for row in scheduler._connection.execute('SELECT attempts FROM units')]
+        scheduler.close()
+    print(f"  {progress['done']} done (expected: {N_WAYS}), attempts: {attempts}, {flaky.requests} requests")
+    assert progress['done'] == N_WAYS and progress['pending'] == 0, f"All units should be done, got {progress}"
+    assert sum(attempts) > N_WAYS, f"Some units should take more than one attempt, got {attempts}"
+    assert flaky.requests == 2 * sum(attempts), f"Each attempt should send 2 requests, got {flaky.requests}"
+    print("  ✓ Incomplete units retried until done!")
+
+
+def test_resume_after_interruption():
+    """An interrupted run keeps its finished units; the next run only sends the others."""
+    print("\nTesting resumption after an interrupted run:")
+    with tempfile.TemporaryDirectory() as job_dir:
+        create_job(job_dir)
+        with StubLLMServer(delay=0.1) as slow:
+            assert run(job_dir, slow, max_attempts=3, workers=1, timeout=0.5) is None, "Run should be interrupted"
+        scheduler = JobScheduler(job_dir)
+        interrupted = scheduler.progress()
+        scheduler.close()
+        with StubLLMServer() as healthy:
+            progress = run(job_dir, healthy, max_attempts=3)
+    print(f"  Interrupted with {interrupted['done']} done, resumed with {healthy.requests} requests "
+          f"(expected: {2 * interrupted['pending']})")
+    assert interrupted['done'] < N_WAYS, f"Interrupted run shouldn't finish, got {interrupted}"
+    assert healthy.requests == 2 * interrupted['pending'], "Only the unfinished units should be sent again"
+    assert progress['done'] == N_WAYS, f"All units should be done after resuming, got {progress}"
+    print("  ✓ Interrupted run resumed!")
+
+
+if __name__ == "__main__":
+    test_failed_units_resumed()
+    test_units_retried_within_run()
+    test_resume_after_interruption()
+    print("\n✓ All scheduler tests passed!")
@@ -0,0 +1,183 @@
+"""
+Precomputed front-view crops of the street-level photos.
+
+load_and_resize_image + get_front_view decode a full 360° panorama, resize all of it to
+WIDTH and then keep a SQUARE_SIDE_DIMENSION square. Here the crop window is mapped back
+to the original panorama, only that region is converted and resized, and the crops of
+all photos are computed once, in a process pool, into a tile store: a memory-mapped
+uint8 array of crops plus an index by (sequence_id, sequence_index). The inference
+runner then reads crops from the store without touching the PNGs.
+
+The crop is centered on the driving direction along the way: the bearing of the way at
+the photo (reversed if the car drives against the way's direction, see match_forward)
+relative to the photo's heading, which is the center of the panorama. With a heading
+along the way this is the same window as the fixed POS_X/POS_Y offsets.
+"""
+import os
+import json
+import math
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import cv2
+from shapely.wkt import loads
+
+# Same crop as the demo notebook: a SQUARE_SIDE_DIMENSION square at (POS_X, POS_Y) of the panorama resized to WIDTH
+SQUARE_SIDE_DIMENSION = 1000
+POS_Y = 500
+POS_X = 1500
+WIDTH = 4000
+
+PHOTOS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'photos')
+
+
+def get_bearing(line, point):
+    """Compass bearing in degrees of a (lon, lat) LINESTRING where it passes closest to a point."""
+    distance = line.project(point)
+    step = min(1e-5, line.length / 2)
+    start = line.interpolate(max(distance - step, 0))
+    end = line.interpolate(min(distance + step, line.length))
+    # Longitude degrees shrink with the latitude
+    dx = (end.x - start.x) * math.cos(math.radians(point.y))
+    dy = end.y - start.y
+    return math.degrees(math.atan2(dx, dy)) % 360
+
+
+def get_view_offset(heading, bearing, match_forward):
+    """Angle in degrees in [-180, 180) from the panorama center (heading) to the driving direction along the way."""
+    direction = bearing if match_forward else bearing + 180
+    return (direction - heading + 180) % 360 - 180
+
+
+def crop_front_view(image, view_offset=0.0, input_format='BGR'):
+    """
+    Front view of a panorama decoded at any size: the crop get_front_view would take from
+    the panorama resized to WIDTH, shifted horizontally by view_offset degrees (wrapping
+    around the 360° seam). Only the crop is resized and converted to RGB. The crop is
+    always SQUARE_SIDE_DIMENSION square: rows below a short panorama are padded with
+    black. Raises ValueError if the panorama has no rows below POS_Y.
+    """
+    height, width = image.shape[:2]
+    scale = width / WIDTH
+    # One rounding of the window start and side, so every panorama width gives a square window
+    side = max(int(round(SQUARE_SIDE_DIMENSION * scale)), 1)
+    x_start = int(round((POS_X + view_offset / 360 * WIDTH) * scale))
+    y_start = int(round(POS_Y * scale))
+    columns = np.arange(x_start, x_start + side) % width
+    rows = min(y_start + side, height) - y_start
+    if rows <= 0:
+        raise ValueError(f"Panorama of {height} rows too short for a front view from row {y_start}")
+    crop = image[y_start:y_start + rows].take(columns, axis=1)
+    crop_height = min(max(int(round(rows * SQUARE_SIDE_DIMENSION / side)), 1), SQUARE_SIDE_DIMENSION)
+    crop = cv2.resize(crop, (SQUARE_SIDE_DIMENSION, crop_height), interpolation=cv2.INTER_AREA)
+    if crop_height < SQUARE_SIDE_DIMENSION:
+        crop = np.pad(crop, ((0, SQUARE_SIDE_DIMENSION - crop_height), (0, 0), (0, 0)))
+    if input_format == 'BGR':
+        crop = cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)
+    return crop
+
+
+def get_view_offsets(photos_df, ways_df):
+    """View offset of every photo, from its heading and the bearing of its way (0 if the way is unknown)."""
+    way_lines = ways_df.set_index('osmid')['geometry']
+    offsets = np.zeros(len(photos_df))
+    for i, photo in enumerate(photos_df.itertuples(index=False)):
+        line = way_lines.get(photo.osmid)
+        if line is None:
+            continue
+        line = loads(line) if isinstance(line, str) else line
+        point = loads(photo.geometry) if isinstance(photo.geometry, str) else photo.geometry
+        offsets[i] = get_view_offset(photo.heading, get_bearing(line, point), photo.match_forward)
+    return offsets
+
+
+def _write_crops(store_dir, photos_dir, tasks):
+    # Runs in a worker: decode the photos of one task list and write their crops in place
+    crops = np.load(os.path.join(store_dir, 'crops.npy'), mmap_mode='r+')
+    written = []
+    for row, sequence_id, sequence_index, view_offset in tasks:
+        image = cv2.imread(os.path.join(photos_dir, f"{sequence_id}_{sequence_index}.png"))
+        if image is None:
+            continue
+        try:
+            crops[row] = crop_front_view(image, view_offset)
+        except ValueError as e:
+            # Left out of the store (not available), like a missing photo
+            print(f"Photo {sequence_id}_{sequence_index} skipped: {e}")
+            continue
+        written.append(row)
+    crops.flush()
+    return written
+
+
+def build_tile_store(photos_df, ways_df, store_dir, photos_dir=PHOTOS_DIR, workers=None, tasks_per_worker=4):
+    """
+    Compute the front-view crop of every photo of photos_df into a tile store in store_dir:
+    crops.npy (photos x side x side x 3 RGB, memory-mapped) and index.csv (sequence_id,
+    sequence_index, row, view_offset, available). Photos missing from photos_dir, or
+    too short for a front view, are marked as not available.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    index_df = photos_df[['sequence_id', 'sequence_index']].drop_duplicates().reset_index(drop=True)
+    assert len(index_df) == len(photos_df), "Duplicate photos in photos_df"
+    index_df['row'] = np.arange(len(index_df))
+    index_df['view_offset'] = np.round(get_view_offsets(photos_df.reset_index(drop=True), ways_df), 2)
+
+    crops = np.lib.format.open_memmap(os.path.join(store_dir, 'crops.npy'), mode='w+', dtype=np.uint8,
+                                      shape=(len(index_df), SQUARE_SIDE_DIMENSION, SQUARE_SIDE_DIMENSION, 3))
+    del crops
+
+    # Contiguous chunks of photos, small enough to balance the pool
+    tasks = list(index_df[['row', 'sequence_id', 'sequence_index', 'view_offset']].itertuples(index=False, name=None))
+    if workers is None:
+        workers = os.cpu_count() or 1
+    bounds = np.linspace(0, len(tasks), max(1, min(len(tasks), workers * tasks_per_worker)) + 1).astype(int)
+    task_chunks = [tasks[start:end] for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+    written = []
+    if workers <= 1:
+        for chunk in task_chunks:
+            written += _write_crops(store_dir, photos_dir, chunk)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for rows in executor.map(_write_crops, [store_dir] * len(task_chunks), [photos_dir] * len(task_chunks),
+                                     task_chunks):
+                written += rows
+
+    index_df['available'] = False
+    index_df.loc[written, 'available'] = True
+    index_df.to_csv(os.path.join(store_dir, 'index.csv'), index=False)
+    with open(os.path.join(store_dir, 'crop_params.json'), 'w') as f:
+        json.dump({'square_side_dimension': SQUARE_SIDE_DIMENSION, 'pos_x': POS_X, 'pos_y': POS_Y, 'width': WIDTH}, f)
+    print(f"Tile store with {len(written)} of {len(index_df)} photos saved to {store_dir}")
+    return index_df
+
+
+class TileStore:
+    """
+    Read-only access to a tile store built by build_tile_store. get() can be passed as
+    load_and_resize_image to analyze_road_sequence or the async runner, together with
+    get_front_view, since the crops already are front views.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.crops = np.load(os.path.join(store_dir, 'crops.npy'), mmap_mode='r')
+        with open(os.path.join(store_dir, 'crop_params.json')) as f:
+            self.crop_params = json.load(f)
+        index_df = pd.read_csv(os.path.join(store_dir, 'index.csv'))
+        index_df = index_df[index_df['available']]
+        self.rows = dict(zip(zip(index_df['sequence_id'], index_df['sequence_index']), index_df['row']))
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    def get(self, sequence_id, sequence_index):
+        """Front-view crop (RGB) of a photo."""
+        key = (int(sequence_id), int(sequence_index))
+        assert key in self.rows, f"Photo {sequence_id}_{sequence_index} not in the tile store"
+        return np.asarray(self.crops[self.rows[key]])
+
+    @staticmethod
+    def get_front_view(crop):
+        return crop
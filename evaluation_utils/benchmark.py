@@ -0,0 +1,308 @@
+"""
+Speed and memory benchmark of the evaluation pipeline on synthetic data.
+
+generate_dataset() writes a seeded synthetic ground truth and predictions file in the
+metadata/ schema, with controllable rates of mismatches, missing osmids, extra osmids
+and abbreviated street names. run_benchmark() evaluates them with eval.py end to end and
+phase by phase (load, merge, scoring, issues, report), timing every phase and measuring
+its peak traced memory, and find_regressions() compares the results with a previous run.
+
+Usage:
+    python benchmark.py [uid] [--sizes 10000 100000 1000000] [--seed 0] [--baseline path/to/benchmark.json]
+"""
+import os
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import eval as evaluation
+from status_cache import fingerprint, status_counts
+
+DEFAULT_SIZES = [10000, 100000, 1000000]
+PHASES = ['load', 'merge', 'scoring', 'issues', 'report']
+
+# Values of the synthetic ground truth, and the share of ways with each tag
+STREET_WORDS = ['Broadway', 'Henry', 'Oliver', 'Worth', 'Madison', 'James', 'Park', 'Canal', 'Grand', 'Division',
+                'Market', 'Water', 'Pearl', 'Mulberry', 'Elizabeth', 'Bowery', 'Chrystie', 'Forsyth', 'Allen',
+                'Orchard', 'Ludlow', 'Essex', 'Norfolk', 'Suffolk', 'Clinton', 'Delancey', 'Rivington', 'Stanton']
+STREET_TYPES = ['Street', 'Avenue', 'Road', 'Place', 'Drive', 'Lane', 'Boulevard', 'Court']
+TAG_VALUES = {
+    'oneway': (['yes'], 0.5),
+    'lanes': ([1, 2, 3, 4], 0.5),
+    'lanes:forward': ([1, 2, 3], 0.5),
+    'lanes:backward': ([1, 2, 3], 0.5),
+    'turn:lanes': (['through', 'left|through', 'through|right', 'left|through|right', 'through|through:right'], 0.2),
+    'turn:lanes:forward': (['through', 'left', 'left|through', 'through|right'], 0.2),
+    'turn:lanes:backward': (['through', 'left|through', 'right'], 0.2),
+    'maxspeed': (['15 mph', '25 mph', '30 mph', '35 mph'], 0.3),
+    'maxspeed:forward': (['25 mph', '30 mph'], 0.2),
+}
+NAME_SHARE = 0.9
+# Predicted by the models but absent from the ground truth, so it is never scored
+UNSCORED_TAG_VALUES = {'maxspeed:backward': (['25 mph', '30 mph'], 0.2)}
+
+
+def _abbreviation_variants():
+    # Street types and the abbreviations eval.py expands back to them
+    variants = {}
+    for abbreviation, full in evaluation.ABBREVIATIONS.items():
+        variants.setdefault(full.title(), []).append(abbreviation.title())
+    return variants
+
+
+def _tag_column(rng, values, share, n_ways):
+    column = pd.Series(np.asarray(values, dtype=object)[rng.integers(0, len(values), n_ways)])
+    return column.where(rng.random(n_ways) < share)
+
+
+def _street_names(rng, n_ways):
+    words = np.asarray(STREET_WORDS, dtype=object)[rng.integers(0, len(STREET_WORDS), n_ways)]
+    types = np.asarray(STREET_TYPES, dtype=object)[rng.integers(0, len(STREET_TYPES), n_ways)]
+    return words, types
+
+
+def generate_dataset(n_ways, out_dir, seed=0, mismatch_rate=0.1, missing_rate=0.05, extra_rate=0.02,
+                     abbreviation_rate=0.3):
+    """
+    Write a synthetic ground truth and predictions file for n_ways ways to out_dir.
+
+    Args:
+        n_ways: number of ways in the ground truth
+        out_dir: output directory, files are re-used if they were generated with the same arguments
+        seed: random seed
+        mismatch_rate: share of predicted values replaced by another value of the same tag
+        missing_rate: share of GT osmids missing from the predictions
+        extra_rate: number of predicted osmids absent from the GT, as a share of n_ways
+        abbreviation_rate: share of predicted street names with an abbreviated street type (e.g. "St.")
+
+    Returns:
+        gt_path, pred_path
+    """
+    params = [n_ways, seed, mismatch_rate, missing_rate, extra_rate, abbreviation_rate, TAG_VALUES, STREET_WORDS]
+    stem = os.path.join(out_dir, f'synthetic_{n_ways}_{fingerprint(*params)[:8]}')
+    gt_path, pred_path = f'{stem}_gt.csv', f'{stem}_pred.csv'
+    if os.path.exists(gt_path) and os.path.exists(pred_path):
+        return gt_path, pred_path
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    words, types = _street_names(rng, n_ways)
+    names = pd.Series(words + ' ' + types).where(rng.random(n_ways) < NAME_SHARE)
+    gt_df = pd.DataFrame({'osmid': np.arange(n_ways, dtype=np.int64) + 1000, 'name': names})
+    for osm_tag, (values, share) in TAG_VALUES.items():
+        gt_df[osm_tag] = _tag_column(rng, values, share, n_ways)
+
+    # Predictions: the GT minus missing osmids, with mismatches and abbreviations
+    kept = np.flatnonzero(rng.random(n_ways) >= missing_rate)
+    pred_df = gt_df.iloc[kept].reset_index(drop=True)
+    n_kept = len(pred_df)
+    variants = _abbreviation_variants()
+    pred_types = types[kept].copy()
+    abbreviated = rng.random(n_kept) < abbreviation_rate
+    for full, abbreviations in variants.items():
+        rows = abbreviated & (pred_types == full)
+        pred_types[rows] = np.asarray(abbreviations, dtype=object)[rng.integers(0, len(abbreviations), rows.sum())]
+    pred_df['name'] = pd.Series(words[kept] + ' ' + pred_types).where(pred_df['name'].notna())
+
+    other_words, other_types = _street_names(rng, n_kept)
+    for osm_tag in ['name'] + list(TAG_VALUES):
+        mismatched = (rng.random(n_kept) < mismatch_rate) & pred_df[osm_tag].notna().to_numpy()
+        if osm_tag == 'name':
+            # Another word, so that the name can't match after normalization
+            replacement = pd.Series(np.where(other_words == words[kept], 'Wrong', other_words) + ' ' + other_types)
+        else:
+            values = TAG_VALUES[osm_tag][0]
+            replacement = _tag_column(rng, values, 1.0, n_kept)
+            if len(values) > 1:
+                # Shift to the next value of the pool where the random one equals the GT
+                positions = pd.Index(values).get_indexer(pred_df[osm_tag])
+                same = replacement.to_numpy() == pred_df[osm_tag].to_numpy()
+                replacement[same] = np.asarray(values, dtype=object)[(positions[same] + 1) % len(values)]
+        pred_df.loc[mismatched, osm_tag] = replacement[mismatched]
+
+    # Extra osmids, with values drawn like the GT
+    n_extra = int(round(n_ways * extra_rate))
+    extra_words, extra_types = _street_names(rng, n_extra)
+    extra_df = pd.DataFrame({'osmid': np.arange(n_extra, dtype=np.int64) + 1000 + n_ways,
+                             'name': pd.Series(extra_words + ' ' + extra_types)})
+    for osm_tag, (values, share) in TAG_VALUES.items():
+        extra_df[osm_tag] = _tag_column(rng, values, share, n_extra)
+    pred_df = pd.concat([pred_df, extra_df], ignore_index=True)
+    for osm_tag, (values, share) in UNSCORED_TAG_VALUES.items():
+        pred_df[osm_tag] = _tag_column(rng, values, share, len(pred_df))
+
+    # Predictions come in no particular order
+    pred_df = pred_df.iloc[rng.permutation(len(pred_df))]
+    gt_df.to_csv(gt_path, index=False)
+    pred_df.to_csv(pred_path, index=False)
+    return gt_path, pred_path
+
+
+@contextmanager
+def _results_in(results_dir):
+    # eval.py writes its outputs to RESULTS_DIR, keep them out of evaluation_results
+    previous_results_dir = evaluation.RESULTS_DIR
+    evaluation.RESULTS_DIR = results_dir
+    try:
+        yield
+    finally:
+        evaluation.RESULTS_DIR = previous_results_dir
+
+
+def _run_phases(gt_path, pred_path, uid, trace_memory):
+    """
+    Run the phases of eval_map_feature_pred (in-memory mode) one by one.
+    Returns {phase: seconds} and, with trace_memory, {phase: peak traced MB during the phase},
+    including the data kept from the previous phases.
+    """
+    seconds, peak_mb = {}, {}
+    state = {}
+
+    def load():
+        state['gt_df'] = evaluation.load_ground_truth(gt_path)
+        state['pred_df'] = pd.read_csv(pred_path, index_col=False)
+
+    def merge():
+        state['osm_tags'], state['scored_tags'] = evaluation.get_osm_tags(state['pred_df'].columns,
+                                                                          state['gt_df'].columns)
+        state['merged_df'] = evaluation._merge_gt_pred(state['pred_df'], state['gt_df'], state['scored_tags'])
+
+    def scoring():
+        state['status'] = evaluation.score_status(state['merged_df'], state['scored_tags'])
+
+    def issues():
+        state['results'] = evaluation._build_results(state['merged_df'], state['gt_df'], state['osm_tags'],
+                                                     state['scored_tags'], state['status'],
+                                                     status_counts(state['status']))
+
+    def report():
+        _, _, final_metrics_df, issues_df = state['results']
+        evaluation.save_results(final_metrics_df, issues_df, uid)
+
+    for phase, run_phase in zip(PHASES, [load, merge, scoring, issues, report]):
+        if trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        run_phase()
+        seconds[phase] = time.perf_counter() - start
+        if trace_memory:
+            peak_mb[phase] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    return seconds, peak_mb
+
+
+def benchmark_dataset(gt_path, pred_path, work_dir):
+    """
+    Benchmark one dataset: end to end eval_map_feature_pred, then every phase on its own.
+    Times come from untraced runs and peak memory from a second run of the phases under
+    tracemalloc, which slows allocations down. The end to end peak is the largest phase peak.
+
+    Returns a list of {'phase', 'seconds', 'peak_mb'} records, 'end_to_end' first.
+    """
+    with _results_in(work_dir):
+        start = time.perf_counter()
+        evaluation.eval_map_feature_pred(pred_path, 'benchmark', gt_path)
+        end_to_end_seconds = time.perf_counter() - start
+
+        seconds, _ = _run_phases(gt_path, pred_path, 'benchmark', trace_memory=False)
+        tracemalloc.start()
+        try:
+            _, peak_mb = _run_phases(gt_path, pred_path, 'benchmark', trace_memory=True)
+        finally:
+            tracemalloc.stop()
+
+    records = [{'phase': 'end_to_end', 'seconds': end_to_end_seconds, 'peak_mb': max(peak_mb.values())}]
+    records += [{'phase': phase, 'seconds': seconds[phase], 'peak_mb': peak_mb[phase]} for phase in PHASES]
+    return records
+
+
+def run_benchmark(sizes=None, seed=0, data_dir=None, **generator_args):
+    """
+    Generate (or re-use) a synthetic dataset per size and benchmark it.
+    Returns a DataFrame with one row per (n_ways, phase): seconds and peak_mb.
+    """
+    if sizes is None:
+        sizes = DEFAULT_SIZES
+    work_dir = tempfile.mkdtemp(prefix='eval_benchmark_')
+    if data_dir is None:
+        data_dir = work_dir
+    rows = []
+    try:
+        for n_ways in sizes:
+            gt_path, pred_path = generate_dataset(n_ways, data_dir, seed=seed, **generator_args)
+            for record in benchmark_dataset(gt_path, pred_path, work_dir):
+                rows.append({'n_ways': n_ways, **record})
+                print(f"{n_ways} ways, {record['phase']}: {record['seconds']:.2f}s, {record['peak_mb']:.0f} MB")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    results_df = pd.DataFrame(rows)
+    results_df['seconds'] = results_df['seconds'].round(3)
+    results_df['peak_mb'] = results_df['peak_mb'].round(1)
+    return results_df
+
+
+def find_regressions(results_df, baseline_df, threshold=1.5, min_seconds=0.1):
+    """
+    Compare a benchmark with a baseline run: (n_ways, phase) pairs whose time or peak memory
+    grew by more than `threshold` times. Phases faster than min_seconds in the baseline are
+    too noisy to compare on time.
+
+    Returns a list of messages, empty if nothing regressed.
+    """
+    merged_df = results_df.merge(baseline_df, on=['n_ways', 'phase'], suffixes=('', '_baseline'))
+    regressions = []
+    for row in merged_df.itertuples(index=False):
+        if row.seconds_baseline >= min_seconds and row.seconds > threshold * row.seconds_baseline:
+            regressions.append(f"{row.n_ways} ways, {row.phase}: {row.seconds:.2f}s vs {row.seconds_baseline:.2f}s")
+        if row.peak_mb > threshold * max(row.peak_mb_baseline, 1):
+            regressions.append(f"{row.n_ways} ways, {row.phase}: {row.peak_mb:.0f} MB vs {row.peak_mb_baseline:.0f} MB")
+    return regressions
+
+
+def save_benchmark(results_df, uid=None):
+    """Write benchmark_{uid}.json/.md to evaluation_results. Returns the uid."""
+    if uid is None:
+        uid = datetime.now().strftime('%Y%m%d%H%M%S')
+    os.makedirs(evaluation.RESULTS_DIR, exist_ok=True)
+    with open(os.path.join(evaluation.RESULTS_DIR, f'benchmark_{uid}.json'), 'w') as f:
+        json.dump(results_df.to_dict(orient='records'), f, indent=1)
+    results_df.to_markdown(os.path.join(evaluation.RESULTS_DIR, f'benchmark_{uid}.md'), index=False)
+    print(f"Benchmark saved to {evaluation.RESULTS_DIR}/benchmark_{uid}")
+    return uid
+
+
+def load_benchmark(path):
+    with open(path, 'r') as f:
+        return pd.DataFrame(json.load(f))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the evaluation pipeline on synthetic data.")
+    parser.add_argument("uid", type=str, help="uid of the benchmark run (optional).", default=None, nargs='?')
+    parser.add_argument("--sizes", type=int, nargs='+', help="Numbers of ways to benchmark (optional, defaults to 10k, 100k and 1M).", default=None)
+    parser.add_argument("--seed", type=int, help="Random seed of the synthetic data (optional, defaults to 0).", default=0)
+    parser.add_argument("--data-dir", type=str, help="Directory to keep the synthetic datasets in for re-use (optional, defaults to a temporary directory).", default=None)
+    parser.add_argument("--mismatch-rate", type=float, help="Share of mismatched predicted values (optional, defaults to 0.1).", default=0.1)
+    parser.add_argument("--missing-rate", type=float, help="Share of GT osmids missing from the predictions (optional, defaults to 0.05).", default=0.05)
+    parser.add_argument("--extra-rate", type=float, help="Predicted osmids absent from the GT, as a share of the ways (optional, defaults to 0.02).", default=0.02)
+    parser.add_argument("--abbreviation-rate", type=float, help="Share of predicted street names with an abbreviated type (optional, defaults to 0.3).", default=0.3)
+    parser.add_argument("--baseline", type=str, help="benchmark_{uid}.json of a previous run to check for regressions (optional).", default=None)
+    parser.add_argument("--threshold", type=float, help="Slowdown or memory growth factor counted as a regression (optional, defaults to 1.5).", default=1.5)
+    args = parser.parse_args()
+
+    results_df = run_benchmark(args.sizes, seed=args.seed, data_dir=args.data_dir, mismatch_rate=args.mismatch_rate,
+                               missing_rate=args.missing_rate, extra_rate=args.extra_rate,
+                               abbreviation_rate=args.abbreviation_rate)
+    save_benchmark(results_df, args.uid)
+    if args.baseline is not None:
+        regressions = find_regressions(results_df, load_benchmark(args.baseline), args.threshold)
+        if regressions:
+            raise SystemExit("Benchmark regressions:\n" + "\n".join(regressions))
+        print(f"No regressions against {args.baseline}")
@@ -0,0 +1,190 @@
+"""
+Bootstrap confidence intervals and paired significance tests for the evaluation metrics.
+
+Resampling is done over osmids (rows of the GT/prediction outer merge) using the
+per-(osmid, tag) status matrix produced by eval.py. A metric only depends on the TP/FP/FN
+totals it is computed from, and every osmid contributes one of a few distinct (tp, fp, fn)
+rows to them: at most 4 for a single tag, and a small number of per-osmid totals for the
+overall metrics. A bootstrap resample is therefore fully described by how many times each
+distinct contribution is drawn, so all resamples are drawn at once as multinomial counts
+over the distinct contributions and turned into totals with one matrix product, instead of
+materializing 10k index arrays over the osmids.
+"""
+import numpy as np
+import pandas as pd
+
+from status_cache import STATUS_FN, STATUS_FP, STATUS_MISMATCH, STATUS_TP, status_counts
+
+# Resamples drawn per block, to bound memory when there are many distinct contributions
+_BLOCK_SIZE = 1000
+
+
+def status_indicators(status):
+    """(osmids, tags, 3) int64 TP/FP/FN indicators of a status matrix (mismatches count as FP and FN)."""
+    mismatch = status == STATUS_MISMATCH
+    return np.stack([status == STATUS_TP,
+                     (status == STATUS_FP) | mismatch,
+                     (status == STATUS_FN) | mismatch], axis=-1).astype(np.int64)
+
+
+def _distinct_rows(contributions):
+    """
+    Distinct rows of a non-negative integer matrix and their counts. Rows are encoded as
+    one integer each (mixed radix over the column ranges), since sorting integers is much
+    faster than np.unique(axis=0) on a million rows.
+    """
+    radixes = contributions.max(axis=0) + 1
+    if np.prod(radixes.astype(float)) >= 2 ** 62:
+        return np.unique(contributions, axis=0, return_counts=True)
+    multipliers = np.concatenate([np.cumprod(radixes[::-1])[::-1][1:], [1]])
+    _, first, counts = np.unique(contributions @ multipliers, return_index=True, return_counts=True)
+    return contributions[first], counts
+
+
+def bootstrap_totals(contributions, n_resamples, rng):
+    """
+    Bootstrap the column totals of a per-osmid contribution matrix.
+
+    Args:
+        contributions: (osmids, m) integer matrix, one row per osmid
+        n_resamples: number of resamples over osmids
+        rng: numpy Generator
+
+    Returns:
+        (n_resamples, m) int64 array of column totals per resample
+    """
+    contributions = np.ascontiguousarray(contributions, dtype=np.int64)
+    n_rows, n_columns = contributions.shape
+    totals = np.zeros((n_resamples, n_columns), dtype=np.int64)
+    if n_rows == 0:
+        return totals
+    distinct, counts = _distinct_rows(contributions)
+    probabilities = counts / n_rows
+    for start in range(0, n_resamples, _BLOCK_SIZE):
+        size = min(_BLOCK_SIZE, n_resamples - start)
+        draws = rng.multinomial(n_rows, probabilities, size=size)
+        totals[start:start + size] = draws @ distinct
+    return totals
+
+
+def bootstrap_counts(status, n_resamples, seed=0):
+    """
+    Bootstrap TP/FP/FN totals per tag and overall.
+
+    Every tag and the overall totals are resampled separately, so the result gives the
+    bootstrap distribution of each of them but not their joint distribution.
+
+    Returns an (n_resamples, n_tags + 1, 3) int64 array of (tp, fp, fn) per resample and
+    tag, the last "tag" being the overall totals.
+    """
+    rng = np.random.default_rng(seed)
+    indicators = status_indicators(status)
+    per_tag = [bootstrap_totals(indicators[:, j], n_resamples, rng) for j in range(status.shape[1])]
+    overall = bootstrap_totals(indicators.sum(axis=1), n_resamples, rng)
+    return np.stack(per_tag + [overall], axis=1)
+
+
+def precision_recall_f1(tp, fp, fn):
+    """Vectorized precision, recall and F1 with the same zero-division convention as eval.py (0)."""
+    tp, fp, fn = (np.asarray(x, dtype=float) for x in (tp, fp, fn))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(tp + fp > 0, tp / (tp + fp), 0.0)
+        recall = np.where(tp + fn > 0, tp / (tp + fn), 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+    return precision, recall, f1
+
+
+def _with_overall(counts):
+    # Append the overall totals (sum over tags) as an extra tag on axis -2
+    return np.concatenate([counts, counts.sum(axis=-2, keepdims=True)], axis=-2)
+
+
+def bootstrap_confidence_intervals(status, osm_tags, n_resamples=10000, confidence=0.95, seed=0):
+    """
+    Percentile bootstrap confidence intervals for precision, recall and F1, per tag and overall.
+
+    Args:
+        status: (osmids x tags) status code matrix of one run
+        osm_tags: tag names of the status matrix columns
+        n_resamples: number of bootstrap resamples over osmids
+        confidence: confidence level of the intervals
+
+    Returns:
+        DataFrame with one row per tag plus 'overall': point estimates and interval bounds
+    """
+    point = precision_recall_f1(*np.moveaxis(_with_overall(status_counts(status)), -1, 0))
+    resampled = precision_recall_f1(*np.moveaxis(bootstrap_counts(status, n_resamples, seed), -1, 0))
+    alpha = (1 - confidence) / 2
+
+    result = {'osm_tag': list(osm_tags) + ['overall']}
+    for name, estimate, samples in zip(['precision', 'recall', 'f1'], point, resampled):
+        low, high = np.quantile(samples, [alpha, 1 - alpha], axis=0)
+        result[name] = np.round(estimate, 4)
+        result[f'{name}_low'] = np.round(low, 4)
+        result[f'{name}_high'] = np.round(high, 4)
+    return pd.DataFrame(result)
+
+
+def _f1_indicators(indicators):
+    # (..., 2) TP and FP + FN indicators of (..., 3) TP/FP/FN indicators
+    return np.stack([indicators[..., 0], indicators[..., 1] + indicators[..., 2]], axis=-1)
+
+
+def _f1(tp, errors):
+    # F1 of TP and FP + FN totals, 0 without TP as in precision_recall_f1
+    tp, errors = np.asarray(tp, dtype=float), np.asarray(errors, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(tp > 0, 2 * tp / (2 * tp + errors), 0.0)
+
+
+def paired_bootstrap_test(status_a, status_b, osm_tags, n_resamples=10000, confidence=0.95, seed=0):
+    """
+    Paired bootstrap comparison of the F1 of two runs on the same osmids.
+
+    status_a and status_b must be aligned row by row (same osmid per row) and column by
+    column (same osm_tags). Both runs are resampled with the same osmids. The two-sided
+    p-value is twice the smaller share of resamples with an F1 difference <= 0 or >= 0,
+    counted as (k + 1) / (n_resamples + 1) so that it is never 0, and capped at 1.
+
+    Most of the time goes into the multinomial draws of the overall totals, whose per-osmid
+    contributions have a few thousand distinct rows for 11 tags: about 4 seconds for 1M ways
+    and 10k resamples on one core.
+
+    Returns:
+        DataFrame with one row per tag plus 'overall': F1 of both runs, their difference,
+        the confidence interval of the difference and the p-value
+    """
+    # F1 = 2 TP / (2 TP + FP + FN) only depends on TP and FP + FN, so only those are resampled:
+    # fewer distinct contributions, and fewer multinomial categories, than with (tp, fp, fn).
+    # Each tag and the overall totals are resampled with the same osmids for both runs
+    rng = np.random.default_rng(seed)
+    f1_indicators_a = _f1_indicators(status_indicators(status_a))
+    f1_indicators_b = _f1_indicators(status_indicators(status_b))
+    joint_contributions = [np.concatenate([f1_indicators_a[:, j], f1_indicators_b[:, j]], axis=1)
+                           for j in range(len(osm_tags))]
+    joint_contributions.append(np.concatenate([f1_indicators_a.sum(axis=1), f1_indicators_b.sum(axis=1)], axis=1))
+    joint_counts = np.stack([bootstrap_totals(contributions, n_resamples, rng)
+                             for contributions in joint_contributions], axis=1)
+    f1_a = _f1(joint_counts[..., 0], joint_counts[..., 1])
+    f1_b = _f1(joint_counts[..., 2], joint_counts[..., 3])
+    _, _, point_a = precision_recall_f1(*np.moveaxis(_with_overall(status_counts(status_a)), -1, 0))
+    _, _, point_b = precision_recall_f1(*np.moveaxis(_with_overall(status_counts(status_b)), -1, 0))
+
+    diff = f1_a - f1_b
+    point_diff = point_a - point_b
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(diff, [alpha, 1 - alpha], axis=0)
+    # (k + 1) / (B + 1): the observed sample counts as one of the resamples
+    share_le = ((diff <= 0).sum(axis=0) + 1) / (n_resamples + 1)
+    share_ge = ((diff >= 0).sum(axis=0) + 1) / (n_resamples + 1)
+    p_value = np.minimum(1.0, 2 * np.minimum(share_le, share_ge))
+
+    return pd.DataFrame({
+        'osm_tag': list(osm_tags) + ['overall'],
+        'f1_a': np.round(point_a, 4),
+        'f1_b': np.round(point_b, 4),
+        'f1_diff': np.round(point_diff, 4),
+        'f1_diff_low': np.round(low, 4),
+        'f1_diff_high': np.round(high, 4),
+        'p_value': np.round(p_value, 4),
+    })
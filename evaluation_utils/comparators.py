@@ -0,0 +1,216 @@
+"""
+Per-tag comparators deciding whether a predicted value matches the ground truth.
+
+A comparator parses a whole column of values once into a typed representation (numbers,
+speeds in km/h, turn lanes as arrays of per-lane codes) and then compares a parsed GT
+column with a parsed prediction column element by element with numpy. Parsing is done
+once per distinct raw value, since values repeat heavily across ways.
+
+Comparators are looked up by OSM tag in a registry. Tags of eval.OSM_TAGS without a
+registered comparator are compared with ==, so adding a tag only takes an OSM_TAGS entry
+and, if its values need parsing, a register_comparator call.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+
+def _map_unique(values, parse_value, dtype=object):
+    """Apply parse_value to every distinct value of a Series of present values and broadcast back to the rows."""
+    codes, uniques = pd.factorize(values.astype(str))
+    return np.array([parse_value(value) for value in uniques], dtype=dtype)[codes]
+
+
+def _normalize_text(value):
+    return value.strip().lower()
+
+
+class ExactComparator:
+    """Values match if they are equal as Python objects (e.g. 'yes' == 'yes')."""
+
+    def parse(self, values):
+        """Parse a Series of present (non-null) values into the representation used by equals()."""
+        return values.to_numpy(dtype=object)
+
+    def equals(self, gt_parsed, pred_parsed):
+        """Boolean array: whether each parsed GT value matches the parsed prediction."""
+        return np.asarray(gt_parsed == pred_parsed, dtype=bool)
+
+    def canonical(self, values):
+        """
+        Canonical text of each value of a Series of present values. Values with the same
+        canonical text are parsed alike, so they get the same status against any GT value.
+        """
+        codes, uniques = pd.factorize(values)
+        return self.canonical_uniques(pd.Series(uniques, dtype=values.dtype))[codes]
+
+    def canonical_uniques(self, values):
+        """canonical() of a Series of distinct values, as an object ndarray."""
+        # Exact comparison tells 2 from '2', so the type is part of the value
+        return np.array([f'{type(value).__name__}:{value}' for value in values], dtype=object)
+
+    def similarity(self, gt_parsed, pred_parsed):
+        """Partial credit in [0, 1] of each pair. Comparators without partial credit give 1 or 0."""
+        return self.equals(gt_parsed, pred_parsed).astype(float)
+
+    def config(self):
+        """JSON-serializable description of the comparison rules (part of the scoring fingerprint)."""
+        return {'type': type(self).__name__}
+
+
+class StreetNameComparator(ExactComparator):
+    """Street names match after normalization with a StreetNameNormalizer (see eval.py)."""
+
+    def __init__(self, normalizer):
+        self.normalizer = normalizer
+
+    def parse(self, values):
+        return self.normalizer.normalize_column(values)
+
+    def canonical_uniques(self, values):
+        return self.parse(values)
+
+
+class NumericComparator(ExactComparator):
+    """
+    Numbers such as lane counts: "2", 2 and 2.0 match.
+    Values that are not numbers are compared as stripped, lower-cased text.
+    """
+
+    def parse_number(self, text):
+        """Parse normalized text into a float, or NaN if it isn't a number."""
+        try:
+            return float(text)
+        except ValueError:
+            return np.nan
+
+    def parse(self, values):
+        text = _map_unique(values, _normalize_text)
+        numbers = _map_unique(pd.Series(text), self.parse_number, dtype=float)
+        return numbers, text
+
+    def canonical_uniques(self, values):
+        numbers, text = self.parse(values)
+        return np.array([f'text:{value_text}' if np.isnan(number) else f'number:{number!r}'
+                         for number, value_text in zip(numbers, text)], dtype=object)
+
+    def equals(self, gt_parsed, pred_parsed):
+        (gt_numbers, gt_text), (pred_numbers, pred_text) = gt_parsed, pred_parsed
+        gt_numeric = ~np.isnan(gt_numbers)
+        pred_numeric = ~np.isnan(pred_numbers)
+        with np.errstate(invalid='ignore'):
+            numbers_match = gt_numeric & pred_numeric & np.isclose(gt_numbers, pred_numbers, rtol=0, atol=1e-6)
+        text_match = ~gt_numeric & ~pred_numeric & (gt_text == pred_text)
+        return numbers_match | text_match
+
+
+# Conversion factors of maxspeed units to km/h
+SPEED_UNITS = {'km/h': 1.0, 'kmh': 1.0, 'kph': 1.0, 'mph': 1.609344, 'knots': 1.852}
+_SPEED_PATTERN = re.compile(r'^(\d+(?:\.\d+)?)\s*(' + '|'.join(re.escape(unit) for unit in SPEED_UNITS) + r')?$')
+
+
+class SpeedComparator(NumericComparator):
+    """
+    Speed limits, compared in km/h: "25 mph", "25mph" and "40.2336 km/h" match.
+    Speeds without a unit are read in default_unit, e.g. with default_unit='mph'
+    (as registered in eval.py) "25" matches "25 mph" but "50" does not match
+    "50 km/h". Values that are not speeds (e.g. "none", "walk", "signals") are
+    compared as stripped, lower-cased text.
+    """
+
+    def __init__(self, default_unit='km/h'):
+        assert default_unit in SPEED_UNITS, f"Unknown speed unit: {default_unit}"
+        self.default_unit = default_unit
+
+    def parse_number(self, text):
+        match = _SPEED_PATTERN.match(text)
+        if match is None:
+            return np.nan
+        return float(match.group(1)) * SPEED_UNITS[match.group(2) or self.default_unit]
+
+    def config(self):
+        return {'type': type(self).__name__, 'default_unit': self.default_unit}
+
+
+class TurnLanesComparator(ExactComparator):
+    """
+    Turn lane markings such as "left|through;right".
+
+    Each lane is canonicalized (lower case, no spaces, arrows deduplicated and sorted,
+    ':' accepted as an arrow separator like ';', 'none' read as a lane without arrows)
+    and encoded as an integer code, so a value becomes an array of lane codes padded
+    with -1. Values match if they have the same lanes in the same order. The partial
+    credit of a pair is the share of positions with the same lane, over the larger
+    number of lanes.
+    """
+
+    def __init__(self):
+        self._lane_codes = {}
+
+    @staticmethod
+    def canonical_lanes(value):
+        """Canonical lanes of a turn:lanes string, e.g. ['left', 'right;through'] for "Left | through;right"."""
+        lanes = []
+        for lane in value.lower().replace(' ', '').split('|'):
+            arrows = sorted(set(arrow for arrow in re.split('[;:]', lane) if arrow not in ('', 'none')))
+            lanes.append(';'.join(arrows))
+        return lanes
+
+    def encode(self, value):
+        """Encode a turn:lanes string as a list of lane codes."""
+        return [self._lane_codes.setdefault(lane, len(self._lane_codes)) for lane in self.canonical_lanes(value)]
+
+    def parse(self, values):
+        codes, uniques = pd.factorize(values.astype(str))
+        encoded = [self.encode(value) for value in uniques]
+        lengths = np.array([len(lanes) for lanes in encoded], dtype=np.int64)
+        lanes = np.full((len(encoded), lengths.max(initial=0)), -1, dtype=np.int64)
+        for i, value_lanes in enumerate(encoded):
+            lanes[i, :len(value_lanes)] = value_lanes
+        return lanes[codes], lengths[codes]
+
+    def canonical_uniques(self, values):
+        # Lane codes depend on the values seen before, so the canonical lanes are used instead
+        return np.array(['|'.join(self.canonical_lanes(value)) for value in values.astype(str)], dtype=object)
+
+    @staticmethod
+    def _matching_lanes(gt_parsed, pred_parsed):
+        # Number of positions where both values have the same lane
+        (gt_lanes, _), (pred_lanes, _) = gt_parsed, pred_parsed
+        width = max(gt_lanes.shape[1], pred_lanes.shape[1])
+        gt_lanes = np.pad(gt_lanes, ((0, 0), (0, width - gt_lanes.shape[1])), constant_values=-1)
+        pred_lanes = np.pad(pred_lanes, ((0, 0), (0, width - pred_lanes.shape[1])), constant_values=-1)
+        return ((gt_lanes == pred_lanes) & (gt_lanes >= 0)).sum(axis=1)
+
+    def equals(self, gt_parsed, pred_parsed):
+        gt_lengths, pred_lengths = gt_parsed[1], pred_parsed[1]
+        return (gt_lengths == pred_lengths) & (self._matching_lanes(gt_parsed, pred_parsed) == gt_lengths)
+
+    def similarity(self, gt_parsed, pred_parsed):
+        lanes = np.maximum(np.maximum(gt_parsed[1], pred_parsed[1]), 1)
+        return self._matching_lanes(gt_parsed, pred_parsed) / lanes
+
+
+EXACT_COMPARATOR = ExactComparator()
+
+# Comparator of each OSM tag, see register_comparator
+COMPARATORS = {}
+
+
+def register_comparator(osm_tags, comparator):
+    """Use comparator for the given OSM tag (or list of tags)."""
+    if isinstance(osm_tags, str):
+        osm_tags = [osm_tags]
+    for osm_tag in osm_tags:
+        COMPARATORS[osm_tag] = comparator
+
+
+def get_comparator(osm_tag):
+    """Comparator registered for an OSM tag, exact comparison by default."""
+    return COMPARATORS.get(osm_tag, EXACT_COMPARATOR)
+
+
+def comparators_config(osm_tags):
+    """Comparison rules of the given tags, for fingerprinting."""
+    return {osm_tag: get_comparator(osm_tag).config() for osm_tag in osm_tags}
@@ -1,7 +1,22 @@
 import os
+import glob
+import json
+import shutil
+import tempfile
+import numpy as np
 import pandas as pd
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from functools import lru_cache
+
+from bootstrap import bootstrap_confidence_intervals, paired_bootstrap_test
+from comparators import (NumericComparator, SpeedComparator, StreetNameComparator, TurnLanesComparator,
+                         comparators_config, get_comparator, register_comparator)
+from geo_slices import GeoSlicer, save_geo_metrics
+from metadata_cache import load_metadata
+from status_cache import (NO_PREDICTION_HASH, fingerprint, hash_prediction_rows, load_status_table,
+                          save_status_table, status_codes, status_counts, status_masks)
 
 OSM_TAGS = {'name': True,  # street name
             'oneway': True,  # one way + dne
@@ -16,104 +31,166 @@ OSM_TAGS = {'name': True,  # street name
             'maxspeed:backward': True,  # speed limit
             }
 
-def _normalize_st_abbreviation(word, position, total_words):
-    """
-    Contextually normalize "St" abbreviation:
-    - At the beginning of a name: "St" -> "saint" (e.g., "St James Place")
-    - Otherwise: "St" -> "street" (e.g., "Main St")
-    """
-    if word == 'st' and position == 0:
-        return 'saint'
-    elif word == 'st':
-        return 'street'
-    return None
+# Bump when the scoring logic changes, to invalidate saved status tables
+SCORING_VERSION = 3
 
+# Paths relative to the repository root
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_GT_PATH = os.path.join(REPO_ROOT, 'metadata', 'ground_truth.csv')
+RESULTS_DIR = os.path.join(REPO_ROOT, 'evaluation_results')
 
-def preprocess(string):
+# Common street name abbreviations mapped to full words (US English)
+ABBREVIATIONS = {
+    'st': 'street',  # Default, but overridden at the start of a name by LEADING_ABBREVIATIONS
+    'st.': 'street',
+    'str': 'street',
+    'str.': 'street',
+    'pl': 'place',
+    'pl.': 'place',
+    'ave': 'avenue',
+    'ave.': 'avenue',
+    'av': 'avenue',
+    'av.': 'avenue',
+    'rd': 'road',
+    'rd.': 'road',
+    'dr': 'drive',
+    'dr.': 'drive',
+    'ln': 'lane',
+    'ln.': 'lane',
+    'blvd': 'boulevard',
+    'blvd.': 'boulevard',
+    'ct': 'court',
+    'ct.': 'court',
+    'cir': 'circle',
+    'cir.': 'circle',
+    'pkwy': 'parkway',
+    'pkwy.': 'parkway',
+    'e': 'east',
+    'e.': 'east',
+    'w': 'west',
+    'w.': 'west',
+    'n': 'north',
+    'n.': 'north',
+    's': 'south',
+    's.': 'south',
+}
+
+# Abbreviations with a different meaning at the beginning of a name
+# e.g., "St James Place" -> "saint james place" but "Main St" -> "main street"
+LEADING_ABBREVIATIONS = {
+    'st': 'saint',
+}
+
+
+class StreetNameNormalizer:
     """
     Normalize street names for comparison by:
     - Converting to lowercase
     - Removing punctuation and question marks
-    - Normalizing common street name abbreviations
+    - Normalizing street name abbreviations (contextually for the first word)
     - Removing extra whitespace
+
+    The abbreviation tables are compiled once per instance and results are memoized
+    per raw string in a bounded LRU cache, since names repeat heavily across ways.
     """
-    if pd.isna(string) or string is None:
-        return ''
-    
-    string = str(string)
-    
-    # Convert to lowercase
-    string = string.lower()
-    
-    # Remove question marks and other uncertainty markers (common in OCR/predictions)
-    string = string.replace('?', '').replace('¿', '')
-    
-    # Normalize common street name abbreviations
-    # Dictionary mapping abbreviations to full words
-    abbreviations = {
-        'st': 'street',  # Default, but will be overridden by _normalize_st_abbreviation for contextual cases
-        'st.': 'street',
-        'str': 'street',
-        'str.': 'street',
-        'pl': 'place',
-        'pl.': 'place',
-        'ave': 'avenue',
-        'ave.': 'avenue',
-        'av': 'avenue',
-        'av.': 'avenue',
-        'rd': 'road',
-        'rd.': 'road',
-        'dr': 'drive',
-        'dr.': 'drive',
-        'ln': 'lane',
-        'ln.': 'lane',
-        'blvd': 'boulevard',
-        'blvd.': 'boulevard',
-        'ct': 'court',
-        'ct.': 'court',
-        'cir': 'circle',
-        'cir.': 'circle',
-        'pkwy': 'parkway',
-        'pkwy.': 'parkway',
-        'e': 'east',
-        'e.': 'east',
-        'w': 'west',
-        'w.': 'west',
-        'n': 'north',
-        'n.': 'north',
-        's': 'south',
-        's.': 'south',
-    }
-    
-    # Split into words and normalize
-    words = string.split()
-    normalized_words = []
-    for i, word in enumerate(words):
+
+    def __init__(self, abbreviations=None, leading_abbreviations=None, cache_size=100000):
+        if abbreviations is None:
+            abbreviations = ABBREVIATIONS
+        if leading_abbreviations is None:
+            leading_abbreviations = LEADING_ABBREVIATIONS
+        self.abbreviations = self._compile_table(abbreviations)
+        self.leading_abbreviations = self._compile_table(leading_abbreviations)
+        self._normalize_cached = lru_cache(maxsize=cache_size, typed=True)(self._normalize_string)
+
+    @staticmethod
+    def _clean_word(word):
         # Remove punctuation (periods, commas)
-        word = word.strip().replace('.', '').replace(',', '')
-        
-        # Handle "St" contextually first (special case)
-        st_normalized = _normalize_st_abbreviation(word, i, len(words))
-        if st_normalized is not None:
-            word = st_normalized
-        elif word in abbreviations:
-            word = abbreviations[word]
-        
-        normalized_words.append(word)
-    
-    # Join and remove extra whitespace
-    result = ' '.join(normalized_words)
-    # Remove any remaining extra spaces
-    result = ' '.join(result.split())
-    
-    return result
+        return word.strip().replace('.', '').replace(',', '')
+
+    @classmethod
+    def _compile_table(cls, table):
+        # Words are looked up after punctuation removal, so keys are cleaned the same way.
+        # Keys that are already clean take precedence over their punctuated variants.
+        compiled = {}
+        for key in sorted(table, key=lambda k: cls._clean_word(k.lower()) != k.lower()):
+            compiled.setdefault(cls._clean_word(key.lower()), table[key].lower())
+        return compiled
+
+    @classmethod
+    def from_file(cls, path, cache_size=100000):
+        """
+        Load a locale-specific abbreviation table from a JSON file of the form
+        {"abbreviations": {"str": "strasse", ...}, "leading_abbreviations": {"st": "sankt", ...}}.
+        "leading_abbreviations" is optional and defaults to an empty table.
+        """
+        with open(path, 'r', encoding='utf-8') as f:
+            tables = json.load(f)
+        return cls(tables['abbreviations'], tables.get('leading_abbreviations', {}), cache_size=cache_size)
+
+    def _normalize_string(self, string):
+        # Convert to lowercase
+        string = string.lower()
+
+        # Remove question marks and other uncertainty markers (common in OCR/predictions)
+        string = string.replace('?', '').replace('¿', '')
+
+        normalized_words = []
+        for i, word in enumerate(string.split()):
+            word = self._clean_word(word)
+            if i == 0 and word in self.leading_abbreviations:
+                word = self.leading_abbreviations[word]
+            else:
+                word = self.abbreviations.get(word, word)
+            # Words that were only punctuation are dropped
+            if word:
+                normalized_words.append(word)
+
+        return ' '.join(normalized_words)
+
+    def normalize(self, string):
+        """Normalize a single street name. Missing values normalize to ''."""
+        if pd.isna(string) or string is None:
+            return ''
+        return self._normalize_cached(str(string))
+
+    def normalize_column(self, values):
+        """
+        Normalize a whole Series of street names. Each distinct raw string is normalized
+        once and the results are broadcast back to the rows. Returns an object ndarray.
+        """
+        present = values.notna().to_numpy()
+        result = np.full(len(values), '', dtype=object)
+        if present.any():
+            codes, uniques = pd.factorize(values[present].astype(str))
+            normalized = np.array([self._normalize_cached(string) for string in uniques], dtype=object)
+            result[present] = normalized[codes]
+        return result
+
+    def cache_info(self):
+        return self._normalize_cached.cache_info()
+
+
+STREET_NAME_NORMALIZER = StreetNameNormalizer()
+
+# Typed comparison of tag values, other tags of OSM_TAGS are compared with ==
+register_comparator('name', StreetNameComparator(STREET_NAME_NORMALIZER))
+register_comparator(['lanes', 'lanes:forward', 'lanes:backward'], NumericComparator())
+# The benchmark covers US roads, where speed limits without a unit are meant in mph
+register_comparator(['maxspeed', 'maxspeed:forward', 'maxspeed:backward'], SpeedComparator(default_unit='mph'))
+register_comparator(['turn:lanes', 'turn:lanes:forward', 'turn:lanes:backward'], TurnLanesComparator())
+
+
+def preprocess(string):
+    """
+    Normalize a street name for comparison with the default (US) abbreviation table.
+    See StreetNameNormalizer for the normalization rules.
+    """
+    return STREET_NAME_NORMALIZER.normalize(string)
 
 
 def equals(gt_value, pred_value, map_feature):
-    if map_feature == 'name':
-        return preprocess(gt_value) == preprocess(pred_value)
-    else:
-        return gt_value == pred_value
+    return bool(equals_columns(pd.Series([gt_value]), pd.Series([pred_value]), map_feature)[0])
 
 
 def get_pred_status(gt_value, pred_value, map_feature):
@@ -133,6 +210,90 @@ def get_pred_status(gt_value, pred_value, map_feature):
         return 'fp'
 
 
+def get_tag_comparator(map_feature, name_normalizer=None):
+    """Comparator of a tag (see comparators.py); street names use name_normalizer if one is given."""
+    if map_feature == 'name' and name_normalizer is not None:
+        return StreetNameComparator(name_normalizer)
+    return get_comparator(map_feature)
+
+
+def equals_columns(gt_values, pred_values, map_feature, name_normalizer=None):
+    """
+    Column-wise counterpart of equals(): compares two aligned Series of present values
+    element by element with the tag's comparator and returns a boolean numpy array.
+    Each column is parsed once, so the result is the same as calling equals() on every pair.
+    """
+    comparator = get_tag_comparator(map_feature, name_normalizer)
+    return comparator.equals(comparator.parse(gt_values), comparator.parse(pred_values))
+
+
+def get_pred_status_masks(gt_values, pred_values, map_feature, name_normalizer=None, partial_credit=False):
+    """
+    Column-wise counterpart of get_pred_status() for the GT and prediction columns of a merged frame.
+    Returns boolean masks for 'tp', 'fp', 'fn' and 'mismatch'. Mismatches (both values exist
+    but don't match) are included in both the 'fp' and 'fn' masks.
+    With partial_credit, 'credit' is also returned: the comparator's partial credit of each
+    mismatched row (0 for other rows).
+    """
+    gt_present = gt_values.notna().to_numpy()
+    pred_present = pred_values.notna().to_numpy()
+    both_present = gt_present & pred_present
+
+    # Only compare rows where both values exist, each column is parsed once
+    comparator = get_tag_comparator(map_feature, name_normalizer)
+    gt_parsed = comparator.parse(gt_values[both_present])
+    pred_parsed = comparator.parse(pred_values[both_present])
+    match = np.zeros(len(gt_values), dtype=bool)
+    match[both_present] = comparator.equals(gt_parsed, pred_parsed)
+
+    mismatch = both_present & ~match
+    masks = {
+        'tp': both_present & match,
+        'fp': (pred_present & ~gt_present) | mismatch,
+        'fn': (gt_present & ~pred_present) | mismatch,
+        'mismatch': mismatch,
+    }
+    if partial_credit:
+        credit = np.zeros(len(gt_values), dtype=float)
+        credit[both_present] = comparator.similarity(gt_parsed, pred_parsed)
+        masks['credit'] = np.where(mismatch, credit, 0.0)
+    return masks
+
+
+def credited_counts(tp, fp, fn, credit):
+    """
+    Apply partial credit to TP/FP/FN counts: a mismatch with credit c counts as c TP
+    and 1 - c FP and FN instead of one FP and one FN.
+    """
+    return tp + credit, fp - credit, fn - credit
+
+
+def get_tag_issues(merged_df, osm_tag, masks):
+    """
+    Build the issues table (osmid, tag, issue_type, ground_truth, prediction) for one tag
+    from the status masks. Mismatches are listed once with issue_type 'Mismatch' rather than
+    as separate FP and FN rows. Missing values are '' for TP rows and '(empty)' otherwise.
+    """
+    mismatch = masks['mismatch']
+    issue_type = np.select([masks['tp'], masks['fp'] & ~mismatch, masks['fn'] & ~mismatch, mismatch],
+                           ['TP', 'FP', 'FN', 'Mismatch'], default='')
+    keep = issue_type != ''
+    empty_marker = np.where(masks['tp'], '', '(empty)').astype(object)
+
+    gt_values = merged_df[osm_tag + '_gt']
+    pred_values = merged_df[osm_tag + '_pred']
+    gt_values = np.where(gt_values.notna().to_numpy(), gt_values.to_numpy(dtype=object), empty_marker)
+    pred_values = np.where(pred_values.notna().to_numpy(), pred_values.to_numpy(dtype=object), empty_marker)
+
+    return pd.DataFrame({
+        'osmid': merged_df['osmid'].to_numpy()[keep],
+        'tag': osm_tag,
+        'issue_type': issue_type[keep].astype(object),
+        'ground_truth': gt_values[keep],
+        'prediction': pred_values[keep],
+    })
+
+
 def update_metrics(final_metrics, osm_tag, occurrences, tp, fp, fn, precision, recall, f1):
     final_metrics['osm_tag'].append(osm_tag)
     final_metrics['occurrences'].append(occurrences)
@@ -145,27 +306,79 @@ def update_metrics(final_metrics, osm_tag, occurrences, tp, fp, fn, precision, r
     return final_metrics
 
 
-def eval_map_feature_pred(pred_df_path, uid=None, gt_df_path=None, test_mode=False):
-    pred_df = pd.read_csv(pred_df_path, index_col=False)
-    # Get the script directory and construct paths relative to it
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    repo_root = os.path.dirname(script_dir)
+# Sections of the human-readable issues report: issue_type, title, marker used for missing values
+ISSUE_SECTIONS = [('TP', 'True Positives', ''),
+                  ('FP', 'False Positives', '(empty)'),
+                  ('FN', 'False Negatives', '(empty)'),
+                  ('Mismatch', 'Mismatched', '(empty)')]
+
+
+def format_issue_lines(type_issues, empty_marker):
+    """Format issues of one tag and issue type as report lines (missing values shown as None)."""
+    gt_vals = type_issues['ground_truth'].astype(object)
+    pred_vals = type_issues['prediction'].astype(object)
+    gt_vals = gt_vals.where(gt_vals != empty_marker, 'None').astype(str)
+    pred_vals = pred_vals.where(pred_vals != empty_marker, 'None').astype(str)
+    lines = '  id: ' + type_issues['osmid'].astype(str) + '  gt: ' + gt_vals + '  pred: ' + pred_vals + '\n'
+    return ''.join(lines.tolist())
+
+
+def write_issues_txt(issues_df, issues_txt):
+    """
+    Write the human-readable issues report, one section per tag and issue type.
+    Lines are formatted column-wise instead of row by row.
+    """
+    with open(issues_txt, 'w') as f:
+        # Group by tag
+        for tag in sorted(issues_df['tag'].unique()):
+            tag_issues = issues_df[issues_df['tag'] == tag]
+
+            f.write(f"{tag.upper()}\n")
+            f.write("=" * 80 + "\n\n")
+
+            for issue_type, title, empty_marker in ISSUE_SECTIONS:
+                type_issues = tag_issues[tag_issues['issue_type'] == issue_type]
+                if issue_type == 'Mismatch':
+                    # Mismatches are shown once per osmid even though they count as both FP and FN
+                    type_issues = type_issues.drop_duplicates(subset=['osmid', 'tag'])
+                if len(type_issues) == 0:
+                    continue
+                f.write(f"{title}:\n\n")
+                f.write(format_issue_lines(type_issues, empty_marker))
+                f.write("\n")
+
+            f.write("\n")
+
+
+def load_ground_truth(gt_df_path=None):
+    """Load the ground truth CSV (defaults to metadata/ground_truth.csv), through its columnar cache."""
     if gt_df_path is None:
-        gt_path = os.path.join(repo_root, 'metadata', 'ground_truth.csv')
-    else:
-        gt_path = gt_df_path
-    gt_df = pd.read_csv(gt_path, index_col=False)
+        gt_df_path = DEFAULT_GT_PATH
+    return load_metadata(gt_df_path)
+
+
+def get_name_normalizer(abbreviations_path=None):
+    """Street names are normalized with a locale-specific abbreviation table if one is given."""
+    if abbreviations_path is not None:
+        return StreetNameNormalizer.from_file(abbreviations_path)
+    return STREET_NAME_NORMALIZER
+
+
+def summarize_metrics(osm_tags, tag_counts, tag_occurrences):
+    """
+    Turn per-tag (tp, fp, fn) counts into metrics.
+    Tags of osm_tags missing from tag_counts are not in the ground truth and get an empty row.
+
+    Returns:
+        detailed_metrics: dict of per-tag tp/fp/fn/occurrences/precision/recall/f1
+        overall_metrics: dict of overall tp/fp/fn/precision/recall/f1
+        final_metrics_df: metrics table as written to metrics_{uid}.csv
+    """
     final_metrics = {'osm_tag': [], 'occurrences': [], 'tp': [], 'fp': [], 'fn': [], 'precision': [], 'recall': [], 'f1': []}
     
     # Store detailed metrics for test assertions
     detailed_metrics = {}
     
-    # Store detailed issues for each tag (for issues file generation)
-    all_issues = []
-
-    osm_tags = sorted(list(pred_df.columns))
-    osm_tags = [tag for tag in osm_tags if tag != 'osmid']
-    
     # Variables to store overall metrics
     total_tp = 0
     total_fp = 0
@@ -173,90 +386,13 @@ def eval_map_feature_pred(pred_df_path, uid=None, gt_df_path=None, test_mode=Fal
     
     for osm_tag in osm_tags:
 
-        assert osm_tag in OSM_TAGS.keys(), f"Invalid map feature: {osm_tag}"
-        if osm_tag not in gt_df.columns:
+        if osm_tag not in tag_counts:
             print(f"OSM tag '{osm_tag}' not found in ground truth dataframe.")
             final_metrics = update_metrics(final_metrics, osm_tag, 0, 0, 0, 0, None, None, None)
             continue
 
-        map_feature_gt_df = gt_df[['osmid', osm_tag]]
-        map_feature_pred_df = pred_df[['osmid', osm_tag]]
-        # Use outer merge to capture FPs (osmid in pred but not in GT) and FNs (osmid in GT but not in pred)
-        map_feature_gt_df = map_feature_gt_df.merge(map_feature_pred_df, on='osmid', how='outer', suffixes=('_gt', '_pred'))
-
-        # Count occurrences (non-null values in ground truth) - use original GT df before merge
-        occurrences = gt_df[osm_tag].notna().sum()
-
-        map_feature_gt_df['pred_status'] = map_feature_gt_df.apply(lambda x: get_pred_status(
-            x[osm_tag + '_gt'], x[osm_tag + '_pred'], osm_tag), axis=1)
-
-        # For mismatches (both exist but don't match), we need to count as both FP and FN
-        # Create separate columns for precision and recall counting
-        map_feature_gt_df['is_fp'] = map_feature_gt_df['pred_status'].isin(['fp'])
-        map_feature_gt_df['is_fn'] = map_feature_gt_df['pred_status'].isin(['fn'])
-        # Mismatches (wrong predictions when GT exists) count as both FP and FN
-        # A mismatch is when: pred_status is 'fp' AND both GT and pred have values (notna)
-        # This means it's a wrong prediction (FP) that also missed the correct answer (FN)
-        mismatch_mask = (map_feature_gt_df['pred_status'] == 'fp') & \
-                        map_feature_gt_df[osm_tag + '_gt'].notna() & \
-                        map_feature_gt_df[osm_tag + '_pred'].notna()
-        map_feature_gt_df.loc[mismatch_mask, 'is_fp'] = True
-        map_feature_gt_df.loc[mismatch_mask, 'is_fn'] = True
-
-        tp_samples = map_feature_gt_df[map_feature_gt_df['pred_status'] == 'tp']
-        fp_samples = map_feature_gt_df[map_feature_gt_df['is_fp'] == True]
-        fn_samples = map_feature_gt_df[map_feature_gt_df['is_fn'] == True]
-
-        tp_count = len(tp_samples)
-        fp_count = len(fp_samples)
-        fn_count = len(fn_samples)
-        
-        # Store issues for this tag
-        # True Positives
-        for _, row in tp_samples.iterrows():
-            all_issues.append({
-                'osmid': row['osmid'],
-                'tag': osm_tag,
-                'issue_type': 'TP',
-                'ground_truth': row[osm_tag + '_gt'] if pd.notna(row[osm_tag + '_gt']) else '',
-                'prediction': row[osm_tag + '_pred'] if pd.notna(row[osm_tag + '_pred']) else ''
-            })
-        
-        # Identify mismatches (they appear in both fp_samples and fn_samples, so we'll add them separately)
-        mismatch_samples = map_feature_gt_df[mismatch_mask]
-        mismatch_osmids = set(mismatch_samples['osmid'].values) if len(mismatch_samples) > 0 else set()
-        
-        # False Positives (excluding mismatches, as they'll be added separately)
-        for _, row in fp_samples.iterrows():
-            if row['osmid'] not in mismatch_osmids:
-                all_issues.append({
-                    'osmid': row['osmid'],
-                    'tag': osm_tag,
-                    'issue_type': 'FP',
-                    'ground_truth': row[osm_tag + '_gt'] if pd.notna(row[osm_tag + '_gt']) else '(empty)',
-                    'prediction': row[osm_tag + '_pred'] if pd.notna(row[osm_tag + '_pred']) else '(empty)'
-                })
-        
-        # False Negatives (excluding mismatches, as they'll be added separately)
-        for _, row in fn_samples.iterrows():
-            if row['osmid'] not in mismatch_osmids:
-                all_issues.append({
-                    'osmid': row['osmid'],
-                    'tag': osm_tag,
-                    'issue_type': 'FN',
-                    'ground_truth': row[osm_tag + '_gt'] if pd.notna(row[osm_tag + '_gt']) else '(empty)',
-                    'prediction': row[osm_tag + '_pred'] if pd.notna(row[osm_tag + '_pred']) else '(empty)'
-                })
-        
-        # Mismatches (add once, as they count as both FP and FN in metrics but should appear once in issues)
-        for _, row in mismatch_samples.iterrows():
-            all_issues.append({
-                'osmid': row['osmid'],
-                'tag': osm_tag,
-                'issue_type': 'Mismatch',
-                'ground_truth': row[osm_tag + '_gt'] if pd.notna(row[osm_tag + '_gt']) else '(empty)',
-                'prediction': row[osm_tag + '_pred'] if pd.notna(row[osm_tag + '_pred']) else '(empty)'
-            })
+        occurrences = tag_occurrences[osm_tag]
+        tp_count, fp_count, fn_count = tag_counts[osm_tag]
 
         # Update total counts for overall metrics
         total_tp += tp_count
@@ -286,6 +422,14 @@ def eval_map_feature_pred(pred_df_path, uid=None, gt_df_path=None, test_mode=Fal
     overall_precision = total_tp / (total_tp + total_fp) if (total_tp + total_fp) > 0 else 0
     overall_recall = total_tp / (total_tp + total_fn) if (total_tp + total_fn) > 0 else 0
     overall_f1 = (2 * overall_precision * overall_recall) / (overall_precision + overall_recall) if (overall_precision + overall_recall) > 0 else 0
+    overall_metrics = {
+        'tp': total_tp,
+        'fp': total_fp,
+        'fn': total_fn,
+        'precision': overall_precision,
+        'recall': overall_recall,
+        'f1': overall_f1
+    }
     
     # Add separator row and overall metrics
     final_metrics_df.loc[-1] = ['-' for _ in range(len(final_metrics_df.columns))]
@@ -293,7 +437,172 @@ def eval_map_feature_pred(pred_df_path, uid=None, gt_df_path=None, test_mode=Fal
     final_metrics_df.loc[-1] = ['overall', '-', total_tp, total_fp, total_fn,
                                round(overall_precision, 4), round(overall_recall, 4), round(overall_f1, 4)]
 
-    pred_dir = os.path.join(repo_root, 'evaluation_results')
+    return detailed_metrics, overall_metrics, final_metrics_df
+
+
+def get_osm_tags(pred_columns, gt_columns):
+    """Return the (sorted) tags of the predictions and the subset of them that can be scored against the GT."""
+    osm_tags = sorted(list(pred_columns))
+    osm_tags = [tag for tag in osm_tags if tag != 'osmid']
+    for osm_tag in osm_tags:
+        assert osm_tag in OSM_TAGS.keys(), f"Invalid map feature: {osm_tag}"
+    scored_tags = [tag for tag in osm_tags if tag in gt_columns]
+    return osm_tags, scored_tags
+
+
+def score_status(merged_df, scored_tags, name_normalizer=None, partial_credit=False):
+    """
+    Score every tag of a merged (osmid, *_gt, *_pred) frame as a (rows x tags) matrix of status codes.
+    With partial_credit, also returns the total partial credit of the mismatches of each tag.
+    """
+    status = np.zeros((len(merged_df), len(scored_tags)), dtype=np.int8)
+    credit = np.zeros(len(scored_tags), dtype=float)
+    for j, osm_tag in enumerate(scored_tags):
+        masks = get_pred_status_masks(merged_df[osm_tag + '_gt'], merged_df[osm_tag + '_pred'], osm_tag,
+                                      name_normalizer, partial_credit)
+        status[:, j] = status_codes(masks)
+        if partial_credit:
+            credit[j] = masks['credit'].sum()
+    if partial_credit:
+        return status, credit
+    return status
+
+
+def _build_results(merged_df, gt_df, osm_tags, scored_tags, status, counts):
+    # Count occurrences (non-null values in ground truth) - use original GT df before merge
+    tag_occurrences = {osm_tag: gt_df[osm_tag].notna().sum() for osm_tag in scored_tags}
+    # Counts are fractional with partial credit
+    tag_counts = {osm_tag: tuple(round(count.item(), 4) for count in counts[j])
+                  for j, osm_tag in enumerate(scored_tags)}
+    detailed_metrics, overall_metrics, final_metrics_df = summarize_metrics(osm_tags, tag_counts, tag_occurrences)
+
+    # Store detailed issues for each tag (for issues file generation)
+    all_issues = [get_tag_issues(merged_df, osm_tag, status_masks(status[:, j]))
+                  for j, osm_tag in enumerate(scored_tags)]
+    issues_df = pd.concat(all_issues, ignore_index=True) if all_issues else pd.DataFrame()
+    if len(issues_df) > 0:
+        # Sort by tag, then by issue_type, then by osmid
+        issues_df = issues_df.sort_values(['tag', 'issue_type', 'osmid'])
+
+    return detailed_metrics, overall_metrics, final_metrics_df, issues_df
+
+
+def _merge_gt_pred(pred_df, gt_df, scored_tags):
+    # Use a single outer merge for all tags to capture FPs (osmid in pred but not in GT)
+    # and FNs (osmid in GT but not in pred). The merged rows only depend on osmid, so this
+    # is the same frame the per-tag merges would produce, side by side.
+    return gt_df[['osmid'] + scored_tags].merge(pred_df[['osmid'] + scored_tags], on='osmid', how='outer',
+                                                suffixes=('_gt', '_pred'))
+
+
+def compute_metrics(pred_df, gt_df, name_normalizer=None, return_status=False, partial_credit=False):
+    """
+    Score a predictions dataframe against the ground truth dataframe.
+    With partial_credit, mismatches earn the partial credit of their tag's comparator
+    (see credited_counts), so TP/FP/FN counts can be fractional.
+
+    Returns:
+        detailed_metrics, overall_metrics, final_metrics_df: see summarize_metrics
+        issues_df: per-osmid issues table as written to issues_{uid}.csv
+        merged_df, status (only if return_status): the merged frame and its status code matrix
+    """
+    osm_tags, scored_tags = get_osm_tags(pred_df.columns, gt_df.columns)
+    merged_df = _merge_gt_pred(pred_df, gt_df, scored_tags)
+    if partial_credit:
+        status, credit = score_status(merged_df, scored_tags, name_normalizer, partial_credit=True)
+        counts = np.stack(credited_counts(*status_counts(status).T, credit), axis=1)
+    else:
+        status = score_status(merged_df, scored_tags, name_normalizer)
+        counts = status_counts(status)
+    results = _build_results(merged_df, gt_df, osm_tags, scored_tags, status, counts)
+    if return_status:
+        return results + (merged_df, status)
+    return results
+
+
+def get_scoring_fingerprint(gt_df, name_normalizer):
+    """Fingerprint of everything a status table depends on besides the predictions."""
+    if name_normalizer is None:
+        name_normalizer = STREET_NAME_NORMALIZER
+    return fingerprint(SCORING_VERSION, OSM_TAGS, comparators_config(OSM_TAGS), name_normalizer.abbreviations,
+                       name_normalizer.leading_abbreviations, gt_df)
+
+
+def _merged_row_hashes(merged_df, pred_df, pred_row_hashes):
+    # Rows of the outer merge without a prediction keep the NO_PREDICTION_HASH sentinel.
+    # With duplicate osmids the first prediction is used (such tables are never re-used).
+    pred_osmids = pd.Index(pred_df['osmid'].to_numpy())
+    first = ~pred_osmids.duplicated()
+    positions = pred_osmids[first].get_indexer(merged_df['osmid'].to_numpy())
+    row_hashes = np.full(len(merged_df), NO_PREDICTION_HASH, dtype=np.uint64)
+    row_hashes[positions >= 0] = pred_row_hashes[first][positions[positions >= 0]]
+    return row_hashes
+
+
+def compute_metrics_incremental(pred_df, gt_df, pred_row_hashes, previous_table, name_normalizer=None):
+    """
+    Score a predictions dataframe re-using the status table of a previous run.
+
+    Rows are matched by osmid; only rows whose prediction values changed as the comparators
+    read them (or that are new) are re-scored. The aggregate TP/FP/FN counts are updated from
+    the previous counts by removing the contribution of the changed rows and adding their new status.
+    The caller must check that the previous table is still valid (see load_previous_status).
+
+    Returns the same values as compute_metrics(..., return_status=True) plus the number
+    of re-scored rows.
+    """
+    osm_tags, scored_tags = get_osm_tags(pred_df.columns, gt_df.columns)
+    merged_df = _merge_gt_pred(pred_df, gt_df, scored_tags)
+    row_hashes = _merged_row_hashes(merged_df, pred_df, pred_row_hashes)
+
+    # Rows of the previous run with the same osmid and the same prediction keep their status
+    positions = pd.Index(previous_table['osmid']).get_indexer(merged_df['osmid'].to_numpy())
+    reused = positions >= 0
+    reused[reused] = previous_table['row_hash'][positions[reused]] == row_hashes[reused]
+    changed_rows = np.flatnonzero(~reused)
+
+    status = np.zeros((len(merged_df), len(scored_tags)), dtype=np.int8)
+    status[reused] = previous_table['status'][positions[reused]]
+    status[changed_rows] = score_status(merged_df.iloc[changed_rows], scored_tags, name_normalizer)
+
+    # Previous rows that were not reused (changed or gone) no longer count
+    dropped = np.ones(len(previous_table['osmid']), dtype=bool)
+    dropped[positions[reused]] = False
+    counts = previous_table['counts'] - status_counts(previous_table['status'][dropped]) \
+        + status_counts(status[changed_rows])
+
+    results = _build_results(merged_df, gt_df, osm_tags, scored_tags, status, counts)
+    return results + (merged_df, status, len(changed_rows))
+
+
+def load_previous_status(previous_uid, pred_df, gt_df, table_fingerprint):
+    """
+    Load the status table of a previous run if it can be re-used for these predictions:
+    same GT and scoring rules (fingerprint), same scored tags with the same prediction
+    dtypes, and unique osmids. Returns None otherwise.
+    """
+    path = os.path.join(RESULTS_DIR, f'status_{previous_uid}.npz')
+    if not os.path.exists(path):
+        print(f"No status table found for run '{previous_uid}', scoring all rows.")
+        return None
+    previous_table = load_status_table(path)
+    _, scored_tags = get_osm_tags(pred_df.columns, gt_df.columns)
+    pred_dtypes = [str(pred_df[osm_tag].dtype) for osm_tag in scored_tags]
+    if previous_table['fingerprint'] != table_fingerprint:
+        print(f"Ground truth or scoring rules changed since run '{previous_uid}', scoring all rows.")
+        return None
+    if previous_table['osm_tags'] != scored_tags or previous_table['pred_dtypes'] != pred_dtypes:
+        print(f"Prediction columns changed since run '{previous_uid}', scoring all rows.")
+        return None
+    if not (pred_df['osmid'].is_unique and gt_df['osmid'].is_unique and pd.Index(previous_table['osmid']).is_unique):
+        print("Incremental evaluation needs unique osmids, scoring all rows.")
+        return None
+    return previous_table
+
+
+def save_results(final_metrics_df, issues_df, uid=None):
+    """Write metrics_{uid}.csv/.md and issues_{uid}.csv/.txt to evaluation_results. Returns the uid."""
+    pred_dir = RESULTS_DIR
     os.makedirs(pred_dir, exist_ok=True)
     if uid is None:
         uid = datetime.now().strftime('%Y%m%d%H%M%S')
@@ -305,88 +614,470 @@ def eval_map_feature_pred(pred_df_path, uid=None, gt_df_path=None, test_mode=Fal
     final_metrics_df.to_csv(pred_csv, index=False)
 
     # Generate detailed issues file in human-readable format
-    if all_issues:
-        issues_df = pd.DataFrame(all_issues)
-        # Sort by tag, then by issue_type, then by osmid
-        issues_df = issues_df.sort_values(['tag', 'issue_type', 'osmid'])
-        
+    if len(issues_df) > 0:
         # Generate CSV file
         issues_csv = os.path.join(pred_dir, f'issues_{uid}.csv')
         issues_df.to_csv(issues_csv, index=False)
         
         # Generate human-readable text file
         issues_txt = os.path.join(pred_dir, f'issues_{uid}.txt')
-        with open(issues_txt, 'w') as f:
-            # Group by tag
-            for tag in sorted(issues_df['tag'].unique()):
-                tag_issues = issues_df[issues_df['tag'] == tag]
-                
-                f.write(f"{tag.upper()}\n")
-                f.write("=" * 80 + "\n\n")
-                
-                # True Positives
-                tp_issues = tag_issues[tag_issues['issue_type'] == 'TP']
-                if len(tp_issues) > 0:
-                    f.write("True Positives:\n\n")
-                    for _, row in tp_issues.iterrows():
-                        gt_val = row['ground_truth'] if row['ground_truth'] != '' else 'None'
-                        pred_val = row['prediction'] if row['prediction'] != '' else 'None'
-                        f.write(f"  id: {row['osmid']}  gt: {gt_val}  pred: {pred_val}\n")
-                    f.write("\n")
-                
-                # False Positives (excluding mismatches, as they'll be in Mismatched section)
-                fp_issues = tag_issues[(tag_issues['issue_type'] == 'FP')]
-                if len(fp_issues) > 0:
-                    f.write("False Positives:\n\n")
-                    for _, row in fp_issues.iterrows():
-                        gt_val = row['ground_truth'] if row['ground_truth'] != '(empty)' else 'None'
-                        pred_val = row['prediction'] if row['prediction'] != '(empty)' else 'None'
-                        f.write(f"  id: {row['osmid']}  gt: {gt_val}  pred: {pred_val}\n")
-                    f.write("\n")
-                
-                # False Negatives (excluding mismatches)
-                fn_issues = tag_issues[(tag_issues['issue_type'] == 'FN')]
-                if len(fn_issues) > 0:
-                    f.write("False Negatives:\n\n")
-                    for _, row in fn_issues.iterrows():
-                        gt_val = row['ground_truth'] if row['ground_truth'] != '(empty)' else 'None'
-                        pred_val = row['prediction'] if row['prediction'] != '(empty)' else 'None'
-                        f.write(f"  id: {row['osmid']}  gt: {gt_val}  pred: {pred_val}\n")
-                    f.write("\n")
-                
-                # Mismatches (only show once, not duplicated)
-                mismatch_issues = tag_issues[tag_issues['issue_type'] == 'Mismatch']
-                # Remove duplicates (mismatches appear twice - once as FP, once as FN)
-                mismatch_issues = mismatch_issues.drop_duplicates(subset=['osmid', 'tag'])
-                if len(mismatch_issues) > 0:
-                    f.write("Mismatched:\n\n")
-                    for _, row in mismatch_issues.iterrows():
-                        gt_val = row['ground_truth'] if row['ground_truth'] != '(empty)' else 'None'
-                        pred_val = row['prediction'] if row['prediction'] != '(empty)' else 'None'
-                        f.write(f"  id: {row['osmid']}  gt: {gt_val}  pred: {pred_val}\n")
-                    f.write("\n")
-                
-                f.write("\n")
+        write_issues_txt(issues_df, issues_txt)
         
         print(f"Detailed issues saved to {pred_dir}/issues_{uid}.txt (and {pred_dir}/issues_{uid}.csv)")
     
     print(f"Evaluation completed. Metrics saved to {pred_dir}/metrics_{uid}")
+    return uid
+
+
+def eval_map_feature_pred(pred_df_path, uid=None, gt_df_path=None, test_mode=False, abbreviations_path=None,
+                          gt_df=None, chunksize=None, save_status=False, previous_uid=None, bootstrap=None,
+                          confidence=0.95, compare_path=None, seed=0, partial_credit=False, calls_path=None,
+                          geo_slicer=None):
+    """
+    Evaluate a predictions CSV against the ground truth and write metrics_{uid} and issues_{uid} files.
+
+    With save_status, a per-(osmid, tag) status table is also saved to status_{uid}.npz.
+    With previous_uid, the status table of that run is re-used so that only rows whose
+    predictions changed are re-scored (the new table is saved as well). The previous table
+    is ignored if the ground truth or the scoring rules changed since.
+
+    With bootstrap (number of resamples), confidence intervals of precision, recall and F1
+    are written to confidence_{uid}.csv/.md. With compare_path as well, the F1 of this run is
+    compared to the predictions in compare_path with a paired bootstrap test, written to
+    significance_{uid}.csv/.md.
+
+    With partial_credit, mismatches earn partial credit (e.g. the share of matching lanes
+    of turn:lanes), see compute_metrics.
+
+    With calls_path, a CSV of LLM calls per osmid (e.g. AsyncRoadSequenceRunner.calls_summary),
+    the calls of the run are written next to its F1 to calls_{uid}.csv/.md, see summarize_calls.
+
+    With geo_slicer (a geo_slices.GeoSlicer), metrics per grid cell or polygon are written
+    to geo_metrics_{uid}.geojson/.csv, see save_geo_metrics.
+    """
+    # An already loaded ground truth dataframe can be passed to skip re-reading it
+    if gt_df is None:
+        gt_df = load_ground_truth(gt_df_path)
+    assert compare_path is None or bootstrap is not None, "A paired comparison needs the number of bootstrap resamples"
+    assert not partial_credit or (not save_status and previous_uid is None and bootstrap is None), \
+        "Partial credit is not supported with status tables and bootstrap"
+    assert geo_slicer is None or (chunksize is None and not partial_credit), \
+        "Geo-sliced metrics are not supported in streaming mode and with partial credit"
+    if uid is None:
+        uid = datetime.now().strftime('%Y%m%d%H%M%S')
+
+    if chunksize is not None:
+        assert not save_status and previous_uid is None and bootstrap is None, \
+            "Status tables and bootstrap are not supported in streaming mode"
+        # Stream predictions that don't fit in memory
+        detailed_metrics, overall_metrics, final_metrics_df = eval_map_feature_pred_streaming(
+            pred_df_path, uid, chunksize=chunksize, abbreviations_path=abbreviations_path, gt_df=gt_df,
+            partial_credit=partial_credit)
+    elif save_status or previous_uid is not None or bootstrap is not None:
+        detailed_metrics, overall_metrics, final_metrics_df, merged_df, status, uid = _eval_with_status(
+            pred_df_path, uid, gt_df, abbreviations_path, previous_uid,
+            save_status=save_status or previous_uid is not None)
+        if bootstrap is not None:
+            scored_tags = list(detailed_metrics)
+            confidence_df = bootstrap_confidence_intervals(status, scored_tags, bootstrap, confidence, seed)
+            _save_table(confidence_df, f'confidence_{uid}')
+            if compare_path is not None:
+                significance_df = compare_runs(merged_df['osmid'], status, scored_tags, compare_path, gt_df,
+                                               abbreviations_path, bootstrap, confidence, seed)
+                _save_table(significance_df, f'significance_{uid}')
+    else:
+        pred_df = pd.read_csv(pred_df_path, index_col=False)
+        name_normalizer = get_name_normalizer(abbreviations_path)
+        results = compute_metrics(pred_df, gt_df, name_normalizer, return_status=geo_slicer is not None,
+                                  partial_credit=partial_credit)
+        detailed_metrics, overall_metrics, final_metrics_df, issues_df = results[:4]
+        save_results(final_metrics_df, issues_df, uid)
+        if geo_slicer is not None:
+            merged_df, status = results[4:]
+
+    if geo_slicer is not None:
+        save_geo_metrics(geo_slicer, merged_df['osmid'], status, list(detailed_metrics), RESULTS_DIR, uid)
+
+    if calls_path is not None:
+        calls_df = pd.read_csv(calls_path, index_col=False)
+        _save_table(summarize_calls(calls_df, overall_metrics, detailed_metrics), f'calls_{uid}')
     
     # Run test assertions if in test mode
     if test_mode:
         from test_eval import run_test_assertions
-        run_test_assertions(detailed_metrics, total_tp, total_fp, total_fn, overall_precision, overall_recall, overall_f1)
+        run_test_assertions(detailed_metrics, overall_metrics['tp'], overall_metrics['fp'], overall_metrics['fn'],
+                            overall_metrics['precision'], overall_metrics['recall'], overall_metrics['f1'],
+                            partial_credit=partial_credit)
     
     return detailed_metrics, final_metrics_df
 
 
+def _spool_issues(issues_df, spool_dir, spool_paths):
+    """Append issues to one spool file per (tag, issue_type) so they can be written out grouped at the end."""
+    for (tag, issue_type), group in issues_df.groupby(['tag', 'issue_type'], sort=False):
+        path = spool_paths.get((tag, issue_type))
+        if path is None:
+            path = os.path.join(spool_dir, f'{len(spool_paths)}.csv')
+            spool_paths[(tag, issue_type)] = path
+            group.to_csv(path, index=False)
+        else:
+            group.to_csv(path, mode='a', header=False, index=False)
+
+
+def _save_spooled_issues(spool_paths, uid, chunksize):
+    """Concatenate the spool files into issues_{uid}.csv and issues_{uid}.txt, grouped by tag and issue type."""
+    pred_dir = RESULTS_DIR
+    issues_csv = os.path.join(pred_dir, f'issues_{uid}.csv')
+    issues_txt = os.path.join(pred_dir, f'issues_{uid}.txt')
+
+    # CSV: same order of groups as the sorted in-memory issues table
+    with open(issues_csv, 'w') as out:
+        for i, key in enumerate(sorted(spool_paths)):
+            with open(spool_paths[key], 'r') as spool:
+                header = spool.readline()
+                if i == 0:
+                    out.write(header)
+                shutil.copyfileobj(spool, out)
+
+    # Text report: read the spooled values back as raw strings
+    with open(issues_txt, 'w') as f:
+        for tag in sorted({tag for tag, _ in spool_paths}):
+            f.write(f"{tag.upper()}\n")
+            f.write("=" * 80 + "\n\n")
+            for issue_type, title, empty_marker in ISSUE_SECTIONS:
+                if (tag, issue_type) not in spool_paths:
+                    continue
+                f.write(f"{title}:\n\n")
+                for type_issues in pd.read_csv(spool_paths[(tag, issue_type)], dtype=str, keep_default_na=False,
+                                               chunksize=chunksize):
+                    f.write(format_issue_lines(type_issues, empty_marker))
+                f.write("\n")
+            f.write("\n")
+
+    print(f"Detailed issues saved to {pred_dir}/issues_{uid}.txt (and {pred_dir}/issues_{uid}.csv)")
+
+
+def _integers_to_float(merged_df):
+    # The outer merge turns every column with gaps into floats, so values are reported
+    # the same way whichever chunk they come from
+    for column in merged_df.columns:
+        if column != 'osmid' and pd.api.types.is_integer_dtype(merged_df[column]):
+            merged_df[column] = merged_df[column].astype(float)
+    return merged_df
+
+
+def _align_to_gt(pred_chunk, gt_index_df, scored_tags):
+    """
+    Build the merged (osmid, *_gt, *_pred) frame for a chunk of predictions.
+    Predictions whose osmid is not in the GT get empty GT values.
+    """
+    if gt_index_df.index.is_unique:
+        gt_part = gt_index_df.reindex(pred_chunk['osmid'].to_numpy()).reset_index(drop=True)
+        merged_df = pd.concat([pred_chunk[['osmid']].reset_index(drop=True),
+                               gt_part.add_suffix('_gt'),
+                               pred_chunk[scored_tags].reset_index(drop=True).add_suffix('_pred')], axis=1)
+    else:
+        merged_df = gt_index_df.reset_index().merge(pred_chunk[['osmid'] + scored_tags], on='osmid', how='right',
+                                                    suffixes=('_gt', '_pred'))
+    return _integers_to_float(merged_df)
+
+
+def _missing_from_pred(gt_part, scored_tags):
+    """Build the merged frame for GT rows whose osmid never appears in the predictions."""
+    gt_part = gt_part.reset_index()
+    pred_part = pd.DataFrame(np.nan, index=gt_part.index, columns=[osm_tag + '_pred' for osm_tag in scored_tags])
+    return _integers_to_float(pd.concat([gt_part[['osmid']], gt_part[scored_tags].add_suffix('_gt'), pred_part],
+                                        axis=1))
+
+
+def eval_map_feature_pred_streaming(pred_df_path, uid=None, gt_df_path=None, chunksize=100000,
+                                    abbreviations_path=None, gt_df=None, partial_credit=False):
+    """
+    Evaluate a predictions file that is too large to load at once.
+
+    Predictions are read in chunks of `chunksize` rows and joined by osmid against a GT
+    frame indexed by osmid. Per-tag TP/FP/FN counters are updated chunk by chunk and
+    issues are spooled to disk as they are found. GT osmids that never appear in the
+    predictions are counted as FN at the end. Memory is bounded by the chunk size plus
+    the GT index, and the metrics are identical to the in-memory path.
+
+    The issues files contain the same rows as the in-memory path, grouped by tag and
+    issue type, but in file order within a group rather than sorted by osmid.
+
+    Returns detailed_metrics, overall_metrics and final_metrics_df.
+    """
+    if gt_df is None:
+        gt_df = load_ground_truth(gt_df_path)
+    name_normalizer = get_name_normalizer(abbreviations_path)
+
+    pred_columns = pd.read_csv(pred_df_path, index_col=False, nrows=0).columns
+    osm_tags, scored_tags = get_osm_tags(pred_columns, gt_df.columns)
+
+    # Compact GT index: only the scored tags, keyed by osmid
+    gt_index_df = gt_df[['osmid'] + scored_tags].set_index('osmid')
+    gt_seen = np.zeros(len(gt_index_df), dtype=bool)
+    tag_occurrences = {osm_tag: gt_df[osm_tag].notna().sum() for osm_tag in scored_tags}
+    counts = {osm_tag: np.zeros(3, dtype=float if partial_credit else np.int64) for osm_tag in scored_tags}
+    spool_paths = {}
+
+    with tempfile.TemporaryDirectory(prefix='eval_issues_') as spool_dir:
+
+        def score_chunk(merged_df):
+            for osm_tag in scored_tags:
+                masks = get_pred_status_masks(merged_df[osm_tag + '_gt'], merged_df[osm_tag + '_pred'], osm_tag,
+                                              name_normalizer, partial_credit)
+                tag_counts = [masks['tp'].sum(), masks['fp'].sum(), masks['fn'].sum()]
+                if partial_credit:
+                    tag_counts = credited_counts(*tag_counts, masks['credit'].sum())
+                counts[osm_tag] += tag_counts
+                _spool_issues(get_tag_issues(merged_df, osm_tag, masks), spool_dir, spool_paths)
+
+        for pred_chunk in pd.read_csv(pred_df_path, index_col=False, chunksize=chunksize):
+            if gt_index_df.index.is_unique:
+                positions = gt_index_df.index.get_indexer(pred_chunk['osmid'])
+                gt_seen[positions[positions >= 0]] = True
+            else:
+                gt_seen |= gt_index_df.index.isin(pred_chunk['osmid'])
+            score_chunk(_align_to_gt(pred_chunk, gt_index_df, scored_tags))
+
+        # GT osmids missing from the predictions are false negatives for every tag with a GT value
+        unseen_positions = np.flatnonzero(~gt_seen)
+        for start in range(0, len(unseen_positions), chunksize):
+            score_chunk(_missing_from_pred(gt_index_df.iloc[unseen_positions[start:start + chunksize]], scored_tags))
+
+        tag_counts = {osm_tag: tuple(round(count.item(), 4) for count in counts[osm_tag]) for osm_tag in scored_tags}
+        detailed_metrics, overall_metrics, final_metrics_df = summarize_metrics(osm_tags, tag_counts,
+                                                                                tag_occurrences)
+
+        if uid is None:
+            uid = datetime.now().strftime('%Y%m%d%H%M%S')
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        if spool_paths:
+            _save_spooled_issues(spool_paths, uid, chunksize)
+        save_results(final_metrics_df, pd.DataFrame(), uid)
+
+    return detailed_metrics, overall_metrics, final_metrics_df
+
+
+def _eval_with_status(pred_df_path, uid, gt_df, abbreviations_path, previous_uid, save_status=True):
+    pred_df = pd.read_csv(pred_df_path, index_col=False)
+    name_normalizer = get_name_normalizer(abbreviations_path)
+    _, scored_tags = get_osm_tags(pred_df.columns, gt_df.columns)
+    pred_row_hashes = hash_prediction_rows(pred_df, scored_tags,
+                                           lambda osm_tag: get_tag_comparator(osm_tag, name_normalizer))
+    table_fingerprint = get_scoring_fingerprint(gt_df, name_normalizer)
+
+    previous_table = None
+    if previous_uid is not None:
+        previous_table = load_previous_status(previous_uid, pred_df, gt_df, table_fingerprint)
+    if previous_table is not None:
+        (detailed_metrics, overall_metrics, final_metrics_df, issues_df, merged_df, status,
+         rescored_rows) = compute_metrics_incremental(pred_df, gt_df, pred_row_hashes, previous_table, name_normalizer)
+        print(f"Re-scored {rescored_rows} of {len(merged_df)} rows changed since run '{previous_uid}'.")
+    else:
+        (detailed_metrics, overall_metrics, final_metrics_df, issues_df, merged_df,
+         status) = compute_metrics(pred_df, gt_df, name_normalizer, return_status=True)
+
+    uid = save_results(final_metrics_df, issues_df, uid)
+    if save_status:
+        counts = np.array([[detailed_metrics[osm_tag][key] for key in ['tp', 'fp', 'fn']] for osm_tag in scored_tags],
+                          dtype=np.int64).reshape(len(scored_tags), 3)
+        save_status_table(os.path.join(RESULTS_DIR, f'status_{uid}.npz'), merged_df['osmid'].to_numpy(), scored_tags,
+                          status, _merged_row_hashes(merged_df, pred_df, pred_row_hashes), counts, table_fingerprint,
+                          [str(pred_df[osm_tag].dtype) for osm_tag in scored_tags])
+    return detailed_metrics, overall_metrics, final_metrics_df, merged_df, status, uid
+
+
+def _save_table(df, name):
+    df.to_csv(os.path.join(RESULTS_DIR, f'{name}.csv'), index=False)
+    df.to_markdown(os.path.join(RESULTS_DIR, f'{name}.md'), index=False)
+    print(f"Saved {RESULTS_DIR}/{name}")
+
+
+def _align_status(osmids, status, osm_tags, all_osmids, all_tags):
+    # Rows and tags missing from a run are true negatives, which don't count in any metric
+    assert osmids.is_unique, "Paired comparisons need unique osmids"
+    aligned = np.zeros((len(all_osmids), len(all_tags)), dtype=np.int8)
+    rows = all_osmids.get_indexer(osmids)
+    columns = [all_tags.index(osm_tag) for osm_tag in osm_tags]
+    aligned[np.ix_(rows, columns)] = status
+    return aligned
+
+
+def compare_runs(osmids, status, osm_tags, compare_path, gt_df, abbreviations_path=None, n_resamples=10000,
+                 confidence=0.95, seed=0):
+    """
+    Paired bootstrap test of a scored run (osmids, status, osm_tags) against the predictions in
+    compare_path. Both runs are aligned by osmid; per-tag rows are only reported for tags
+    scored in both runs, while the overall row covers every tag of each run.
+    """
+    compare_df = pd.read_csv(compare_path, index_col=False)
+    compare_results = compute_metrics(compare_df, gt_df, get_name_normalizer(abbreviations_path), return_status=True)
+    compare_merged_df, compare_status = compare_results[-2:]
+    compare_tags = list(compare_results[0])
+
+    osmids = pd.Index(np.asarray(osmids))
+    compare_osmids = pd.Index(compare_merged_df['osmid'].to_numpy())
+    all_osmids = osmids.union(compare_osmids)
+    all_tags = sorted(set(osm_tags) | set(compare_tags))
+    significance_df = paired_bootstrap_test(_align_status(osmids, status, osm_tags, all_osmids, all_tags),
+                                            _align_status(compare_osmids, compare_status, compare_tags, all_osmids,
+                                                          all_tags),
+                                            all_tags, n_resamples, confidence, seed)
+    common_tags = set(osm_tags) & set(compare_tags)
+    return significance_df[significance_df['osm_tag'].isin(common_tags | {'overall'})].reset_index(drop=True)
+
+
+def summarize_calls(calls_df, overall_metrics, detailed_metrics):
+    """
+    Cost of a run next to its accuracy, in one row: the ways and LLM calls of calls_df
+    (osmid and calls columns, plus optional frames and keyframes photo counts), calls per
+    way, and the overall and per-tag F1. Rows of several runs can be concatenated to
+    compare cost against accuracy.
+    """
+    assert {'osmid', 'calls'} <= set(calls_df.columns), "The calls CSV needs osmid and calls columns"
+    ways = calls_df['osmid'].nunique()
+    summary = {'ways': ways, 'calls': int(calls_df['calls'].sum())}
+    summary['calls_per_way'] = round(summary['calls'] / ways, 4) if ways else 0
+    for column in ['frames', 'keyframes']:
+        if column in calls_df.columns:
+            summary[column] = int(calls_df[column].sum())
+    summary['f1'] = round(overall_metrics['f1'], 4)
+    for osm_tag, metrics in detailed_metrics.items():
+        summary[f'f1:{osm_tag}'] = round(metrics['f1'], 4)
+    return pd.DataFrame([summary])
+
+
+def get_run_uid(pred_df_path):
+    """Derive the run uid from a predictions file name, e.g. predictions_gpt_4o.csv -> gpt_4o."""
+    stem = os.path.splitext(os.path.basename(pred_df_path))[0]
+    return stem[len('predictions_'):] if stem.startswith('predictions_') else stem
+
+
+def expand_pred_paths(patterns):
+    """Expand a list of prediction file paths and/or glob patterns into a sorted list of unique paths."""
+    pred_paths = set()
+    for pattern in patterns:
+        matches = glob.glob(pattern)
+        assert matches, f"No prediction files match: {pattern}"
+        pred_paths.update(matches)
+    return sorted(pred_paths)
+
+
+# Ground truth and name normalizer shared by the batch evaluation workers
+_batch_gt_df = None
+_batch_name_normalizer = None
+_batch_partial_credit = False
+
+
+def _init_batch_worker(gt_df, abbreviations_path, partial_credit=False):
+    global _batch_gt_df, _batch_name_normalizer, _batch_partial_credit
+    _batch_gt_df = gt_df
+    _batch_name_normalizer = get_name_normalizer(abbreviations_path)
+    _batch_partial_credit = partial_credit
+
+
+def _eval_batch_file(pred_df_path, uid):
+    pred_df = pd.read_csv(pred_df_path, index_col=False)
+    detailed_metrics, overall_metrics, final_metrics_df, issues_df = compute_metrics(
+        pred_df, _batch_gt_df, _batch_name_normalizer, partial_credit=_batch_partial_credit)
+    save_results(final_metrics_df, issues_df, uid)
+    return uid, detailed_metrics, overall_metrics
+
+
+def build_leaderboard(run_metrics):
+    """
+    Combine the metrics of several runs into one table: overall tp/fp/fn/precision/recall/f1
+    followed by the F1 of every tag, one row per run, best overall F1 first.
+    run_metrics is a list of (uid, detailed_metrics, overall_metrics) tuples.
+    """
+    osm_tags = sorted({osm_tag for _, detailed_metrics, _ in run_metrics for osm_tag in detailed_metrics})
+    rows = []
+    for uid, detailed_metrics, overall_metrics in run_metrics:
+        row = {'uid': uid}
+        row.update({key: overall_metrics[key] for key in ['tp', 'fp', 'fn']})
+        row.update({key: round(overall_metrics[key], 4) for key in ['precision', 'recall', 'f1']})
+        for osm_tag in osm_tags:
+            row[f'{osm_tag} f1'] = round(detailed_metrics[osm_tag]['f1'], 4) if osm_tag in detailed_metrics else None
+        rows.append(row)
+    leaderboard_df = pd.DataFrame(rows)
+    return leaderboard_df.sort_values(['f1', 'uid'], ascending=[False, True]).reset_index(drop=True)
+
+
+def eval_map_feature_pred_batch(pred_df_paths, uid=None, gt_df_path=None, abbreviations_path=None, workers=None,
+                                partial_credit=False):
+    """
+    Evaluate many prediction files against the same ground truth, which is loaded once.
+    Files are scored in a process pool and each run writes the usual metrics_{run_uid} and
+    issues_{run_uid} files, where run_uid is derived from the file name (see get_run_uid).
+    A combined leaderboard is written to leaderboard_{uid}.csv/.md.
+
+    pred_df_paths can contain file paths and glob patterns.
+    """
+    pred_df_paths = expand_pred_paths(pred_df_paths)
+    run_uids = [get_run_uid(path) for path in pred_df_paths]
+    assert len(set(run_uids)) == len(run_uids), f"Prediction files must have distinct names, got {run_uids}"
+    gt_df = load_ground_truth(gt_df_path)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(pred_df_paths))
+    if workers <= 1:
+        _init_batch_worker(gt_df, abbreviations_path, partial_credit)
+        run_metrics = [_eval_batch_file(path, run_uid) for path, run_uid in zip(pred_df_paths, run_uids)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                                 initargs=(gt_df, abbreviations_path, partial_credit)) as executor:
+            run_metrics = list(executor.map(_eval_batch_file, pred_df_paths, run_uids))
+
+    leaderboard_df = build_leaderboard(run_metrics)
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    if uid is None:
+        uid = datetime.now().strftime('%Y%m%d%H%M%S')
+    leaderboard_df.to_csv(os.path.join(RESULTS_DIR, f'leaderboard_{uid}.csv'), index=False)
+    leaderboard_df.to_markdown(os.path.join(RESULTS_DIR, f'leaderboard_{uid}.md'), index=False)
+    print(f"Batch evaluation of {len(pred_df_paths)} files completed. Leaderboard saved to {RESULTS_DIR}/leaderboard_{uid}")
+    return leaderboard_df
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Evaluate map feature predictions.")
-    parser.add_argument("pred_df_path", type=str, help="Path to the predictions dataframe (csv file).")
-    parser.add_argument("uid", type=str, help="uid for the evaluation run (optional).", default=None, nargs='?')
+    parser.add_argument("pred_df_path", type=str, help="Path to the predictions dataframe (csv file). Not used with --batch.", default=None, nargs='?')
+    parser.add_argument("uid", type=str, help="uid for the evaluation run (optional). With --batch, uid of the leaderboard.", default=None, nargs='?')
     parser.add_argument("--gt-path", type=str, help="Path to ground truth CSV (optional, defaults to metadata/ground_truth.csv).", default=None)
     parser.add_argument("--test", action="store_true", help="Enable test mode with assertions (for test cases).")
+    parser.add_argument("--abbreviations", type=str, help="Path to a JSON street name abbreviation table (optional, defaults to US English).", default=None)
+    parser.add_argument("--batch", type=str, nargs='+', help="Prediction files or glob patterns to evaluate together against one ground truth.", default=None)
+    parser.add_argument("--save-status", action="store_true", help="Save a per-(osmid, tag) status table to status_{uid}.npz for incremental re-evaluation.")
+    parser.add_argument("--previous-uid", type=str, help="uid of a previous run with a status table: only re-score rows whose predictions changed.", default=None)
+    parser.add_argument("--bootstrap", type=int, help="Number of bootstrap resamples over osmids for confidence intervals (optional).", default=None)
+    parser.add_argument("--confidence", type=float, help="Confidence level of the bootstrap intervals (optional, defaults to 0.95).", default=0.95)
+    parser.add_argument("--compare", type=str, help="Predictions CSV to compare against with a paired bootstrap test (optional, needs --bootstrap).", default=None)
+    parser.add_argument("--seed", type=int, help="Random seed of the bootstrap (optional, defaults to 0).", default=0)
+    parser.add_argument("--calls", type=str, help="CSV of LLM calls per osmid, reported next to the F1 in calls_{uid} (optional).", default=None)
+    parser.add_argument("--partial-credit", action="store_true", help="Give mismatches partial credit where the tag supports it (share of matching lanes for turn:lanes).")
+    parser.add_argument("--chunksize", type=int, help="Stream the predictions file in chunks of this many rows (optional, for files larger than memory).", default=None)
+    parser.add_argument("--workers", type=int, help="Number of worker processes for --batch (optional, defaults to the CPU count).", default=None)
+    parser.add_argument("--geo-cell-size", type=float, help="Also compute metrics per grid cell of this size in meters, to geo_metrics_{uid} (optional).", default=None)
+    parser.add_argument("--geo-shape", choices=['hex', 'square'], help="Shape of the grid cells (optional, defaults to hex).", default='hex')
+    parser.add_argument("--geo-polygons", type=str, help="GeoJSON polygon layer to compute metrics per polygon instead of per grid cell (optional).", default=None)
+    parser.add_argument("--geo-id-field", type=str, help="Property of the polygons used as their id (optional, defaults to the feature id).", default=None)
+    parser.add_argument("--geo-ways", type=str, help="Way geometries, GeoJSON or CSV (optional, defaults to metadata/ground_truth.geojson).", default=None)
     args = parser.parse_args()
 
-    eval_map_feature_pred(args.pred_df_path, args.uid, args.gt_path, test_mode=args.test)
-    
\ No newline at end of file
+    if args.batch is not None:
+        uid = args.uid if args.uid is not None else args.pred_df_path
+        eval_map_feature_pred_batch(args.batch, uid, args.gt_path, abbreviations_path=args.abbreviations,
+                                    workers=args.workers, partial_credit=args.partial_credit)
+    else:
+        if args.pred_df_path is None:
+            parser.error("pred_df_path is required unless --batch is given")
+        geo_slicer = None
+        if args.geo_cell_size is not None or args.geo_polygons is not None:
+            geo_slicer = GeoSlicer(args.geo_ways, args.geo_cell_size, args.geo_shape, args.geo_polygons, args.geo_id_field)
+        eval_map_feature_pred(args.pred_df_path, args.uid, args.gt_path, test_mode=args.test,
+                              abbreviations_path=args.abbreviations, chunksize=args.chunksize,
+                              save_status=args.save_status, previous_uid=args.previous_uid,
+                              bootstrap=args.bootstrap, confidence=args.confidence, compare_path=args.compare,
+                              seed=args.seed, partial_credit=args.partial_credit, calls_path=args.calls,
+                              geo_slicer=geo_slicer)
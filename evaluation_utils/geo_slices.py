@@ -0,0 +1,237 @@
+"""
+Metrics of an evaluation run per area: cells of a grid, or polygons.
+
+Every way with a geometry (ground_truth.geojson, or a CSV with a geometry column such as
+ways.csv) is placed in one cell by the midpoint of its line. The cells are those of a
+hexagonal or square grid (cell_size in meters between neighboring cell centers, in a
+local equirectangular projection as in demo_utils/spatial_index.py) or the polygons of a
+GeoJSON layer (districts, neighborhoods, ...).
+
+The per-(osmid, tag) status matrix of eval.py is reduced to TP/FP/FN per (cell, tag)
+with a single bincount over (cell, tag, status code) keys, and precision, recall and F1 are
+computed for all cells at once, per tag and overall. Rows of osmids without a geometry
+(e.g. predictions of ways missing from the ground truth) count in the global metrics
+only.
+
+Cells with at least one evaluated way are written as a GeoJSON FeatureCollection with
+the counts and metrics in its properties (tp, fp, fn, precision, recall, f1 overall and
+"{tag} tp", ..., "{tag} f1" per tag), which the notebook maps as it is, and as a long
+CSV with one row per (cell, tag).
+
+Usage (through eval.py):
+    python eval.py path/to/predictions.csv [uid] --geo-cell-size 500 [--geo-shape square]
+    python eval.py path/to/predictions.csv [uid] --geo-polygons path/to/districts.geojson [--geo-id-field name]
+"""
+import os
+import json
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely import STRtree
+
+from bootstrap import precision_recall_f1
+from metadata_cache import load_metadata
+from status_cache import STATUS_FN, STATUS_FP, STATUS_MISMATCH, STATUS_TP
+
+# Meters per degree of latitude (and of longitude at the equator)
+METERS_PER_DEGREE = 111320
+
+SHAPES = ['hex', 'square']
+
+DEFAULT_WAYS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'metadata',
+                                 'ground_truth.geojson')
+
+COUNT_COLUMNS = ['tp', 'fp', 'fn', 'precision', 'recall', 'f1']
+
+
+def _read_features(path):
+    with open(path) as f:
+        features = json.load(f)['features']
+    geometries = shapely.from_geojson([json.dumps(feature['geometry']) for feature in features])
+    return features, geometries
+
+
+def load_way_geometries(path):
+    """osmids and shapely geometries of the ways of a GeoJSON, or of a CSV with osmid and geometry columns."""
+    if path.endswith('.geojson') or path.endswith('.json'):
+        features, geometries = _read_features(path)
+        osmids = np.array([feature['properties']['osmid'] for feature in features], dtype=np.int64)
+        return osmids, geometries
+    ways_df = load_metadata(path)
+    return ways_df['osmid'].to_numpy(dtype=np.int64), ways_df['geometry'].to_numpy(dtype=object)
+
+
+def representative_points(geometries):
+    """(n, 2) longitudes and latitudes of the midpoints of lines, and of a point on other geometries."""
+    points = shapely.point_on_surface(geometries)
+    # LineString, LinearRing and MultiLineString
+    lines = np.isin(shapely.get_type_id(geometries), [1, 2, 5])
+    points[lines] = shapely.line_interpolate_point(geometries[lines], 0.5, normalized=True)
+    return shapely.get_coordinates(points)
+
+
+def _cube_round(q, r):
+    # Nearest hexagon of fractional axial coordinates
+    s = -q - r
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq = np.where(fix_q, -rr - rs, rq)
+    rr = np.where(fix_r, -rq - rs, rr)
+    return rq.astype(np.int64), rr.astype(np.int64)
+
+
+def grid_cells(points, cell_size, shape='hex'):
+    """
+    Cells of a hexagonal (pointy-top) or square grid holding points (lon/lat), with
+    cell_size meters between the centers of neighboring cells.
+
+    Returns:
+        cell of every point (row of cells_df)
+        cells_df: cell id ('hex_{q}_{r}' or 'square_{i}_{j}') and polygon (lon/lat) of every occupied cell
+    """
+    assert shape in SHAPES, f"Unknown cell shape {shape}, expected one of {SHAPES}"
+    assert cell_size > 0, "Cell size must be positive"
+    latitude = np.mean(points[:, 1]) if len(points) else 0.0
+    scale = np.array([METERS_PER_DEGREE * np.cos(np.radians(latitude)), METERS_PER_DEGREE])
+    x, y = (points * scale).T
+    if shape == 'hex':
+        radius = cell_size / np.sqrt(3)
+        keys = np.stack(_cube_round((np.sqrt(3) / 3 * x - y / 3) / radius, (2 / 3 * y) / radius), axis=1)
+    else:
+        keys = np.floor(np.stack([x, y], axis=1) / cell_size).astype(np.int64)
+    keys, cells = np.unique(keys.reshape(-1, 2), axis=0, return_inverse=True)
+    a, b = keys.T
+    if shape == 'hex':
+        centers = np.stack([radius * np.sqrt(3) * (a + b / 2), radius * 1.5 * b], axis=1)
+        angles = np.radians(30 + 60 * np.arange(6))
+        offsets = radius * np.stack([np.cos(angles), np.sin(angles)], axis=1)
+    else:
+        centers = (keys + 0.5) * cell_size
+        offsets = cell_size / 2 * np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]])
+    rings = (centers[:, None, :] + offsets[None, :, :]) / scale
+    cells_df = pd.DataFrame({'cell': [f'{shape}_{i}_{j}' for i, j in zip(a.tolist(), b.tolist())],
+                             'geometry': shapely.polygons(rings)})
+    return cells.ravel(), cells_df
+
+
+def polygon_cells(points, polygons_path, id_field=None):
+    """
+    Polygon of a GeoJSON layer holding every point (lon/lat), -1 if none (the first one
+    in the layer if they overlap). Polygons are identified by their id_field property,
+    else by their feature id, else by their position in the layer.
+
+    Returns the cell of every point and cells_df (cell id and polygon of every feature).
+    """
+    features, polygons = _read_features(polygons_path)
+    if id_field is not None:
+        ids = [feature['properties'][id_field] for feature in features]
+    else:
+        ids = [feature.get('id', i) for i, feature in enumerate(features)]
+    point_rows, polygon_rows = STRtree(polygons).query(shapely.points(points), predicate='within')
+    cells = np.full(len(points), -1, dtype=np.int64)
+    # Written from the last match to the first, so the first polygon of the layer wins
+    order = np.lexsort((polygon_rows, point_rows))[::-1]
+    cells[point_rows[order]] = polygon_rows[order]
+    return cells, pd.DataFrame({'cell': ids, 'geometry': polygons})
+
+
+class GeoSlicer:
+    """
+    Cells of the ways of the ground truth, to compute metrics per cell.
+
+    Args:
+        ways_path: way geometries, GeoJSON or CSV (defaults to metadata/ground_truth.geojson)
+        cell_size: meters between neighboring cells of a grid
+        shape: 'hex' or 'square' grid
+        polygons_path: GeoJSON layer of polygons, instead of a grid
+        id_field: property of the polygons used as cell id
+    """
+
+    def __init__(self, ways_path=None, cell_size=None, shape='hex', polygons_path=None, id_field=None):
+        assert (cell_size is None) != (polygons_path is None), "Either a cell size or a polygon layer is needed"
+        osmids, geometries = load_way_geometries(ways_path or DEFAULT_WAYS_PATH)
+        located = ~shapely.is_missing(geometries) & ~shapely.is_empty(geometries)
+        points = representative_points(geometries[located])
+        if polygons_path is not None:
+            cells, self.cells_df = polygon_cells(points, polygons_path, id_field)
+        else:
+            cells, self.cells_df = grid_cells(points, cell_size, shape)
+        way_index = pd.Index(osmids[located])
+        first = ~way_index.duplicated()
+        self.way_index = way_index[first]
+        self.way_cells = cells[first]
+
+    def cells_of(self, osmids):
+        """Cell (row of cells_df) of every osmid, -1 for osmids without a geometry or outside the cells."""
+        positions = self.way_index.get_indexer(np.asarray(osmids))
+        cells = np.full(len(positions), -1, dtype=np.int64)
+        cells[positions >= 0] = self.way_cells[positions[positions >= 0]]
+        return cells
+
+    def cell_metrics(self, osmids, status, osm_tags):
+        """
+        Metrics of the cells holding at least one row of an evaluation run (osmids of the
+        rows of its status matrix, osm_tags of its columns).
+
+        Returns a dataframe with one row per cell and tag, plus an 'overall' row per cell:
+        cell, osm_tag, ways, tp, fp, fn, precision, recall, f1.
+        """
+        cells = self.cells_of(osmids)
+        located = cells >= 0
+        cells = cells[located]
+        n_cells, n_tags, n_codes = len(self.cells_df), len(osm_tags), STATUS_MISMATCH + 1
+        keys = (cells[:, None] * n_tags + np.arange(n_tags)) * n_codes + np.asarray(status)[located]
+        codes = np.bincount(keys.ravel(), minlength=n_cells * n_tags * n_codes).reshape(n_cells, n_tags, n_codes)
+        # Mismatches count as FP and FN
+        counts = np.stack([codes[..., STATUS_TP], codes[..., STATUS_FP] + codes[..., STATUS_MISMATCH],
+                           codes[..., STATUS_FN] + codes[..., STATUS_MISMATCH]], axis=-1).astype(np.int64)
+        counts = np.concatenate([counts, counts.sum(axis=1, keepdims=True)], axis=1)
+        ways = np.bincount(cells, minlength=n_cells)
+
+        occupied = np.flatnonzero(ways)
+        counts = counts[occupied].reshape(-1, 3)
+        tags = list(osm_tags) + ['overall']
+        precision, recall, f1 = precision_recall_f1(*counts.T)
+        return pd.DataFrame({
+            'cell': self.cells_df['cell'].to_numpy(dtype=object)[np.repeat(occupied, len(tags))],
+            'osm_tag': np.tile(np.array(tags, dtype=object), len(occupied)),
+            'ways': np.repeat(ways[occupied], len(tags)),
+            'tp': counts[:, 0], 'fp': counts[:, 1], 'fn': counts[:, 2],
+            'precision': np.round(precision, 4), 'recall': np.round(recall, 4), 'f1': np.round(f1, 4),
+        })
+
+    def to_geojson(self, metrics_df):
+        """FeatureCollection of the cells of cell_metrics, with their metrics as properties."""
+        overall_df = metrics_df[metrics_df['osm_tag'] == 'overall'].set_index('cell')
+        wide_df = metrics_df[metrics_df['osm_tag'] != 'overall'].pivot(index='cell', columns='osm_tag',
+                                                                       values=COUNT_COLUMNS)
+        wide_df = wide_df[[(column, osm_tag) for osm_tag in sorted(wide_df.columns.levels[1])
+                           for column in COUNT_COLUMNS]]
+        wide_df.columns = [f'{osm_tag} {column}' for column, osm_tag in wide_df.columns]
+        # The pivot turns the counts into floats, next to the metrics
+        wide_df = wide_df.astype({column: np.int64 for column in wide_df.columns
+                                  if column.rsplit(' ', 1)[1] in COUNT_COLUMNS[:3]})
+        properties_df = overall_df[['ways'] + COUNT_COLUMNS].join(wide_df)
+        geometries = self.cells_df.set_index('cell')['geometry'].loc[properties_df.index]
+        features = []
+        for cell, properties, geometry in zip(properties_df.index, properties_df.to_dict('records'),
+                                              shapely.to_geojson(geometries.to_numpy())):
+            features.append({'type': 'Feature', 'properties': {'cell': cell, **properties},
+                             'geometry': json.loads(geometry)})
+        return {'type': 'FeatureCollection', 'features': features}
+
+
+def save_geo_metrics(geo_slicer, osmids, status, osm_tags, results_dir, uid):
+    """Write geo_metrics_{uid}.geojson and geo_metrics_{uid}.csv (one row per cell and tag). Returns the metrics."""
+    metrics_df = geo_slicer.cell_metrics(osmids, status, osm_tags)
+    os.makedirs(results_dir, exist_ok=True)
+    metrics_df.to_csv(os.path.join(results_dir, f'geo_metrics_{uid}.csv'), index=False)
+    with open(os.path.join(results_dir, f'geo_metrics_{uid}.geojson'), 'w') as f:
+        json.dump(geo_slicer.to_geojson(metrics_df), f, default=lambda value: value.item())
+    located = (geo_slicer.cells_of(osmids) >= 0).sum()
+    print(f"Metrics of {metrics_df['cell'].nunique()} cells ({located} of {len(osmids)} rows located) saved to "
+          f"{results_dir}/geo_metrics_{uid}.geojson (and .csv)")
+    return metrics_df
@@ -0,0 +1,341 @@
+"""
+Columnar cache of the metadata CSVs (ways.csv, photos.csv, ground_truth.csv, ...).
+
+Reading ways.csv means parsing a WKT geometry and a dict of sequences on every row, which
+the notebooks did with shapely.wkt.loads and eval, row by row. load_metadata() parses a
+CSV once, with vectorized shapely (from_wkt) and one JSON parse of the whole sequences
+column, and saves the parsed columns in a NumPy archive under .metadata_cache next to
+the CSV:
+    geometry   coordinates of all Points or LineStrings, with the row of every coordinate
+               (WKB with offsets for other or missing geometries)
+    sequences  flattened: row, sequence_id and offsets into the sequence indexes of every sequence
+    strings    dictionary encoded: a code per row (-1 if missing) and the UTF-8 text of the distinct values
+    others     one array per column (numbers, booleans)
+Files with other columns (e.g. a boolean column with blanks, read as objects) are not cached.
+Later loads rebuild the dataframe from the arrays, the geometries with shapely.points /
+shapely.linestrings in one call, with the dtypes pd.read_csv gives.
+
+The cache holds the size and modification time of the CSV. When they changed, the
+sha256 of the CSV decides: the cache is kept if the content is the same (e.g. after a
+checkout), and rebuilt otherwise. CACHE_VERSION invalidates the caches of older formats.
+
+Usage:
+    from metadata_cache import load_metadata
+    ways_df = load_metadata('../metadata/ways.csv')  # geometry: shapely, sequences: {sequence_id: [index, ...]}
+
+    python metadata_cache.py ../metadata/ways.csv ../metadata/photos.csv  # build the caches, time the loads
+"""
+import os
+import re
+import ast
+import json
+import time
+import hashlib
+import argparse
+import tempfile
+import warnings
+
+import numpy as np
+import pandas as pd
+import shapely
+
+CACHE_VERSION = 1
+CACHE_DIR_NAME = '.metadata_cache'
+
+GEOMETRY_COLUMN = 'geometry'
+SEQUENCES_COLUMN = 'sequences'
+
+# Integer keys of the Python dicts in the sequences column, quoted to read them as JSON
+_DICT_KEY_PATTERN = re.compile(r'(-?\d+)\s*:')
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _source_stat(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def cache_path(path, cache_dir=None):
+    """Archive of the cache of a CSV, in cache_dir or in .metadata_cache next to the CSV."""
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_DIR_NAME)
+    return os.path.join(cache_dir, os.path.basename(path) + '.npz')
+
+
+def parse_sequences(values):
+    """
+    {sequence_id: [sequence_index, ...]} dicts of the sequences column (NaN stays NaN).
+    The column is read as one JSON array; rows that aren't JSON once their keys are quoted
+    fall back to ast.literal_eval.
+    """
+    values = list(values)
+    present = [i for i, value in enumerate(values) if isinstance(value, str)]
+    texts = [values[i] for i in present]
+    try:
+        parsed = json.loads('[' + _DICT_KEY_PATTERN.sub(r'"\1":', ','.join(texts)) + ']')
+    except ValueError:
+        parsed = [ast.literal_eval(text) for text in texts]
+    for i, sequences in zip(present, parsed):
+        values[i] = {int(sequence_id): list(indexes) for sequence_id, indexes in sequences.items()}
+    return values
+
+
+def parse_metadata(df):
+    """Parse the WKT geometry and sequences columns of a metadata dataframe, in place."""
+    if GEOMETRY_COLUMN in df.columns and df[GEOMETRY_COLUMN].map(lambda value: isinstance(value, str)).any():
+        wkt = df[GEOMETRY_COLUMN].to_numpy(dtype=object, na_value=None)
+        df[GEOMETRY_COLUMN] = pd.Series(shapely.from_wkt(wkt), index=df.index, dtype=object)
+    if SEQUENCES_COLUMN in df.columns and df[SEQUENCES_COLUMN].map(lambda value: isinstance(value, str)).any():
+        df[SEQUENCES_COLUMN] = pd.Series(parse_sequences(df[SEQUENCES_COLUMN]), index=df.index, dtype=object)
+    return df
+
+
+def _column_encoding(column, values):
+    # Encoding of a column in the cache: geometry, sequences, array or strings
+    if column == GEOMETRY_COLUMN and values.dtype == object and not values.map(
+            lambda value: isinstance(value, str)).any():
+        return 'geometry'
+    if column == SEQUENCES_COLUMN and values.map(lambda value: isinstance(value, dict)).any():
+        return 'sequences'
+    if values.dtype.kind in 'biufcmM':
+        return 'array'
+    return 'strings'
+
+
+def _strings_error(values):
+    # Why a column can't be dictionary encoded as strings, None if it can
+    uniques = pd.unique(values.dropna())
+    if not all(isinstance(value, str) for value in uniques):
+        return f"Column {values.name} has values other than strings"
+    if any('\x00' in value for value in uniques):
+        return f"Column {values.name} has values with NUL characters"
+    return None
+
+
+def uncacheable_column(df):
+    """
+    Reason why a parsed metadata dataframe can't be cached, e.g. a boolean column with
+    blanks (read as objects), None if it can be.
+    """
+    for column in df.columns:
+        if _column_encoding(column, df[column]) == 'strings':
+            error = _strings_error(df[column])
+            if error is not None:
+                return error
+    return None
+
+
+def _encode_strings(values):
+    """Dictionary encoding of a string column: codes (-1 for missing) and the UTF-8 text of the distinct values."""
+    error = _strings_error(values)
+    if error is not None:
+        raise ValueError(error)
+    codes, uniques = pd.factorize(values)
+    uniques = uniques.tolist()
+    text = '\x00'.join(uniques)
+    return codes.astype(np.int32), np.frombuffer(text.encode('utf-8'), dtype=np.uint8), len(uniques)
+
+
+def _decode_strings(codes, text, n_uniques):
+    if not n_uniques:
+        return np.full(len(codes), np.nan, dtype=object)
+    values = np.array(text.tobytes().decode('utf-8').split('\x00'), dtype=object)[codes]
+    values[codes < 0] = np.nan
+    return values
+
+
+def _encode_bytes(values):
+    lengths = np.array([len(value) for value in values], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    return np.frombuffer(b''.join(values), dtype=np.uint8), offsets
+
+
+def _decode_bytes(buffer, offsets):
+    data = buffer.tobytes()
+    return [data[start:end] for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+
+def _encode_geometry(geometries, arrays):
+    """Store geometries in arrays, as coordinates if they are all non-empty Points or all LineStrings."""
+    type_ids = shapely.get_type_id(geometries)
+    include_z = bool(shapely.has_z(geometries).any())
+    if len(geometries) and (type_ids == type_ids[0]).all() and type_ids[0] in (0, 1) and \
+            not shapely.is_empty(geometries).any():
+        coordinates, rows = shapely.get_coordinates(geometries, include_z=include_z, return_index=True)
+        arrays['geometry_coordinates'] = coordinates
+        arrays['geometry_rows'] = rows.astype(np.int64)
+        return 'points' if type_ids[0] == 0 else 'linestrings'
+    missing = shapely.is_missing(geometries)
+    wkb = shapely.to_wkb(geometries, output_dimension=3 if include_z else 2)
+    arrays['geometry_missing'] = missing
+    arrays['geometry_wkb'], arrays['geometry_offsets'] = _encode_bytes([b'' if value is None else value
+                                                                        for value in wkb])
+    return 'wkb'
+
+
+def _decode_geometry(encoding, archive):
+    if encoding == 'points':
+        return shapely.points(archive['geometry_coordinates'])
+    if encoding == 'linestrings':
+        return shapely.linestrings(archive['geometry_coordinates'], indices=archive['geometry_rows'])
+    wkb = np.array(_decode_bytes(archive['geometry_wkb'], archive['geometry_offsets']), dtype=object)
+    wkb[archive['geometry_missing']] = None
+    return shapely.from_wkb(wkb)
+
+
+def _encode_sequences(values, arrays):
+    missing = np.array([not isinstance(value, dict) for value in values])
+    rows, sequence_ids, lengths, indexes = [], [], [], []
+    for row, sequences in enumerate(values):
+        if missing[row]:
+            continue
+        for sequence_id, sequence_indexes in sequences.items():
+            rows.append(row)
+            sequence_ids.append(sequence_id)
+            lengths.append(len(sequence_indexes))
+            indexes.extend(sequence_indexes)
+    arrays['sequences_missing'] = missing
+    arrays['sequences_rows'] = np.array(rows, dtype=np.int64)
+    arrays['sequences_ids'] = np.array(sequence_ids, dtype=np.int64)
+    arrays['sequences_offsets'] = np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)])
+    arrays['sequences_indexes'] = np.array(indexes, dtype=np.int64)
+
+
+def _decode_sequences(archive):
+    missing = archive['sequences_missing']
+    values = [np.nan if is_missing else {} for is_missing in missing.tolist()]
+    indexes = archive['sequences_indexes'].tolist()
+    offsets = archive['sequences_offsets'].tolist()
+    for row, sequence_id, start, end in zip(archive['sequences_rows'].tolist(), archive['sequences_ids'].tolist(),
+                                            offsets[:-1], offsets[1:]):
+        values[row][sequence_id] = indexes[start:end]
+    return values
+
+
+def save_cache(path, df, source):
+    """
+    Save a parsed metadata dataframe as the cache of its CSV, with the size, mtime and
+    sha256 of the CSV. Raises ValueError for columns that can't be cached.
+    """
+    arrays = {}
+    columns = []
+    for i, column in enumerate(df.columns):
+        values = df[column]
+        encoding = _column_encoding(column, values)
+        if encoding == 'geometry':
+            encoding = _encode_geometry(values.to_numpy(dtype=object), arrays)
+        elif encoding == 'sequences':
+            _encode_sequences(values.tolist(), arrays)
+        elif encoding == 'array':
+            arrays[f'column_{i}'] = values.to_numpy()
+        else:
+            arrays[f'column_{i}'], arrays[f'column_{i}_text'], uniques = _encode_strings(values)
+        columns.append({'name': column, 'dtype': str(values.dtype), 'encoding': encoding})
+        if encoding == 'strings':
+            columns[-1]['uniques'] = uniques
+    meta = {'version': CACHE_VERSION, 'source': source, 'rows': len(df), 'columns': columns}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Written to a file of its own next to the cache and renamed, so readers never see a
+    # partial archive and processes writing the same cache don't mix their writes
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix=os.path.basename(path), suffix='.tmp',
+                                     delete=False) as f:
+        try:
+            np.savez(f, meta=np.asarray(json.dumps(meta)), **arrays)
+        except BaseException:
+            f.close()
+            os.remove(f.name)
+            raise
+    os.replace(f.name, path)
+
+
+def read_cache_meta(path):
+    """Metadata of a cache archive (version, source size/mtime/sha256, columns), None if it can't be read."""
+    try:
+        with np.load(path, allow_pickle=False) as archive:
+            return json.loads(str(archive['meta']))
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def load_cache(path):
+    """Dataframe of a cache archive."""
+    with np.load(path, allow_pickle=False) as archive:
+        meta = json.loads(str(archive['meta']))
+        data = {}
+        for i, column in enumerate(meta['columns']):
+            encoding = column['encoding']
+            if encoding in ('points', 'linestrings', 'wkb'):
+                data[column['name']] = pd.Series(_decode_geometry(encoding, archive), dtype=object)
+            elif encoding == 'sequences':
+                data[column['name']] = pd.Series(_decode_sequences(archive), dtype=object)
+            elif encoding == 'array':
+                data[column['name']] = pd.Series(archive[f'column_{i}'], dtype=column['dtype'])
+            else:
+                values = _decode_strings(archive[f'column_{i}'], archive[f'column_{i}_text'], column['uniques'])
+                data[column['name']] = pd.Series(values, dtype=object).astype(column['dtype'])
+    return pd.DataFrame(data, index=pd.RangeIndex(meta['rows']))
+
+
+def load_metadata(path, cache_dir=None, use_cache=True):
+    """
+    Dataframe of a metadata CSV, as pd.read_csv reads it, with shapely geometries in
+    the geometry column and {sequence_id: [sequence_index, ...]} dicts in the sequences
+    column. The parsed columns are cached in cache_dir (.metadata_cache next to the CSV
+    by default); a cache that can't be written is skipped.
+    """
+    if not use_cache:
+        return parse_metadata(pd.read_csv(path, index_col=False))
+    archive_path = cache_path(path, cache_dir)
+    stat = _source_stat(path)
+    meta = read_cache_meta(archive_path) if os.path.exists(archive_path) else None
+    sha256 = None
+    if meta is not None and meta['version'] == CACHE_VERSION:
+        source = meta['source']
+        if source['size'] == stat['size'] and source['mtime_ns'] == stat['mtime_ns']:
+            return load_cache(archive_path)
+        sha256 = file_sha256(path)
+        if sha256 == source['sha256']:
+            # Same content with a new mtime: keep the cache, with the new mtime
+            df = load_cache(archive_path)
+            _try_save_cache(archive_path, df, {**stat, 'sha256': sha256})
+            return df
+    df = parse_metadata(pd.read_csv(path, index_col=False))
+    _try_save_cache(archive_path, df, {**stat, 'sha256': sha256 or file_sha256(path)})
+    return df
+
+
+def _try_save_cache(path, df, source):
+    # The parsed dataframe is returned whether or not it could be cached. Files with columns
+    # that can't be cached are parsed on every load; a cache that can't be written is skipped
+    if uncacheable_column(df) is not None:
+        return
+    try:
+        save_cache(path, df, source)
+    except OSError as e:
+        # Including PermissionError, e.g. a read-only metadata directory
+        warnings.warn(f"Metadata cache {path} not written: {e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the columnar caches of metadata CSVs and time their loads.")
+    parser.add_argument("paths", type=str, nargs='+', help="Metadata CSVs (e.g. ../metadata/ways.csv).")
+    parser.add_argument("--cache-dir", type=str, help="Cache directory (defaults to .metadata_cache next to each CSV).",
+                        default=None)
+    args = parser.parse_args()
+
+    for path in args.paths:
+        start = time.perf_counter()
+        df = load_metadata(path, use_cache=False)
+        parse_seconds = time.perf_counter() - start
+        load_metadata(path, args.cache_dir)
+        start = time.perf_counter()
+        load_metadata(path, args.cache_dir)
+        cached_seconds = time.perf_counter() - start
+        print(f"{path}: {len(df)} rows, parsed in {parse_seconds:.3f}s, loaded from the cache in {cached_seconds:.3f}s")
@@ -0,0 +1,111 @@
+"""
+Per-(osmid, tag) status tables for incremental re-evaluation.
+
+A status table stores, for every row of the GT/prediction outer merge, the status of each
+scored tag as a small integer code, a hash of the prediction values of the row as the
+comparators read them, and the aggregate TP/FP/FN counts. It is saved as a compressed NumPy archive next to the metrics of
+a run, and a later run only re-scores the rows whose predictions changed.
+"""
+import hashlib
+import json
+
+import numpy as np
+import pandas as pd
+
+# Status codes of a (row, tag) pair
+STATUS_TN = 0
+STATUS_TP = 1
+STATUS_FP = 2  # prediction without ground truth
+STATUS_FN = 3  # ground truth without prediction
+STATUS_MISMATCH = 4  # both exist but don't match (counts as FP and FN)
+
+# Row hash of merged rows without a prediction (osmid only in the ground truth)
+NO_PREDICTION_HASH = np.uint64(0)
+
+
+def status_codes(masks):
+    """Encode the tp/fp/fn/mismatch masks of one tag as an int8 array of status codes."""
+    codes = np.full(len(masks['tp']), STATUS_TN, dtype=np.int8)
+    codes[masks['tp']] = STATUS_TP
+    codes[masks['fp'] & ~masks['mismatch']] = STATUS_FP
+    codes[masks['fn'] & ~masks['mismatch']] = STATUS_FN
+    codes[masks['mismatch']] = STATUS_MISMATCH
+    return codes
+
+
+def status_masks(codes):
+    """Decode an array of status codes back into tp/fp/fn/mismatch masks."""
+    mismatch = codes == STATUS_MISMATCH
+    return {
+        'tp': codes == STATUS_TP,
+        'fp': (codes == STATUS_FP) | mismatch,
+        'fn': (codes == STATUS_FN) | mismatch,
+        'mismatch': mismatch,
+    }
+
+
+def status_counts(status):
+    """TP/FP/FN counts per tag (columns) of a status matrix, as an (n_tags, 3) int64 array."""
+    tp = (status == STATUS_TP).sum(axis=0)
+    mismatch = (status == STATUS_MISMATCH).sum(axis=0)
+    fp = (status == STATUS_FP).sum(axis=0) + mismatch
+    fn = (status == STATUS_FN).sum(axis=0) + mismatch
+    return np.stack([tp, fp, fn], axis=1).astype(np.int64)
+
+
+def hash_prediction_rows(pred_df, osm_tags, get_comparator):
+    """
+    Hash the values of the given tag columns of every row of a predictions dataframe, as
+    the comparator of each tag (get_comparator(osm_tag)) reads them: values parsed alike,
+    such as lanes "2" and "2.0", hash alike, so re-saving an unchanged file keeps the
+    hashes of its rows.
+    """
+    canonical_df = pd.DataFrame(index=pred_df.index)
+    for osm_tag in osm_tags:
+        values = pred_df[osm_tag]
+        present = values.notna().to_numpy()
+        # Missing values hash as '', present ones with a prefix so that they never do
+        canonical = np.full(len(values), '', dtype=object)
+        if present.any():
+            canonical[present] = '+' + get_comparator(osm_tag).canonical(values[present]).astype(object)
+        canonical_df[osm_tag] = canonical
+    row_hashes = pd.util.hash_pandas_object(canonical_df, index=False).to_numpy().copy()
+    # Keep the sentinel for rows without a prediction
+    row_hashes[row_hashes == NO_PREDICTION_HASH] = np.uint64(1)
+    return row_hashes
+
+
+def fingerprint(*parts):
+    """
+    Stable hash of the inputs a status table depends on. Parts can be dataframes
+    (hashed by content, column names and dtypes) or JSON-serializable objects.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, pd.DataFrame):
+            digest.update(json.dumps([[str(column), str(dtype)] for column, dtype in part.dtypes.items()]).encode())
+            digest.update(pd.util.hash_pandas_object(part, index=False).to_numpy().tobytes())
+        else:
+            digest.update(json.dumps(part, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def save_status_table(path, osmids, osm_tags, status, row_hashes, counts, table_fingerprint, pred_dtypes):
+    np.savez_compressed(path,
+                        osmid=np.asarray(osmids, dtype=np.int64),
+                        osm_tags=np.asarray(osm_tags, dtype=str),
+                        status=status.astype(np.int8),
+                        row_hash=row_hashes.astype(np.uint64),
+                        counts=counts.astype(np.int64),
+                        fingerprint=np.asarray(table_fingerprint),
+                        pred_dtypes=np.asarray(pred_dtypes, dtype=str))
+
+
+def load_status_table(path):
+    """Load a status table saved by save_status_table as a dict of arrays (plain lists for tags and dtypes)."""
+    with np.load(path, allow_pickle=False) as archive:
+        table = {key: archive[key] for key in archive.files}
+    table['osm_tags'] = table['osm_tags'].tolist()
+    table['pred_dtypes'] = table['pred_dtypes'].tolist()
+    table['fingerprint'] = str(table['fingerprint'])
+    return table
@@ -2,12 +2,20 @@
 Test assertions for evaluation script.
 This module contains test validation functions for the comprehensive test cases.
 """
+import os
 
+import pandas as pd
 
-def run_test_assertions(detailed_metrics, total_tp, total_fp, total_fn, overall_precision, overall_recall, overall_f1):
+TEST_PREDICTIONS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'metadata',
+                                     'test_predictions_comprehensive.csv')
+
+
+def run_test_assertions(detailed_metrics, total_tp, total_fp, total_fn, overall_precision, overall_recall, overall_f1,
+                        partial_credit=False):
     """
     Run assertions to validate test case results.
     These assertions are based on the comprehensive test cases in test_ground_truth.csv and test_predictions_comprehensive.csv
+    With partial_credit, the turn:lanes mismatch (osmid 1019) is expected to earn its partial credit.
     """
     print("\n" + "="*60)
     print("Running test assertions...")
@@ -133,6 +141,53 @@ def run_test_assertions(detailed_metrics, total_tp, total_fp, total_fn, overall_
         assert total_classified > 0, "Should have classified samples (TNs filtered out)"
         print("  ✓ TN values correctly filtered out!")
     
+    # Test Case: Verify typed comparison of lanes
+    # osmid 1015: GT lanes="2", Pred lanes="2.0" → TP (numbers, not strings, are compared)
+    # Pred lanes of osmid 1013 is the text "1 lane", so the predicted column is read as strings
+    # and "2.0" only matches GT 2 through the numeric comparator
+    # Expected: 7 occurrences, 4 TP (1003, 1005, 1007, 1015), 1 FP (1013), 3 FN (1001, 1009, 1011)
+    print(f"\nTesting numeric comparison (osmid 1015: lanes '2' vs '2.0'):")
+    pred_lanes = pd.read_csv(TEST_PREDICTIONS_PATH, index_col=False)['lanes'].dropna().tolist()
+    assert '2.0' in pred_lanes, f"Pred lanes should be read as strings, so that '2.0' isn't 2 already, got {pred_lanes}"
+    if 'lanes' in detailed_metrics:
+        lanes_metrics = detailed_metrics['lanes']
+        assert lanes_metrics['occurrences'] == 7, f"Lanes occurrences should be 7, got {lanes_metrics['occurrences']}"
+        assert lanes_metrics['tp'] == 4, f"Lanes TP should be 4 ('2' matches '2.0'), got {lanes_metrics['tp']}"
+        assert lanes_metrics['fp'] == 1, f"Lanes FP should be 1 (extra osmid 1013), got {lanes_metrics['fp']}"
+        assert lanes_metrics['fn'] == 3, f"Lanes FN should be 3 (1001, 1009, 1011), got {lanes_metrics['fn']}"
+        print("  ✓ '2' and '2.0' lanes match!")
+
+    # Test Case: Verify speed units (speeds without a unit are read in mph, see eval.py)
+    # osmid 1016: GT maxspeed="25 mph", Pred maxspeed="25" → TP
+    # osmid 1017: GT maxspeed="50 km/h", Pred maxspeed="50" (50 mph) → mismatch, both FP and FN
+    print(f"\nTesting speed comparison (osmid 1016: '25 mph' vs '25', osmid 1017: '50 km/h' vs '50'):")
+    if 'maxspeed' in detailed_metrics:
+        speed_metrics = detailed_metrics['maxspeed']
+        assert speed_metrics['occurrences'] == 2, f"Maxspeed occurrences should be 2, got {speed_metrics['occurrences']}"
+        assert speed_metrics['tp'] == 1, f"Maxspeed TP should be 1 ('25 mph' matches '25'), got {speed_metrics['tp']}"
+        assert speed_metrics['fp'] == 1, f"Maxspeed FP should be 1 ('50 km/h' vs '50' mismatch), got {speed_metrics['fp']}"
+        assert speed_metrics['fn'] == 1, f"Maxspeed FN should be 1 ('50 km/h' vs '50' mismatch), got {speed_metrics['fn']}"
+        print("  ✓ Speeds without a unit are compared in mph!")
+
+    # Test Case: Verify turn lanes comparison
+    # osmid 1018: GT turn:lanes="Left | Through", Pred turn:lanes="left|through" → TP (case and spaces ignored)
+    # osmid 1019: GT turn:lanes="left|through|right", Pred turn:lanes="left|through|through" → mismatch,
+    # with partial credit 2/3 (2 of 3 lanes match): 2/3 TP, 1/3 FP and 1/3 FN instead of 1 FP and 1 FN
+    print(f"\nTesting turn lanes comparison (osmid 1018: 'Left | Through' vs 'left|through', "
+          f"osmid 1019: 2 of 3 lanes match):")
+    if 'turn:lanes' in detailed_metrics:
+        turn_lanes_metrics = detailed_metrics['turn:lanes']
+        credit = 2 / 3 if partial_credit else 0
+        assert turn_lanes_metrics['occurrences'] == 2, \
+            f"Turn lanes occurrences should be 2, got {turn_lanes_metrics['occurrences']}"
+        assert approx_equal(turn_lanes_metrics['tp'], 1 + credit), \
+            f"Turn lanes TP should be {1 + credit:.4f}, got {turn_lanes_metrics['tp']}"
+        assert approx_equal(turn_lanes_metrics['fp'], 1 - credit), \
+            f"Turn lanes FP should be {1 - credit:.4f}, got {turn_lanes_metrics['fp']}"
+        assert approx_equal(turn_lanes_metrics['fn'], 1 - credit), \
+            f"Turn lanes FN should be {1 - credit:.4f}, got {turn_lanes_metrics['fn']}"
+        print("  ✓ Turn lanes ignore case and spaces" + (" and mismatches earn partial credit!" if partial_credit else "!"))
+
     # Overall metrics validation
     print(f"\nTesting overall metrics:")
     print(f"  Total TP: {total_tp}")